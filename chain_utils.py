@@ -1,58 +1,265 @@
-import glog as log
+import functools
+import threading
 
+import glog as log
+import httpx
 from langchain.chains.sequential import SequentialChain
+from langchain.embeddings import CacheBackedEmbeddings
 from langchain.prompts import ChatPromptTemplate
+from langchain.storage import LocalFileStore
 from langchain_core.runnables import RunnableLambda, RunnableParallel
 from langchain_core.output_parsers.string import StrOutputParser
 from langchain_core.exceptions import OutputParserException
 
 import output_parsers
 import model_registry
-from chains import filter_chains, summarization_chains, aggregation_chains
+import model_router
+import structured_output
+import thinking
+from review_records import Review
+from chains import filter_chains, sampling_chains, summarization_chains, aggregation_chains
 from prompts import filter_prompts, summarization_prompts, aggregation_prompts
 
 
+# Process-wide pool of model clients keyed by (model, temperature). Clients are thread-safe and keep their HTTP
+# connections alive, so sharing them across games and calls avoids repeated client and connection setup.
+_MODEL_POOL = {}
+_MODEL_POOL_LOCK = threading.Lock()
+
+# Keep pooled Ollama connections open between games instead of httpx's default 5 second expiry
+OLLAMA_CLIENT_KWARGS = {"limits": httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=300)}
+
+# How long Ollama keeps a model loaded after a request (e.g. "30m", -1 for forever); None uses the server default
+OLLAMA_KEEP_ALIVE = None
+
+# Ollama base URLs per model name, "*" for all models; models with several endpoints are load balanced over them
+OLLAMA_ENDPOINTS = {}
+
+# On-disk cache of document embeddings used by get_cached_embedding_model
+EMBEDDING_CACHE_DIR = ".embedding_cache"
+
+
+def _get_pooled(key, factory):
+    with _MODEL_POOL_LOCK:
+        if key not in _MODEL_POOL:
+            _MODEL_POOL[key] = factory()
+        return _MODEL_POOL[key]
+
+
+def clear_model_pool():
+    """Drops all pooled model clients and cached chains, e.g. after changing model_registry at runtime."""
+    with _MODEL_POOL_LOCK:
+        _MODEL_POOL.clear()
+    for cached_factory in [get_blurb_chain, get_filter_chain, get_summarization_chain, get_aggregation_chain]:
+        cached_factory.cache_clear()
+
+
 def get_embedding_model(model, temperature=0.7):
     EmbeddingClass = model_registry.EMBEDDING_CLASS_MAP.get(model)
     if EmbeddingClass is None:
         raise ValueError(f"Unrecognized embedding model: {model}")
-    return EmbeddingClass(model=model, temperature=temperature)
+    return _get_pooled(("embedding", model, temperature), lambda: EmbeddingClass(model=model, temperature=temperature))
+
+
+def get_cached_embedding_model(model, temperature=0.7, cache_dir=EMBEDDING_CACHE_DIR):
+    """Returns an embedding model whose document embeddings are cached on disk, keyed by model and text."""
+    embedder = get_embedding_model(model, temperature=temperature)
+    return _get_pooled(
+        ("cached_embedding", model, temperature, cache_dir),
+        lambda: CacheBackedEmbeddings.from_bytes_store(embedder, LocalFileStore(cache_dir), namespace=model),
+    )
+
+
+def check_ollama_endpoint(base_url, timeout=5):
+    """Health check of an Ollama server: whether it answers its version endpoint."""
+    return httpx.get(f"{base_url.rstrip('/')}/api/version", timeout=timeout).status_code == 200
 
 
 def get_language_model(model, temperature=0.7):
+    """
+    Returns the (pooled) chat model client for a model name. A comma-separated list of model names gives a
+    RoutedChatModel that routes each call to the fastest healthy model of the list and fails over between them.
+    Ollama models served from several endpoints (see OLLAMA_ENDPOINTS) give a RoutedChatModel over the endpoints
+    that sends each call to the endpoint with the fewest requests in flight, and drains failing endpoints until
+    their health check passes.
+    """
+    if "," in model:
+        model_names = [name.strip() for name in model.split(",") if name.strip()]
+        models = [get_language_model(name, temperature=temperature) for name in model_names]
+        return _get_pooled(
+            ("routed", tuple(model_names), temperature), lambda: model_router.RoutedChatModel(models, model_names)
+        )
+
     LLMClass = model_registry.LLM_CLASS_MAP.get(model)
     if LLMClass is None:
         raise ValueError(f"Unrecognized language model: {model}")
-    return LLMClass(model=model, temperature=temperature)
 
+    def _make_model(base_url=None):
+        if LLMClass is model_registry.ChatOllama:
+            return LLMClass(
+                model=model,
+                temperature=temperature,
+                keep_alive=OLLAMA_KEEP_ALIVE,
+                client_kwargs=OLLAMA_CLIENT_KWARGS,
+                base_url=base_url,
+            )
+        return LLMClass(model=model, temperature=temperature)
+
+    endpoints = []
+    if LLMClass is model_registry.ChatOllama:
+        endpoints = OLLAMA_ENDPOINTS.get(model) or OLLAMA_ENDPOINTS.get("*") or []
+    if len(endpoints) <= 1:
+        base_url = endpoints[0] if endpoints else None
+        return _get_pooled(("llm", model, temperature, OLLAMA_KEEP_ALIVE, base_url), lambda: _make_model(base_url))
+
+    members = [
+        _get_pooled(("llm", model, temperature, OLLAMA_KEEP_ALIVE, url), lambda url=url: _make_model(url))
+        for url in endpoints
+    ]
+    return _get_pooled(
+        ("endpoints", model, temperature, OLLAMA_KEEP_ALIVE, tuple(endpoints)),
+        lambda: model_router.RoutedChatModel(
+            members,
+            [f"{model}@{url}" for url in endpoints],
+            # Keep the plain model name, so that cache entries and traces do not depend on the endpoints
+            model=model,
+            policy="least_outstanding",
+            max_error_rate=0.0,
+            min_errors=1,
+            health_checks=[functools.partial(check_ollama_endpoint, url) for url in endpoints],
+        ),
+    )
+
+
+def _wrap_models(llm, wrap):
+    # Wraps every model of a (possibly nested) pool, keeping the pool's routing state
+    if isinstance(llm, model_router.RoutedChatModel):
+        return llm.map_members(lambda member: _wrap_models(member, wrap))
+    return wrap(llm)
 
-def get_blurb(review_text, model="qwen2.5:7b", temperature=0.7):
+
+def _get_leaf_models(llm):
+    if isinstance(llm, model_router.RoutedChatModel):
+        return [leaf for member in llm.models for leaf in _get_leaf_models(member)]
+    return [llm]
+
+
+def get_stage_language_model(model, temperature=0.7, thinking_budget=0):
     """
-    Generates a blurb for a given review text using the specified language model.
+    Returns the chat model for a stage and whether the stage should let it think.
+
+    Thinking models (model_registry.THINKING_MODELS) only think when given a thinking budget: a positive budget
+    bounds their reasoning to about that many tokens with thinking.ThinkingBudgetChatModel, and -1 lets them think
+    without a bound. Other models, and thinking models without a budget, are returned as is and get /no_think.
+    """
+    model_names = [name.strip() for name in model.split(",") if name.strip()]
+    llm = get_language_model(model, temperature=temperature)
+    if not thinking_budget or not all(name in model_registry.THINKING_MODELS for name in model_names):
+        return llm, False
+    if thinking_budget < 0:
+        return llm, True
+
+    # Bound every member of a routed pool, since the router itself does not stream
+    return (
+        _get_pooled(
+            ("thinking", model, temperature, thinking_budget, OLLAMA_KEEP_ALIVE),
+            lambda: _wrap_models(
+                llm, lambda member: thinking.ThinkingBudgetChatModel(llm=member, budget_tokens=thinking_budget)
+            ),
+        ),
+        True,
+    )
+
+
+def get_native_structured_model(model, temperature, output_parser, schema_name):
+    """
+    Returns the chat model for a stage constrained to the stage's output schema by its provider, together with the
+    output parser to use with it (short format instructions, plain JSON parsing). Falls back to the plain model and
+    the given parser if any model of the (possibly routed) pool has no native structured output.
+    """
+    llm = get_language_model(model, temperature=temperature)
+    leaf_models = _get_leaf_models(llm)
+    if not all(structured_output.supports_native_structured_output(leaf) for leaf in leaf_models):
+        log.warning(f"No native structured output for {model}, falling back to format instructions")
+        return llm, output_parser
+
+    json_schema = structured_output.get_json_schema(output_parser.response_schemas)
+    structured_llm = _get_pooled(
+        ("structured", model, temperature, schema_name, OLLAMA_KEEP_ALIVE),
+        lambda: _wrap_models(
+            llm,
+            lambda member: structured_output.NativeStructuredChatModel(
+                llm=member, json_schema=json_schema, schema_name=schema_name
+            ),
+        ),
+    )
+    native_parser = output_parsers.NativeStructuredOutputParser(
+        output_parser.response_schemas,
+        include_descriptions=not all(structured_output.shows_schema_to_model(leaf) for leaf in leaf_models),
+    )
+    return structured_llm, native_parser
+
+
+def get_stage_model_and_parser(
+    model, temperature, thinking_budget, output_parser, schema_name, native_structured_output=False
+):
+    """
+    Returns the chat model, whether it should think and the output parser of a stage. Native structured output is
+    only used when the stage does not think, since a schema-constrained response leaves no room for reasoning.
+    """
+    llm, enable_thinking = get_stage_language_model(model, temperature, thinking_budget)
+    if native_structured_output and not enable_thinking:
+        llm, output_parser = get_native_structured_model(model, temperature, output_parser, schema_name)
+    return llm, enable_thinking, output_parser
+
+
+@functools.lru_cache(maxsize=None)
+def get_blurb_chain(model="qwen2.5:7b", temperature=0.7):
+    """
+    Creates (or returns the cached) chain that turns a score breakdown into a blurb.
 
     Args:
-        review_text (str): The review text to generate a blurb for.
         model (str, optional): The language model to use for generating the blurb. Defaults to "qwen2.5:7b".
 
     Returns:
-        str: The generated blurb.
+        Chain: A LangChain chain that takes "review_text" and returns the blurb string.
     """
     blurb_prompt = ChatPromptTemplate.from_template(aggregation_prompts.BLURB_PROMPT)
     llm = get_language_model(model=model, temperature=temperature)
+    return (blurb_prompt | llm | StrOutputParser()).with_config(run_name="blurb", metadata={"stage": "blurb"})
 
-    chain = blurb_prompt | llm | StrOutputParser()
-    output = chain.invoke({"review_text": review_text})
+
+def get_blurb(review_text, model="qwen2.5:7b", temperature=0.7, config=None):
+    """
+    Generates a blurb for a given review text using the specified language model.
+
+    Args:
+        review_text (str): The review text to generate a blurb for.
+        model (str, optional): The language model to use for generating the blurb. Defaults to "qwen2.5:7b".
+        config (RunnableConfig, optional): Config (callbacks, metadata) to invoke the blurb chain with.
+
+    Returns:
+        str: The generated blurb.
+    """
+    chain = get_blurb_chain(model=model, temperature=temperature)
+    output = chain.invoke({"review_text": review_text}, config=config)
     return output
 
 
+async def aget_blurb(review_text, model="qwen2.5:7b", temperature=0.7, config=None):
+    """Async version of get_blurb."""
+    chain = get_blurb_chain(model=model, temperature=temperature)
+    return await chain.ainvoke({"review_text": review_text}, config=config)
+
+
 def club_reviews(reviews_data, batch_size=3):
     """
-    Given a list of Steam review data, return another list with similar dicts,
-    but each dict has clubbed review texts.
+    Given a list of Steam review data, return another list of Review records,
+    but each record has clubbed review texts.
 
-    :param reviews_data: List of review dictionaries
+    :param reviews_data: List (or ReviewBatch) of Review records or review dictionaries
     :param batch_size: Number of reviews to club together
-    :return: Clubbed data as a list of dictionaries
+    :return: Clubbed data as a list of Review records
     """
     if batch_size <= 1:
         log.info("Clubbing batch size is <= 1, no clubbing required, returning original data")
@@ -64,76 +271,181 @@ def club_reviews(reviews_data, batch_size=3):
     for review_batch in review_batches:
         clubbed_recommendation_id = " ".join([review["recommendationid"] for review in review_batch])
         clubbed_review_text = "\n\n".join([review["review"] for review in review_batch])
-        clubbed_data.append(
-            {
-                "recommendationid": clubbed_recommendation_id,
-                "review": clubbed_review_text,
-            }
-        )
+        clubbed_data.append(Review(recommendationid=clubbed_recommendation_id, review=clubbed_review_text))
     log.info(f"Returning {len(clubbed_data)} clubbed reviews")
     return clubbed_data
 
 
-def get_filter_chain(model, temperature=0.7, club_reviews_batch_size=3, include_llm_filter=False):
+def get_stage_stats(stage_output):
+    """Picks the stats (e.g. normalization_stats) that stages add to their outputs, to carry them downstream."""
+    return {key: value for key, value in stage_output.items() if key.endswith("_stats")}
+
+
+@functools.lru_cache(maxsize=None)
+def get_filter_chain(
+    model,
+    temperature=0.7,
+    club_reviews_batch_size=3,
+    include_llm_filter=False,
+    normalize=True,
+    max_review_words=300,
+    sampling_embedding_model=None,
+    max_clusters=40,
+    cluster_distance_threshold=0.15,
+    thinking_budget=0,
+    native_structured_output=False,
+):
     """
-    Creates a filter chain to determine whether reviews should be included based on certain criteria.
+    Creates (or returns the cached) filter chain to determine whether reviews should be included based on certain criteria.
 
     Args:
         model (str): The language model to use for filtering.
         temperature (float, optional): The temperature parameter for the language model. Defaults to 0.0.
+        normalize (bool, optional): Whether to strip markup and noise from review texts before filtering.
+        max_review_words (int, optional): Word cap for normalized reviews, longer ones are shortened by extractive
+            sentence selection. None disables the cap.
+        sampling_embedding_model (str, optional): If set, filtered reviews are embedded with this model (through
+            the on-disk embedding cache) and clustered, and only one representative per cluster is kept.
+        max_clusters (int, optional): Upper bound on the number of clusters (and thus representatives) per game.
+            Below it, the number of clusters is chosen by silhouette score, see sampling_chains.choose_num_clusters.
+        cluster_distance_threshold (float, optional): Cosine distance within which reviews count as near-duplicates.
+        thinking_budget (int, optional): Reasoning token budget of the LLM filter, see get_stage_language_model.
+        native_structured_output (bool, optional): Whether to constrain LLM filter responses to the output schema
+            through the provider instead of format instructions, see get_native_structured_model.
 
     Returns:
-        Chain: A LangChain chain that includes deterministic filtering and LLM-based filtering.
+        Chain: A LangChain chain that includes normalization, deterministic filtering, cluster sampling and
+            LLM-based filtering.
     """
-    deterministic_filter = filter_chains.DeterministicFilterChain() | RunnableLambda(
-        lambda x: {"filtered_reviews": club_reviews(x["filtered_reviews"], club_reviews_batch_size)}
+    deterministic_filter = filter_chains.DeterministicFilterChain()
+    if sampling_embedding_model:
+        deterministic_filter = deterministic_filter | sampling_chains.ClusterSamplingChain(
+            get_cached_embedding_model(sampling_embedding_model),
+            max_clusters=max_clusters,
+            distance_threshold=cluster_distance_threshold,
+        )
+    deterministic_filter = deterministic_filter | RunnableLambda(
+        lambda x: {
+            "filtered_reviews": club_reviews(x["filtered_reviews"], club_reviews_batch_size),
+            **get_stage_stats(x),
+        }
     )
+    if normalize:
+        deterministic_filter = filter_chains.NormalizationChain(max_review_words=max_review_words) | deterministic_filter
 
     if include_llm_filter:
+        filter_llm, enable_thinking, filter_parser = get_stage_model_and_parser(
+            model, temperature, thinking_budget, output_parsers.FILTER_CHAIN_PARSER, "filter", native_structured_output
+        )
         llm_filter = filter_chains.LLMFilterChain(
-            get_language_model(model=model, temperature=temperature),
-            output_parser=output_parsers.FILTER_CHAIN_PARSER,
+            filter_llm,
+            output_parser=filter_parser,
             prompt_template=filter_prompts.FLUFF_FILTER_PROMPT,
+            enable_thinking=enable_thinking,
+        )
+        remap_output = RunnableLambda(lambda x: {"reviews": x["filtered_reviews"], **get_stage_stats(x)})
+        return (deterministic_filter | remap_output | llm_filter).with_config(
+            run_name="filter", metadata={"stage": "filter"}
         )
-        remap_output = RunnableLambda(lambda x: {"reviews": x["filtered_reviews"]})
-        return deterministic_filter | remap_output | llm_filter
 
-    return deterministic_filter
+    return deterministic_filter.with_config(run_name="filter", metadata={"stage": "filter"})
 
 
-def get_summarization_chain(model, temperature=0.7, batch_size=12):
+@functools.lru_cache(maxsize=None)
+def get_summarization_chain(
+    model,
+    temperature=0.7,
+    batch_size=12,
+    thinking_budget=0,
+    native_structured_output=False,
+    num_retries=2,
+    min_success_rate=1.0,
+):
     """
-    Creates a summarization chain to generate summaries of the filtered reviews.
+    Creates (or returns the cached) summarization chain to generate summaries of the filtered reviews.
 
     Args:
         model (str): The language model to use for summarization.
         temperature (float, optional): The temperature parameter for the language model. Defaults to 0.0.
+        thinking_budget (int, optional): Reasoning token budget per summary, see get_stage_language_model.
+        native_structured_output (bool, optional): Whether to constrain summaries to the output schema through the
+            provider instead of format instructions, see get_native_structured_model.
+        num_retries (int, optional): Retries of failed summary batches. Only the failed batches are rerun.
+        min_success_rate (float, optional): Fraction of batches that must succeed (after retries) for the chain to
+            proceed without the failed ones, otherwise it raises the error of the first failed batch.
 
     Returns:
         Chain: A LangChain chain that performs LLM-based summarization of reviews.
     """
-    summary_llm = get_language_model(model=model, temperature=temperature)
+    summary_llm, enable_thinking, summary_parser = get_stage_model_and_parser(
+        model,
+        temperature,
+        thinking_budget,
+        output_parsers.JUICE_SUMMARIZATION_CHAIN_PARSER,
+        "summarization",
+        native_structured_output,
+    )
     summarization_chain = summarization_chains.SummarizationChain(
         summary_llm,
-        output_parser=output_parsers.JUICE_SUMMARIZATION_CHAIN_PARSER,
+        output_parser=summary_parser,
         prompt_template=summarization_prompts.JUICE_SUMMARIZATION_PROMPT,
         batch_size=batch_size,
+        enable_thinking=enable_thinking,
+        num_retries=num_retries,
+        min_success_rate=min_success_rate,
     )
-    return summarization_chain
+    return summarization_chain.with_config(run_name="summarization", metadata={"stage": "summarization"})
 
 
-def get_aggregation_chain(model, temperature=0.7, num_retries=2):
+@functools.lru_cache(maxsize=None)
+def get_aggregation_chain(
+    model,
+    temperature=0.7,
+    num_retries=2,
+    passthrough_keys=("normalization_stats", "sampling_stats", "summarization_stats"),
+    thinking_budget=0,
+    native_structured_output=False,
+    cascade_model=None,
+    cascade_borderline_scores=(5, 6),
+    cascade_audit_fraction=0.05,
+):
     """
-    Creates an aggregation chain to generate summaries of the filtered reviews for each aspect.
+    Creates (or returns the cached) aggregation chain to generate summaries of the filtered reviews for each aspect.
 
     Args:
         model (str): The language model to use for aggregation.
         temperature (float, optional): The temperature parameter for the language model. Defaults to 0.0.
+        passthrough_keys (tuple, optional): Input keys copied to the output as is (None when missing), so that
+            stats gathered by earlier stages end up in the chain output.
+        thinking_budget (int, optional): Reasoning token budget per aspect score, see get_stage_language_model.
+        native_structured_output (bool, optional): Whether to constrain aspect scores to the output schema through
+            the provider instead of format instructions, see get_native_structured_model.
+        cascade_model (str, optional): If set, this (smaller) model scores every aspect first and model is only
+            used when the cascade escalates, see aggregation_chains.CascadeAggregationChain. The output then
+            includes "cascade_stats".
+        cascade_borderline_scores (tuple, optional): Scores of the cascade model that are always escalated.
+        cascade_audit_fraction (float, optional): Fraction of aspect scores escalated to compare both models.
 
     Returns:
         Chain: A LangChain chain that performs LLM-based aggregation of review summaries and output parsing.
     """
-    aggregation_llm = get_language_model(model=model, temperature=temperature)
+    aggregation_llm, enable_thinking, aggregation_parser = get_stage_model_and_parser(
+        model,
+        temperature,
+        thinking_budget,
+        output_parsers.JUICE_AGGREGATION_CHAIN_PARSER,
+        "aggregation",
+        native_structured_output,
+    )
+    if cascade_model:
+        cascade_llm, _, cascade_parser = get_stage_model_and_parser(
+            cascade_model,
+            temperature,
+            0,
+            output_parsers.JUICE_AGGREGATION_CASCADE_CHAIN_PARSER,
+            "aggregation_cascade",
+            native_structured_output,
+        )
     aspects = list(aggregation_prompts.JUICE_AGGREGATION_PROMPTS.keys())
     aggregation_branches = {}
     for aspect in aspects:
@@ -142,16 +454,36 @@ def get_aggregation_chain(model, temperature=0.7, num_retries=2):
         )
         chain = aggregation_chains.AggregationChain(
             aggregation_llm,
-            output_parser=output_parsers.JUICE_AGGREGATION_CHAIN_PARSER,
+            output_parser=aggregation_parser,
             prompt_template=aggregation_prompts.JUICE_AGGREGATION_PROMPTS[aspect],
+            enable_thinking=enable_thinking,
         ).with_retry(stop_after_attempt=num_retries, retry_if_exception_type=[OutputParserException])
-        aggregation_branches[aspect] = remap_input | chain
+        if cascade_model:
+            # No retries for the cascade model, a parse failure escalates to the large model instead
+            chain = aggregation_chains.CascadeAggregationChain(
+                aggregation_chains.AggregationChain(
+                    cascade_llm,
+                    output_parser=cascade_parser,
+                    prompt_template=aggregation_prompts.JUICE_AGGREGATION_PROMPTS[aspect],
+                ),
+                chain,
+                borderline_scores=tuple(cascade_borderline_scores),
+                audit_fraction=cascade_audit_fraction,
+            )
+        aggregation_branches[aspect] = (remap_input | chain).with_config(
+            run_name=f"aggregation.{aspect}", metadata={"aspect": aspect}
+        )
 
-    aggregation_chain = RunnableParallel(branches=aggregation_branches)
-    return aggregation_chain
+    passthrough = {key: RunnableLambda((lambda y: (lambda x: x.get(y)))(key)) for key in passthrough_keys}
+    aggregation_chain = RunnableParallel(branches=aggregation_branches, **passthrough)
+    if cascade_model:
+        aggregation_chain = aggregation_chain | RunnableLambda(
+            lambda x: {**x, "cascade_stats": aggregation_chains.get_cascade_stats(x["branches"])}
+        )
+    return aggregation_chain.with_config(run_name="aggregation", metadata={"stage": "aggregation"})
 
 
-def make_complete_chain(
+def make_stage_chains(
     filter_model="gemma3:4b",
     summarization_model="qwen2.5:7b",
     aggregation_model="gemma3:12b",
@@ -159,27 +491,91 @@ def make_complete_chain(
     temperature=0.7,
     club_reviews_batch_size=3,
     include_llm_filter=False,
+    normalize=True,
+    max_review_words=300,
+    sampling_embedding_model=None,
+    max_clusters=40,
+    thinking_budgets=None,
+    native_structured_output=False,
+    cascade_model=None,
+    cascade_borderline_scores=(5, 6),
+    cascade_audit_fraction=0.05,
+    summarization_retries=2,
+    summarization_quorum=1.0,
+    interim_aggregation_model=None,
 ):
     """
-    Creates a complete chain that filters, summarizes, and aggregates reviews using specified language models.
+    Creates the filter, summarization and aggregation stages as separate chains, for callers that need to run
+    stages individually (e.g. adaptive sampling, which summarizes in rounds and aggregates in between).
 
     Args:
         filter_model (str): The language model to use for filtering reviews.
         summarization_model (str): The language model to use for summarizing reviews.
         aggregation_model (str): The language model to use for aggregating review summaries.
+        thinking_budgets (dict, optional): Reasoning token budget per stage name ("filter", "summarization",
+            "aggregation") for thinking models, see get_stage_language_model. Stages without one do not think.
+        native_structured_output (bool): Whether LLM stages use the providers' structured output instead of format
+            instructions, see get_native_structured_model.
+        cascade_model (str, optional): Small model that scores aspects before aggregation_model, see
+            get_aggregation_chain.
+        summarization_retries (int): Retries of failed summary batches, see get_summarization_chain.
+        summarization_quorum (float): Fraction of summary batches that must succeed, see get_summarization_chain.
+        interim_aggregation_model (str, optional): Model of the interim aggregations of adaptive runs, configured
+            like the aggregation chain so that interim scores are comparable to the final ones.
 
     Returns:
-        Chain: A LangChain chain that filters, summarizes, and aggregates reviews based on the specified models.
+        dict: The "filter", "summarization" and "aggregation" chains, and the "interim_aggregation" chain (None
+            without interim_aggregation_model).
     """
+    thinking_budgets = thinking_budgets or {}
     filter_chain = get_filter_chain(
         filter_model,
         temperature=temperature,
         club_reviews_batch_size=club_reviews_batch_size,
         include_llm_filter=include_llm_filter,
+        normalize=normalize,
+        max_review_words=max_review_words,
+        sampling_embedding_model=sampling_embedding_model,
+        max_clusters=max_clusters,
+        thinking_budget=thinking_budgets.get("filter", 0),
+        native_structured_output=native_structured_output,
     )
     summarization_chain = get_summarization_chain(
-        summarization_model, temperature=temperature, batch_size=summarization_batch_size
+        summarization_model,
+        temperature=temperature,
+        batch_size=summarization_batch_size,
+        thinking_budget=thinking_budgets.get("summarization", 0),
+        native_structured_output=native_structured_output,
+        num_retries=summarization_retries,
+        min_success_rate=summarization_quorum,
     )
-    aggregation_chain = get_aggregation_chain(aggregation_model, temperature=temperature)
-    complete_chain = filter_chain | summarization_chain | aggregation_chain
+    aggregation_chains = {
+        stage: get_aggregation_chain(
+            model,
+            temperature=temperature,
+            thinking_budget=thinking_budgets.get("aggregation", 0),
+            native_structured_output=native_structured_output,
+            cascade_model=cascade_model,
+            cascade_borderline_scores=tuple(cascade_borderline_scores),
+            cascade_audit_fraction=cascade_audit_fraction,
+        )
+        if model
+        else None
+        for stage, model in [("aggregation", aggregation_model), ("interim_aggregation", interim_aggregation_model)]
+    }
+    return {"filter": filter_chain, "summarization": summarization_chain, **aggregation_chains}
+
+
+def make_complete_chain(**kwargs):
+    """
+    Creates a complete chain that filters, summarizes, and aggregates reviews using specified language models.
+
+    Args:
+        **kwargs: Same arguments as make_stage_chains.
+
+    Returns:
+        Chain: A LangChain chain that filters, summarizes, and aggregates reviews based on the specified models.
+    """
+    stage_chains = make_stage_chains(**kwargs)
+    complete_chain = stage_chains["filter"] | stage_chains["summarization"] | stage_chains["aggregation"]
     return complete_chain
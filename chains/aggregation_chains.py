@@ -1,9 +1,33 @@
-from typing import List, Dict, Any
+import hashlib
+import math
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple
 
+import glog as log
+
+from langchain.callbacks.manager import AsyncCallbackManagerForChainRun, CallbackManagerForChainRun
 from langchain.chains.base import Chain
 from langchain.llms.base import BaseLanguageModel
 from langchain.output_parsers import StructuredOutputParser
 from langchain.prompts import ChatPromptTemplate
+from langchain_core.exceptions import OutputParserException
+from langchain_core.runnables import Runnable
+from pydantic import PrivateAttr
+
+
+def parse_score(score):
+    """
+    Parses a model score leniently, since models don't always stick to integers. Returns None if unparseable.
+
+    >>> parse_score("7.5"), parse_score(8), parse_score("n/a")
+    (7.5, 8.0, None)
+    """
+    try:
+        score = float(score)
+    except (TypeError, ValueError):
+        return None
+    return score if math.isfinite(score) else None
+
 
 class AggregationChain(Chain):
     llm: BaseLanguageModel
@@ -11,6 +35,9 @@ class AggregationChain(Chain):
     output_parser: StructuredOutputParser
     enable_thinking: bool
 
+    _llm_chain: Runnable = PrivateAttr(default=None)
+    _format_instructions: str = PrivateAttr(default="")
+
     @property
     def input_keys(self) -> List[str]:
         return ["batch_summaries", "summary_aspect"]
@@ -36,17 +63,155 @@ class AggregationChain(Chain):
         self.prompt_template = prompt_template
         self.output_parser = output_parser
         self.enable_thinking = enable_thinking
-
-    def _call(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
-        summary_aspect = inputs["summary_aspect"]
-        summaries = [x[summary_aspect] for x in inputs["batch_summaries"]]
         prompt = ChatPromptTemplate([
             ("system", "" if self.enable_thinking else "/no_think"),
             ("human", self.prompt_template)
         ])
-        format_instructions = self.output_parser.get_format_instructions()
-        chain = prompt | self.llm | self.output_parser
-        
-        return chain.invoke(
-            {"summary_texts": '\n\n'.join(summaries), "format_instructions": format_instructions}
+        self._llm_chain = prompt | self.llm | self.output_parser
+        self._format_instructions = self.output_parser.get_format_instructions()
+
+    def _make_input(self, inputs):
+        summary_aspect = inputs["summary_aspect"]
+        summaries = [x[summary_aspect] for x in inputs["batch_summaries"]]
+        return {"summary_texts": '\n\n'.join(summaries), "format_instructions": self._format_instructions}
+
+    def _call(
+        self, inputs: Dict[str, Any], run_manager: Optional[CallbackManagerForChainRun] = None
+    ) -> Dict[str, Any]:
+        return self._llm_chain.invoke(
+            self._make_input(inputs),
+            config={"callbacks": run_manager.get_child() if run_manager else None},
+        )
+
+    async def _acall(
+        self, inputs: Dict[str, Any], run_manager: Optional[AsyncCallbackManagerForChainRun] = None
+    ) -> Dict[str, Any]:
+        return await self._llm_chain.ainvoke(
+            self._make_input(inputs),
+            config={"callbacks": run_manager.get_child() if run_manager else None},
         )
+
+
+class CascadeAggregationChain(Chain):
+    """
+    Scores an aspect with a small model first and escalates to a large model only when needed: when the small model
+    fails (e.g. on a timeout or rate limit, reason "small_model_error") or its output fails to parse, when its score
+    is borderline (within half a point of borderline_scores), when it rates its own confidence as low, or for a
+    deterministic audit sample (audit_fraction) of all inputs. Audited inputs keep both scores, which is what the
+    agreement stats of get_cascade_stats are computed from. The output has the same keys as AggregationChain plus
+    "cascade", describing which model scored and why.
+    """
+
+    small_chain: Chain
+    large_chain: Runnable
+    borderline_scores: Tuple[int, ...] = (5, 6)
+    audit_fraction: float = 0.05
+
+    @property
+    def input_keys(self) -> List[str]:
+        return ["batch_summaries", "summary_aspect"]
+
+    @property
+    def output_keys(self) -> List[str]:
+        return ["aggregate_score", "score_explanation", "cascade"]
+
+    def __init__(
+        self,
+        small_chain: Chain,
+        large_chain: Runnable,
+        borderline_scores: Tuple[int, ...] = (5, 6),
+        audit_fraction: float = 0.05,
+    ):
+        super().__init__(
+            small_chain=small_chain,
+            large_chain=large_chain,
+            borderline_scores=borderline_scores,
+            audit_fraction=audit_fraction,
+        )
+
+    def _is_audited(self, inputs):
+        # Hash the inputs rather than drawing a random number, so that reruns (and the LLM cache) audit the same inputs
+        summaries = "\n\n".join(x[inputs["summary_aspect"]] for x in inputs["batch_summaries"])
+        digest = hashlib.sha256(f"{inputs['summary_aspect']}\0{summaries}".encode()).digest()
+        return int.from_bytes(digest[:4], "big") / 2**32 < self.audit_fraction
+
+    def _get_escalation_reason(self, small_output, small_error, inputs):
+        if small_error is not None and not isinstance(small_error, OutputParserException):
+            log.warning(f"Cascade model failed, escalating: {type(small_error).__name__}: {small_error}")
+            return "small_model_error"
+        small_score = parse_score(small_output["aggregate_score"]) if small_output is not None else None
+        if small_score is None:
+            return "parse_failure"
+        if any(abs(small_score - score) <= 0.5 for score in self.borderline_scores):
+            return "borderline"
+        if str(small_output.get("confidence", "")).strip().lower() == "low":
+            return "low_confidence"
+        if self._is_audited(inputs):
+            return "audit"
+        return None
+
+    @staticmethod
+    def _make_output(small_output, large_output, reason):
+        output = small_output if reason is None else large_output
+        return {
+            "aggregate_score": output["aggregate_score"],
+            "score_explanation": output["score_explanation"],
+            "cascade": {
+                "escalated": reason is not None,
+                "reason": reason,
+                "small_score": small_output["aggregate_score"] if small_output is not None else None,
+                "large_score": large_output["aggregate_score"] if large_output is not None else None,
+            },
+        }
+
+    def _call(
+        self, inputs: Dict[str, Any], run_manager: Optional[CallbackManagerForChainRun] = None
+    ) -> Dict[str, Any]:
+        config = {"callbacks": run_manager.get_child() if run_manager else None}
+        small_error = None
+        try:
+            small_output = self.small_chain.invoke(inputs, config=config)
+        except Exception as e:
+            small_output, small_error = None, e
+        reason = self._get_escalation_reason(small_output, small_error, inputs)
+        large_output = self.large_chain.invoke(inputs, config=config) if reason is not None else None
+        return self._make_output(small_output, large_output, reason)
+
+    async def _acall(
+        self, inputs: Dict[str, Any], run_manager: Optional[AsyncCallbackManagerForChainRun] = None
+    ) -> Dict[str, Any]:
+        config = {"callbacks": run_manager.get_child() if run_manager else None}
+        small_error = None
+        try:
+            small_output = await self.small_chain.ainvoke(inputs, config=config)
+        except Exception as e:
+            small_output, small_error = None, e
+        reason = self._get_escalation_reason(small_output, small_error, inputs)
+        large_output = await self.large_chain.ainvoke(inputs, config=config) if reason is not None else None
+        return self._make_output(small_output, large_output, reason)
+
+
+def get_cascade_stats(branches):
+    """
+    Summarizes the cascades of all aspects of a game: how many were escalated and why, and how well the small
+    and large models agree on the aspects both of them scored. Scores that don't parse are left out of the
+    comparison.
+
+    >>> get_cascade_stats({"gameplay": {"cascade": {"escalated": True, "reason": "audit", "small_score": "7.5",
+    ...     "large_score": 7}}})["num_within_1"]
+    1
+    """
+    cascades = [branch["cascade"] for branch in branches.values() if branch.get("cascade")]
+    compared = [
+        (parse_score(cascade["small_score"]), parse_score(cascade["large_score"])) for cascade in cascades
+    ]
+    compared = [(small, large) for small, large in compared if small is not None and large is not None]
+    return {
+        "num_aspects": len(cascades),
+        "num_escalated": sum(cascade["escalated"] for cascade in cascades),
+        "escalation_reasons": dict(Counter(cascade["reason"] for cascade in cascades if cascade["reason"])),
+        "num_compared": len(compared),
+        "num_exact_agreement": sum(small == large for small, large in compared),
+        "num_within_1": sum(abs(small - large) <= 1 for small, large in compared),
+        "total_abs_difference": sum(abs(small - large) for small, large in compared),
+    }
@@ -1,10 +1,76 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
+import glog as log
+from langchain.callbacks.manager import AsyncCallbackManagerForChainRun, CallbackManagerForChainRun
 from langchain.chains.base import Chain
 from langchain.llms.base import BaseLanguageModel
 from langchain.output_parsers import StructuredOutputParser
 from langchain.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable
+from pydantic import PrivateAttr
 from prompts import filter_prompts
+from review_records import Review, get_playtime_at_review
+from text_utils import approx_token_count, select_sentences, strip_markup_and_noise
+
+
+class NormalizationChain(Chain):
+    """
+    Strips BBCode, URLs, emoji/character runs and ASCII art from review texts and caps overly long reviews by
+    extractive sentence selection. Outputs normalized copies of the reviews along with token savings stats.
+    """
+
+    max_review_words: Optional[int]
+
+    @property
+    def input_keys(self) -> List[str]:
+        return ["reviews"]
+
+    @property
+    def output_keys(self) -> List[str]:
+        return ["reviews", "normalization_stats"]
+
+    def __init__(self, max_review_words: Optional[int] = 300):
+        super().__init__(max_review_words=max_review_words)
+        self.max_review_words = max_review_words
+
+    def normalize_text(self, review_text: str) -> str:
+        review_text = strip_markup_and_noise(review_text)
+        if self.max_review_words:
+            review_text = select_sentences(review_text, self.max_review_words)
+        return review_text
+
+    def _call(
+        self, inputs: Dict[str, Any], run_manager: Optional[CallbackManagerForChainRun] = None
+    ) -> Dict[str, Any]:
+        normalized_reviews = []
+        tokens_before = tokens_after = 0
+        for review_data in inputs["reviews"]:
+            # Work on copies so that raw reviews held by the caller stay untouched
+            if isinstance(review_data, dict):
+                review = Review.from_steam(review_data)
+            else:
+                review = Review(**review_data.to_dict())
+            tokens_before += approx_token_count(review.review)
+            review.review = self.normalize_text(review.review)
+            tokens_after += approx_token_count(review.review)
+            normalized_reviews.append(review)
+
+        stats = {
+            "num_reviews": len(normalized_reviews),
+            "tokens_before": tokens_before,
+            "tokens_after": tokens_after,
+            "tokens_saved": tokens_before - tokens_after,
+        }
+        log.info(
+            f"Normalization saved ~{stats['tokens_saved']} of ~{tokens_before} tokens "
+            f"across {len(normalized_reviews)} reviews"
+        )
+        return {"reviews": normalized_reviews, "normalization_stats": stats}
+
+    async def _acall(
+        self, inputs: Dict[str, Any], run_manager: Optional[AsyncCallbackManagerForChainRun] = None
+    ) -> Dict[str, Any]:
+        return self._call(inputs)
 
 
 class DeterministicFilterChain(Chain):
@@ -31,10 +97,12 @@ class DeterministicFilterChain(Chain):
 
     def is_playtime_too_low(self, review_data: Dict[str, Any]) -> bool:
         # less than 10 minutes is too low for a juicy game
-        playtime = review_data.get("author", {}).get("playtime_at_review", 36000)
+        playtime = get_playtime_at_review(review_data, default=36000)
         return playtime < self.min_playtime
 
-    def _call(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+    def _call(
+        self, inputs: Dict[str, Any], run_manager: Optional[CallbackManagerForChainRun] = None
+    ) -> Dict[str, Any]:
         filtered_reviews = []
         for review_data in inputs["reviews"]:
             if not self.is_review_too_small(review_data["review"]) and not self.is_playtime_too_low(review_data):
@@ -43,6 +111,11 @@ class DeterministicFilterChain(Chain):
             return {"filtered_reviews": inputs["reviews"]}
         return {"filtered_reviews": filtered_reviews}
 
+    async def _acall(
+        self, inputs: Dict[str, Any], run_manager: Optional[AsyncCallbackManagerForChainRun] = None
+    ) -> Dict[str, Any]:
+        return self._call(inputs)
+
 
 class LLMFilterChain(Chain):
     llm: BaseLanguageModel
@@ -50,6 +123,9 @@ class LLMFilterChain(Chain):
     output_parser: StructuredOutputParser
     enable_thinking: bool
 
+    _llm_chain: Runnable = PrivateAttr(default=None)
+    _format_instructions: str = PrivateAttr(default="")
+
     @property
     def input_keys(self) -> List[str]:
         return ["reviews"]
@@ -75,29 +151,43 @@ class LLMFilterChain(Chain):
         self.prompt_template = prompt_template
         self.output_parser = output_parser
         self.enable_thinking = enable_thinking
-
-    def _call(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
-        reviews = inputs["reviews"]
         prompt = ChatPromptTemplate([
             ("system", "" if self.enable_thinking else "/no_think"),
             ("human", self.prompt_template),
         ])
-        format_instructions = self.output_parser.get_format_instructions()
-        filter_chain = prompt | self.llm | self.output_parser
+        self._llm_chain = prompt | self.llm | self.output_parser
+        self._format_instructions = self.output_parser.get_format_instructions()
 
-        filtered_reviews = []
-        batch_inputs = []
+    def _make_batch_inputs(self, reviews):
+        return [
+            {"review_text": review_data["review"], "format_instructions": self._format_instructions}
+            for review_data in reviews
+        ]
 
-        for review_data in reviews:
-            batch_inputs.append(
-                {"review_text": review_data["review"], "format_instructions": format_instructions}
-            )
-
-        outputs = filter_chain.batch(batch_inputs)
+    @staticmethod
+    def _keep_genuine_reviews(reviews, outputs):
         assert len(outputs) == len(reviews)
+        filtered_reviews = []
         for review_data, output in zip(reviews, outputs):
             if " " in output["clean_review_text"]:
                 review_data["review"] = output["clean_review_text"]
                 filtered_reviews.append(review_data)
-
         return {"filtered_reviews": filtered_reviews}
+
+    def _call(
+        self, inputs: Dict[str, Any], run_manager: Optional[CallbackManagerForChainRun] = None
+    ) -> Dict[str, Any]:
+        reviews = inputs["reviews"]
+        outputs = self._llm_chain.batch(
+            self._make_batch_inputs(reviews), config={"callbacks": run_manager.get_child() if run_manager else None}
+        )
+        return self._keep_genuine_reviews(reviews, outputs)
+
+    async def _acall(
+        self, inputs: Dict[str, Any], run_manager: Optional[AsyncCallbackManagerForChainRun] = None
+    ) -> Dict[str, Any]:
+        reviews = inputs["reviews"]
+        outputs = await self._llm_chain.abatch(
+            self._make_batch_inputs(reviews), config={"callbacks": run_manager.get_child() if run_manager else None}
+        )
+        return self._keep_genuine_reviews(reviews, outputs)
@@ -0,0 +1,183 @@
+from typing import List, Dict, Any, Optional
+
+import glog as log
+import numpy as np
+from langchain.callbacks.manager import AsyncCallbackManagerForChainRun, CallbackManagerForChainRun
+from langchain.chains.base import Chain
+from langchain_core.embeddings import Embeddings
+from prompts import summarization_prompts
+from review_records import Review, get_playtime_at_review
+
+
+def kmeans(vectors: np.ndarray, max_clusters: int, distance_threshold: float, num_iterations: int = 20, seed: int = 0):
+    """
+    Spherical k-means with k-means++ seeding on L2-normalized vectors. Seeding stops early once every vector is
+    within distance_threshold (cosine distance) of a center, so near-duplicates never get clusters of their own.
+
+    Returns:
+        tuple: (labels, centers) with one label per vector.
+    """
+    rng = np.random.default_rng(seed)
+    centers = [vectors[rng.integers(len(vectors))]]
+    distances = 1.0 - vectors @ centers[0]
+    while len(centers) < max_clusters and distances.max() > distance_threshold:
+        weights = np.clip(distances, 0.0, None) ** 2
+        centers.append(vectors[rng.choice(len(vectors), p=weights / weights.sum())])
+        distances = np.minimum(distances, 1.0 - vectors @ centers[-1])
+    centers = np.stack(centers)
+
+    labels = None
+    for _ in range(num_iterations):
+        new_labels = np.argmax(vectors @ centers.T, axis=1)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        for k in range(len(centers)):
+            members = vectors[labels == k]
+            if len(members):
+                center = members.sum(axis=0)
+                centers[k] = center / (np.linalg.norm(center) or 1.0)
+    return labels, centers
+
+
+def silhouette_score(vectors: np.ndarray, labels: np.ndarray) -> float:
+    """Mean silhouette coefficient of a clustering of L2-normalized vectors under cosine distance."""
+    distances = 1.0 - vectors @ vectors.T
+    sizes = np.bincount(labels, minlength=labels.max() + 1)
+    # Mean distance of every vector to the members of each cluster, excluding itself from its own cluster
+    cluster_distances = np.stack([distances[:, labels == k].sum(axis=1) for k in range(len(sizes))], axis=1)
+    own = cluster_distances[np.arange(len(vectors)), labels] / np.maximum(sizes[labels] - 1, 1)
+    cluster_distances /= np.maximum(sizes, 1)
+    cluster_distances[np.arange(len(vectors)), labels] = np.inf
+    cluster_distances[:, sizes == 0] = np.inf
+    nearest = cluster_distances.min(axis=1)
+    scores = (nearest - own) / np.maximum(np.maximum(own, nearest), 1e-12)
+    scores[sizes[labels] == 1] = 0.0
+    return float(scores.mean())
+
+
+def choose_num_clusters(
+    vectors: np.ndarray,
+    max_clusters: int,
+    distance_threshold: float,
+    min_silhouette: float = 0.05,
+    sample_size: int = 1000,
+    seed: int = 0,
+):
+    """
+    Picks the number of clusters with the best silhouette score among a geometric grid of candidates up to
+    max_clusters, clustering a sample of at most sample_size vectors. If no candidate reaches min_silhouette the
+    data has no cluster structure to exploit, and max_clusters is used.
+
+    Returns:
+        tuple: (num_clusters, silhouette) with the silhouette score of the chosen number of clusters.
+    """
+    rng = np.random.default_rng(seed)
+    if len(vectors) > sample_size:
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    best_num_clusters, best_silhouette = max_clusters, None
+    for num_clusters in np.unique(np.geomspace(2, max(max_clusters, 2), num=10).round().astype(int)):
+        if num_clusters > min(max_clusters, len(vectors) - 1):
+            break
+        labels, centers = kmeans(vectors, num_clusters, distance_threshold, seed=seed)
+        if len(centers) < 2:
+            return 1, None
+        silhouette = silhouette_score(vectors, labels)
+        if best_silhouette is None or silhouette > best_silhouette:
+            best_num_clusters, best_silhouette = len(centers), silhouette
+        if len(centers) < num_clusters:
+            # Every vector is within distance_threshold of a center, more clusters would only split near-duplicates
+            break
+    if best_silhouette is None or best_silhouette < min_silhouette:
+        return max_clusters, best_silhouette
+    return best_num_clusters, best_silhouette
+
+
+class ClusterSamplingChain(Chain):
+    """
+    Embeds the filtered reviews, clusters them and keeps only the review closest to each cluster center. Every
+    representative is prefixed with the size of its cluster so that downstream prompts can weigh it accordingly.
+    The number of clusters is chosen from the data with choose_num_clusters; sampling_stats records whether
+    max_clusters was reached rather than the data deciding it.
+    """
+
+    embedder: Embeddings
+    max_clusters: int
+    distance_threshold: float
+    min_reviews: int
+
+    @property
+    def input_keys(self) -> List[str]:
+        return ["filtered_reviews"]
+
+    @property
+    def output_keys(self) -> List[str]:
+        return ["filtered_reviews", "sampling_stats"]
+
+    def __init__(
+        self, embedder: Embeddings, max_clusters: int = 40, distance_threshold: float = 0.15, min_reviews: int = 50
+    ):
+        super().__init__(
+            embedder=embedder, max_clusters=max_clusters, distance_threshold=distance_threshold, min_reviews=min_reviews
+        )
+        self.embedder = embedder
+        self.max_clusters = max_clusters
+        self.distance_threshold = distance_threshold
+        self.min_reviews = min_reviews
+
+    def _call(
+        self, inputs: Dict[str, Any], run_manager: Optional[CallbackManagerForChainRun] = None
+    ) -> Dict[str, Any]:
+        reviews = inputs["filtered_reviews"]
+        if len(reviews) < self.min_reviews:
+            return {"filtered_reviews": reviews, "sampling_stats": {"num_reviews": len(reviews), "num_clusters": None}}
+        return self._sample(reviews, self.embedder.embed_documents([review["review"] for review in reviews]))
+
+    async def _acall(
+        self, inputs: Dict[str, Any], run_manager: Optional[AsyncCallbackManagerForChainRun] = None
+    ) -> Dict[str, Any]:
+        reviews = inputs["filtered_reviews"]
+        if len(reviews) < self.min_reviews:
+            return {"filtered_reviews": reviews, "sampling_stats": {"num_reviews": len(reviews), "num_clusters": None}}
+        return self._sample(reviews, await self.embedder.aembed_documents([review["review"] for review in reviews]))
+
+    def _sample(self, reviews, embeddings):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(1e-12)
+        num_clusters, silhouette = choose_num_clusters(vectors, self.max_clusters, self.distance_threshold)
+        labels, centers = kmeans(vectors, num_clusters, self.distance_threshold)
+
+        representatives = []
+        for k in range(len(centers)):
+            member_ids = np.flatnonzero(labels == k)
+            if not len(member_ids):
+                continue
+            review = reviews[member_ids[np.argmax(vectors[member_ids] @ centers[k])]]
+            review_text = review["review"]
+            if len(member_ids) > 1:
+                prefix = summarization_prompts.REPRESENTATIVE_PREFIX.format(num_reviews=len(member_ids))
+                review_text = f"{prefix} {review_text}"
+            # The representative carries the IDs of all reviews it stands for, like clubbed reviews do
+            member_review_ids = [review["recommendationid"]] + [
+                reviews[i]["recommendationid"] for i in member_ids if reviews[i] is not review
+            ]
+            representatives.append(
+                Review(
+                    recommendationid=" ".join(member_review_ids),
+                    review=review_text,
+                    playtime_at_review=get_playtime_at_review(review),
+                    language=review.get("language") or "",
+                )
+            )
+
+        stats = {
+            "num_reviews": len(reviews),
+            "num_clusters": len(representatives),
+            "max_clusters_reached": len(centers) >= self.max_clusters,
+            "silhouette": None if silhouette is None else round(silhouette, 3),
+        }
+        log.info(
+            f"Cluster sampling kept {len(representatives)} representatives of {len(reviews)} reviews "
+            f"(silhouette {stats['silhouette']}, max_clusters reached: {stats['max_clusters_reached']})"
+        )
+        return {"filtered_reviews": representatives, "sampling_stats": stats}
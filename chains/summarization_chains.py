@@ -1,18 +1,34 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
+import glog as log
+from langchain.callbacks.manager import AsyncCallbackManagerForChainRun, CallbackManagerForChainRun
 from langchain.chains.base import Chain
 from langchain.llms.base import BaseLanguageModel
 from langchain.output_parsers import StructuredOutputParser
 from langchain.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable
+from pydantic import PrivateAttr
 from prompts import summarization_prompts
 
 
 class SummarizationChain(Chain):
+    """
+    Summarizes reviews in batches of batch_size. A failed batch (e.g. an unparseable response) does not fail the
+    others: only failed batches are retried, up to num_retries times, and the chain succeeds as long as at least
+    min_success_rate of the batches were summarized. Batch counts, the success rate and the IDs of the reviews in
+    failed batches (so that callers can summarize them again later) are returned as summarization_stats.
+    """
+
     llm: BaseLanguageModel
     prompt_template: str
     output_parser: StructuredOutputParser
     batch_size: int
     enable_thinking: bool
+    num_retries: int = 2
+    min_success_rate: float = 1.0
+
+    _llm_chain: Runnable = PrivateAttr(default=None)
+    _format_instructions: str = PrivateAttr(default="")
 
     @property
     def input_keys(self) -> List[str]:
@@ -20,7 +36,7 @@ class SummarizationChain(Chain):
 
     @property
     def output_keys(self) -> List[str]:
-        return ["batch_summaries"]
+        return ["batch_summaries", "summarization_stats"]
 
     def __init__(
         self,
@@ -29,6 +45,8 @@ class SummarizationChain(Chain):
         prompt_template: str = summarization_prompts.JUICE_SUMMARIZATION_PROMPT,
         batch_size: int = 12,
         enable_thinking: bool = False,
+        num_retries: int = 2,
+        min_success_rate: float = 1.0,
     ):
         super().__init__(
             llm=llm,
@@ -36,28 +54,115 @@ class SummarizationChain(Chain):
             prompt_template=prompt_template,
             batch_size=batch_size,
             enable_thinking=enable_thinking,
+            num_retries=num_retries,
+            min_success_rate=min_success_rate,
         )
         self.llm = llm
         self.prompt_template = prompt_template
         self.output_parser = output_parser
         self.batch_size = batch_size
         self.enable_thinking = enable_thinking
-
-    def _call(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
-        reviews = inputs["filtered_reviews"]
+        self.num_retries = num_retries
+        self.min_success_rate = min_success_rate
         prompt = ChatPromptTemplate(
             [("system", "" if self.enable_thinking else "/no_think"), ("human", self.prompt_template)]
         )
-        format_instructions = self.output_parser.get_format_instructions()
-        summarization_chain = prompt | self.llm | self.output_parser
+        self._llm_chain = prompt | self.llm | self.output_parser
+        self._format_instructions = self.output_parser.get_format_instructions()
 
-        batch_summaries = []
+    def _make_batch_inputs(self, reviews):
         review_batches = [reviews[i : i + self.batch_size] for i in range(0, len(reviews), self.batch_size)]
-        summarization_outputs = summarization_chain.batch(
-            [
-                {"review_texts": "\n\n".join([review["review"] for review in review_batch]), "format_instructions": format_instructions}
-                for review_batch in review_batches
-            ]
-        )
-        assert len(summarization_outputs) == len(review_batches)
-        return {"batch_summaries": summarization_outputs}
+        return [
+            {
+                "review_texts": "\n\n".join([review["review"] for review in review_batch]),
+                "format_instructions": self._format_instructions,
+            }
+            for review_batch in review_batches
+        ]
+
+    @staticmethod
+    def _make_config(run_manager, attempt):
+        if run_manager is None:
+            return {"callbacks": None}
+        # Tagged like the attempts of Runnable.with_retry (not inherited by nested runs), so tracing counts retries
+        return {"callbacks": run_manager.get_child(f"retry:attempt:{attempt + 1}" if attempt > 0 else None)}
+
+    @staticmethod
+    def _get_failed(outputs, pending):
+        failed = [i for i in pending if isinstance(outputs[i], Exception)]
+        if failed:
+            log.warning(
+                f"{len(failed)}/{len(outputs)} summarization batches failed: "
+                f"{', '.join(sorted(set(type(outputs[i]).__name__ for i in failed)))}"
+            )
+        return failed
+
+    def _collect_outputs(self, reviews, outputs, num_retried_batches):
+        batch_summaries = [output for output in outputs if not isinstance(output, Exception)]
+        errors = [output for output in outputs if isinstance(output, Exception)]
+        # Clubbed reviews and cluster representatives join the IDs of all reviews they stand for with spaces
+        failed_review_ids = [
+            review_id
+            for i, output in enumerate(outputs)
+            if isinstance(output, Exception)
+            for review in reviews[i * self.batch_size : (i + 1) * self.batch_size]
+            for review_id in str(review["recommendationid"]).split()
+        ]
+        stats = {
+            "num_batches": len(outputs),
+            "num_failed_batches": len(errors),
+            "num_retried_batches": num_retried_batches,
+            "success_rate": len(batch_summaries) / len(outputs) if outputs else 1.0,
+            "failed_review_ids": failed_review_ids,
+        }
+        if stats["success_rate"] < self.min_success_rate:
+            log.error(
+                f"Only {len(batch_summaries)}/{len(outputs)} summarization batches succeeded, "
+                f"below the quorum of {self.min_success_rate}"
+            )
+            raise errors[0]
+        if errors:
+            log.warning(f"Proceeding with {len(batch_summaries)}/{len(outputs)} summarization batches")
+        return {"batch_summaries": batch_summaries, "summarization_stats": stats}
+
+    def _call(
+        self, inputs: Dict[str, Any], run_manager: Optional[CallbackManagerForChainRun] = None
+    ) -> Dict[str, Any]:
+        batch_inputs = self._make_batch_inputs(inputs["filtered_reviews"])
+        outputs = [None] * len(batch_inputs)
+        pending = list(range(len(batch_inputs)))
+        attempt = 0
+        num_retried_batches = 0
+        while pending:
+            pending_outputs = self._llm_chain.batch(
+                [batch_inputs[i] for i in pending],
+                config=self._make_config(run_manager, attempt),
+                return_exceptions=True,
+            )
+            for i, output in zip(pending, pending_outputs):
+                outputs[i] = output
+            attempt += 1
+            pending = self._get_failed(outputs, pending) if attempt <= self.num_retries else []
+            num_retried_batches += len(pending)
+        return self._collect_outputs(inputs["filtered_reviews"], outputs, num_retried_batches)
+
+    async def _acall(
+        self, inputs: Dict[str, Any], run_manager: Optional[AsyncCallbackManagerForChainRun] = None
+    ) -> Dict[str, Any]:
+        batch_inputs = self._make_batch_inputs(inputs["filtered_reviews"])
+        outputs = [None] * len(batch_inputs)
+        pending = list(range(len(batch_inputs)))
+        attempt = 0
+        num_retried_batches = 0
+        while pending:
+            pending_outputs = await self._llm_chain.abatch(
+                [batch_inputs[i] for i in pending],
+                config=self._make_config(run_manager, attempt),
+                return_exceptions=True,
+            )
+            for i, output in zip(pending, pending_outputs):
+                outputs[i] = output
+            attempt += 1
+            pending = self._get_failed(outputs, pending) if attempt <= self.num_retries else []
+            num_retried_batches += len(pending)
+        return self._collect_outputs(inputs["filtered_reviews"], outputs, num_retried_batches)
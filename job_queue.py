@@ -0,0 +1,244 @@
+import argparse
+import contextlib
+import json
+import sqlite3
+import threading
+import time
+
+import glog as log
+import pandas as pd
+
+
+class JobQueue:
+    """
+    Durable, SQLite-backed queue of app IDs shared by any number of worker processes.
+
+    Workers lease one app ID at a time. A lease expires unless it is renewed through heartbeats, after which the
+    job can be leased again by another worker, so a crashed worker only loses its current job. Every lease counts
+    as an attempt, and jobs that fail or expire max_attempts times are moved to the "dead" status. Results are
+    written back to the same database.
+
+    The database uses a rollback journal rather than WAL, since WAL relies on shared memory and doesn't work when
+    workers on several hosts open the database over a network filesystem (which must support file locking).
+    """
+
+    def __init__(self, db_path, lease_seconds=900, max_attempts=3):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with self._connect() as conn:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    app_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    lease_owner TEXT,
+                    lease_expires_at REAL,
+                    last_error TEXT,
+                    enqueued_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS jobs_status_idx ON jobs (status, lease_expires_at);
+                CREATE TABLE IF NOT EXISTS results (
+                    app_id TEXT PRIMARY KEY,
+                    worker_id TEXT NOT NULL,
+                    finished_at REAL NOT NULL,
+                    result TEXT NOT NULL
+                );
+                """
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # Autocommit mode, transactions are opened explicitly with BEGIN IMMEDIATE where needed
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=DELETE")
+            conn.execute("PRAGMA busy_timeout=60000")
+            yield conn
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def enqueue(self, app_ids, requeue_done=False):
+        """Adds app IDs to the queue, skipping ones already queued. Returns the number of newly pending jobs."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            num_before = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+            conn.executemany(
+                "INSERT OR IGNORE INTO jobs (app_id, enqueued_at, updated_at) VALUES (?, ?, ?)",
+                [(str(app_id), now, now) for app_id in app_ids],
+            )
+            if requeue_done:
+                conn.executemany(
+                    "UPDATE jobs SET status = 'pending', attempts = 0, last_error = NULL, updated_at = ? "
+                    "WHERE app_id = ? AND status IN ('done', 'dead')",
+                    [(now, str(app_id)) for app_id in app_ids],
+                )
+            num_after = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+            conn.execute("COMMIT")
+        return num_after - num_before
+
+    def lease(self, worker_id):
+        """Leases the next available app ID to worker_id, or returns None if no job is available right now."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Jobs whose lease expired too many times are dead-lettered instead of being handed out again
+            conn.execute(
+                "UPDATE jobs SET status = 'dead', lease_owner = NULL, last_error = 'lease expired', updated_at = ? "
+                "WHERE status = 'leased' AND lease_expires_at < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            row = conn.execute(
+                "SELECT app_id FROM jobs WHERE status = 'pending' OR (status = 'leased' AND lease_expires_at < ?) "
+                "ORDER BY attempts, enqueued_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'leased', attempts = attempts + 1, lease_owner = ?, lease_expires_at = ?, "
+                "updated_at = ? WHERE app_id = ?",
+                (worker_id, now + self.lease_seconds, now, row[0]),
+            )
+            conn.execute("COMMIT")
+        return row[0]
+
+    def heartbeat(self, app_id, worker_id):
+        """Extends the lease on app_id. Returns False if worker_id no longer holds the lease."""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires_at = ?, updated_at = ? "
+                "WHERE app_id = ? AND status = 'leased' AND lease_owner = ?",
+                (now + self.lease_seconds, now, str(app_id), worker_id),
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, app_id, worker_id, result):
+        """
+        Stores the result for app_id and marks the job as done. Returns False without storing anything if worker_id
+        no longer holds the lease, i.e. the job was handed to another worker after the lease expired.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'done', lease_owner = NULL, lease_expires_at = NULL, last_error = NULL, "
+                "updated_at = ? WHERE app_id = ? AND lease_owner = ?",
+                (now, str(app_id), worker_id),
+            )
+            if cursor.rowcount != 1:
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO results (app_id, worker_id, finished_at, result) VALUES (?, ?, ?, ?)",
+                (str(app_id), worker_id, now, json.dumps(result)),
+            )
+            conn.execute("COMMIT")
+        return True
+
+    def fail(self, app_id, worker_id, error):
+        """Records a failed attempt. The job goes back to pending, or to dead once it ran out of attempts."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'dead' ELSE 'pending' END, "
+                "lease_owner = NULL, lease_expires_at = NULL, last_error = ?, updated_at = ? "
+                "WHERE app_id = ? AND lease_owner = ?",
+                (self.max_attempts, str(error), now, str(app_id), worker_id),
+            )
+
+    def requeue_dead(self):
+        """Moves all dead-lettered jobs back to pending with a fresh attempt budget."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = 0, last_error = NULL, updated_at = ? "
+                "WHERE status = 'dead'",
+                (time.time(),),
+            )
+        return cursor.rowcount
+
+    def stats(self):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        stats = {"pending": 0, "leased": 0, "done": 0, "dead": 0}
+        stats.update(dict(rows))
+        return stats
+
+    def has_unfinished_jobs(self):
+        stats = self.stats()
+        return stats["pending"] + stats["leased"] > 0
+
+    def dead_jobs(self):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT app_id, attempts, last_error FROM jobs WHERE status = 'dead'").fetchall()
+        return [{"app_id": app_id, "attempts": attempts, "last_error": error} for app_id, attempts, error in rows]
+
+    def results(self):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT result FROM results ORDER BY finished_at").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+class LeaseHeartbeat:
+    """Context manager that keeps renewing a lease from a background thread while a job is being processed."""
+
+    def __init__(self, queue, app_id, worker_id, interval=None):
+        self.queue = queue
+        self.app_id = app_id
+        self.worker_id = worker_id
+        self.interval = interval or max(1.0, queue.lease_seconds / 3)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self.queue.heartbeat(self.app_id, self.worker_id):
+                log.warning(f"Lost lease on app_id={self.app_id}")
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the distributed scoring job queue")
+    parser.add_argument("--queue_db", type=str, default="juice_queue.db", help="Path to the queue database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    enqueue_parser = subparsers.add_parser("enqueue", help="Enqueue app IDs from a file, one per line")
+    enqueue_parser.add_argument("app_ids_file", type=str)
+    enqueue_parser.add_argument("--requeue_done", action="store_true", help="Also requeue finished/dead app IDs")
+    subparsers.add_parser("status", help="Show job counts per status and dead-lettered jobs")
+    subparsers.add_parser("requeue_dead", help="Move dead-lettered jobs back to pending")
+    export_parser = subparsers.add_parser("export", help="Export results to a CSV file")
+    export_parser.add_argument("output_file", type=str)
+    args = parser.parse_args()
+
+    queue = JobQueue(args.queue_db)
+    if args.command == "enqueue":
+        app_ids = [x.strip() for x in open(args.app_ids_file, "r").readlines()]
+        app_ids = sorted(list(set([app_id for app_id in app_ids if app_id])))
+        num_enqueued = queue.enqueue(app_ids, requeue_done=args.requeue_done)
+        log.info(f"Enqueued {num_enqueued} new app IDs")
+        print(json.dumps(queue.stats(), indent=4))
+    elif args.command == "status":
+        print(json.dumps({"jobs": queue.stats(), "dead": queue.dead_jobs()}, indent=4))
+    elif args.command == "requeue_dead":
+        log.info(f"Requeued {queue.requeue_dead()} dead jobs")
+    elif args.command == "export":
+        results = queue.results()
+        log.info(f"Saving {len(results)} results to {args.output_file}")
+        pd.DataFrame(results).to_csv(args.output_file, index=False)
@@ -0,0 +1,237 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import warnings
+import zlib
+from collections import defaultdict
+from typing import Optional
+
+import glog as log
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+
+
+# langchain_core.load.loads is marked beta and would warn on every cache hit
+warnings.filterwarnings("ignore", message="The function `loads` is in beta")
+
+MODEL_RE = re.compile(r"""["']model(?:_name)?["']\s*[:,]\s*["']([^"']+)["']""")
+
+
+def normalize_model_name(model):
+    """Strips the "models/" prefix Gemini adds to model names, so they match the names in the model registry."""
+    return model.removeprefix("models/")
+
+
+def get_model_name(llm_string):
+    """
+    Extracts the model name from a LangChain llm_string, which is how cache entries are namespaced.
+
+    >>> get_model_name('{"kwargs": {"model": "models/gemini-2.0-flash", "temperature": 0.0}}---[]')
+    'gemini-2.0-flash'
+    """
+    match = MODEL_RE.search(llm_string)
+    return normalize_model_name(match.group(1)) if match else "unknown"
+
+
+class BoundedSQLiteCache(BaseCache):
+    """
+    LLM cache in a SQLite database that can be shared by concurrent processes.
+
+    Entries are zlib-compressed, namespaced by model and prompt version, and evicted least recently used first
+    once the cache exceeds max_size_mb, or once they are older than max_age_days. Lookups for models listed in
+    overwrite_models ("*" for all) always miss, so that their responses are recomputed and overwritten. Hit and
+    miss counts per model are kept for the lifetime of the cache object.
+    """
+
+    def __init__(
+        self,
+        database_path=".llm_cache.db",
+        max_size_mb=1024,
+        max_age_days=None,
+        prompt_version="",
+        overwrite_models=(),
+        evict_every=200,
+    ):
+        self.database_path = database_path
+        self.max_size_mb = max_size_mb
+        self.max_age_days = max_age_days
+        self.prompt_version = prompt_version
+        self.overwrite_models = {normalize_model_name(model) for model in overwrite_models or ()}
+        self.evict_every = evict_every
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self._lock = threading.Lock()
+        self._num_updates = 0
+        with self._connect() as conn:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    prompt_version TEXT NOT NULL,
+                    response BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS llm_cache_access_idx ON llm_cache (last_access);
+                CREATE INDEX IF NOT EXISTS llm_cache_namespace_idx ON llm_cache (model, prompt_version);
+                UPDATE llm_cache SET model = substr(model, 8) WHERE model LIKE 'models/%';
+                """
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.database_path, timeout=60, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=60000")
+            yield conn
+        finally:
+            conn.close()
+
+    def _key(self, prompt, llm_string):
+        return hashlib.sha256(f"{self.prompt_version}\0{llm_string}\0{prompt}".encode()).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        model = get_model_name(llm_string)
+        if "*" in self.overwrite_models or model in self.overwrite_models:
+            return None
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT response, last_access FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            # Access times only need to be roughly right for LRU, so avoid a write on every hit
+            if row is not None and now - row[1] > 60:
+                conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+        with self._lock:
+            if row is None:
+                self.misses[model] += 1
+            else:
+                self.hits[model] += 1
+        if row is None:
+            return None
+        return [loads(generation) for generation in json.loads(zlib.decompress(row[0]))]
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        response = zlib.compress(json.dumps([dumps(generation) for generation in return_val]).encode())
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache "
+                "(key, model, prompt_version, response, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self._key(prompt, llm_string),
+                    get_model_name(llm_string),
+                    self.prompt_version,
+                    response,
+                    len(response),
+                    now,
+                    now,
+                ),
+            )
+        with self._lock:
+            self._num_updates += 1
+            should_evict = self._num_updates % self.evict_every == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """Deletes entries past max_age_days, then least recently used entries until under max_size_mb."""
+        num_deleted = 0
+        with self._connect() as conn:
+            if self.max_age_days:
+                cursor = conn.execute(
+                    "DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.max_age_days * 86400,)
+                )
+                num_deleted += cursor.rowcount
+            if self.max_size_mb:
+                cursor = conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN ("
+                    "SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY last_access DESC) AS total FROM llm_cache) "
+                    "WHERE total > ?)",
+                    (self.max_size_mb * 1024 * 1024,),
+                )
+                num_deleted += cursor.rowcount
+        if num_deleted:
+            log.info(f"Evicted {num_deleted} LLM cache entries")
+        return num_deleted
+
+    def invalidate(self, model=None, prompt_version=None):
+        """
+        Deletes all entries of a model and/or prompt version. Returns the number of deleted entries.
+
+        >>> import os, tempfile
+        >>> from langchain_core.outputs import Generation
+        >>> llm_string = '{"kwargs": {"model": "models/gemini-2.0-flash"}}---[]'
+        >>> cache = BoundedSQLiteCache(os.path.join(tempfile.mkdtemp(), "cache.db"))
+        >>> cache.update("prompt", llm_string, [Generation(text="response")])
+        >>> cache.lookup("prompt", llm_string)[0].text
+        'response'
+        >>> BoundedSQLiteCache(cache.database_path, overwrite_models=["gemini-2.0-flash"]).lookup("prompt", llm_string)
+        >>> cache.invalidate(model="gemini-2.0-flash")
+        1
+        """
+        conditions, params = [], []
+        if model is not None:
+            conditions.append("model = ?")
+            params.append(normalize_model_name(model))
+        if prompt_version is not None:
+            conditions.append("prompt_version = ?")
+            params.append(prompt_version)
+        if not conditions:
+            raise ValueError("Pass a model and/or prompt_version to invalidate, or use clear()")
+        with self._connect() as conn:
+            cursor = conn.execute(f"DELETE FROM llm_cache WHERE {' AND '.join(conditions)}", params)
+        return cursor.rowcount
+
+    def clear(self, **kwargs) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM llm_cache")
+
+    def stats(self):
+        """Returns entry counts and sizes per model and prompt version, and the hit/miss counts of this process."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT model, prompt_version, COUNT(*), SUM(size) FROM llm_cache GROUP BY model, prompt_version"
+            ).fetchall()
+        with self._lock:
+            hits, misses = dict(self.hits), dict(self.misses)
+        return {
+            "namespaces": [
+                {"model": model, "prompt_version": prompt_version, "entries": entries, "bytes": size}
+                for model, prompt_version, entries, size in rows
+            ],
+            "hits": hits,
+            "misses": misses,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and maintain the LLM cache")
+    parser.add_argument("--cache_db", type=str, default=".llm_cache.db", help="Path to the cache database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="Show entries and size per model and prompt version")
+    invalidate_parser = subparsers.add_parser("invalidate", help="Delete entries of a model and/or prompt version")
+    invalidate_parser.add_argument("--model", type=str, default=None)
+    invalidate_parser.add_argument("--prompt_version", type=str, default=None)
+    evict_parser = subparsers.add_parser("evict", help="Evict entries by age and total size, then vacuum")
+    evict_parser.add_argument("--max_size_mb", type=float, default=1024)
+    evict_parser.add_argument("--max_age_days", type=float, default=None)
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        print(json.dumps(BoundedSQLiteCache(args.cache_db).stats()["namespaces"], indent=4))
+    elif args.command == "invalidate":
+        num_deleted = BoundedSQLiteCache(args.cache_db).invalidate(model=args.model, prompt_version=args.prompt_version)
+        log.info(f"Deleted {num_deleted} cache entries")
+    elif args.command == "evict":
+        cache = BoundedSQLiteCache(args.cache_db, max_size_mb=args.max_size_mb, max_age_days=args.max_age_days)
+        cache.evict()
+        with cache._connect() as conn:
+            conn.execute("VACUUM")
@@ -0,0 +1,85 @@
+import argparse
+import json
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import glog as log
+from tqdm import tqdm
+
+import steam_utils
+
+
+def fetch_one(app_id, num_reviews, num_per_page, language):
+    start_time = time.time()
+    reviews_data = steam_utils.get_user_reviews(
+        app_id, language=language, num_per_page=num_per_page, limit=num_reviews
+    )
+    return {
+        "app_id": app_id,
+        "num_reviews": len(reviews_data["reviews"]),
+        "has_summary": bool(reviews_data["query_summary"]),
+        "seconds": time.time() - start_time,
+    }
+
+
+def main(args):
+    if args.app_ids_file:
+        app_ids = [x.strip() for x in open(args.app_ids_file, "r").readlines() if x.strip()]
+    else:
+        app_ids = [str(args.first_app_id + i) for i in range(args.num_games)]
+
+    results = []
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [
+            executor.submit(fetch_one, app_id, args.num_reviews, args.num_per_page, args.language)
+            for app_id in app_ids
+        ]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            results.append(future.result())
+    elapsed = time.time() - start_time
+
+    outcomes = Counter()
+    for result in results:
+        if result["num_reviews"] == 0:
+            outcomes["empty"] += 1
+        elif not result["has_summary"]:
+            outcomes["partial_after_error"] += 1
+        elif result["num_reviews"] < args.num_reviews:
+            outcomes["short"] += 1
+        else:
+            outcomes["complete"] += 1
+
+    latencies = sorted(result["seconds"] for result in results)
+    report = {
+        "games": len(results),
+        "elapsed_seconds": elapsed,
+        "games_per_hour": len(results) / elapsed * 3600 if elapsed else 0.0,
+        "reviews_fetched": sum(result["num_reviews"] for result in results),
+        "p50_seconds_per_game": latencies[len(latencies) // 2] if latencies else 0.0,
+        "p95_seconds_per_game": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+        "outcomes": dict(outcomes),
+    }
+    print(json.dumps(report, indent=4))
+    if args.output_file:
+        log.info(f"Saving per-game results to {args.output_file}")
+        with open(args.output_file, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the Steam review fetch path")
+    parser.add_argument("--store_base_url", type=str, default="http://127.0.0.1:8765", help="Base URL of the store API")
+    parser.add_argument("--app_ids_file", type=str, default="", help="File with one app ID per line")
+    parser.add_argument("--num_games", type=int, default=1000, help="Number of app IDs to fetch if no file is given")
+    parser.add_argument("--first_app_id", type=int, default=100000, help="First app ID if no file is given")
+    parser.add_argument("--num_reviews", type=int, default=500)
+    parser.add_argument("--num_per_page", type=int, default=100)
+    parser.add_argument("--language", type=str, default="english")
+    parser.add_argument("--concurrency", type=int, default=16, help="Number of games fetched in parallel")
+    parser.add_argument("--output_file", type=str, default="", help="Save per-game results to this json file")
+    args = parser.parse_args()
+
+    steam_utils.STORE_BASE_URL = args.store_base_url
+    main(args)
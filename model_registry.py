@@ -1,10 +1,19 @@
 from langchain_community.chat_models.openai import ChatOpenAI
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_google_genai.embeddings import GoogleGenerativeAIEmbeddings
-from langchain_ollama import ChatOllama
+from langchain_ollama import ChatOllama as _ChatOllama
 from langchain_ollama.embeddings import OllamaEmbeddings
 
 
+class ChatOllama(_ChatOllama):
+    # langchain_ollama leaves model and temperature out of the identifying params, so LLM cache
+    # keys would otherwise be shared between all Ollama models and temperatures
+    @property
+    def _identifying_params(self):
+        return {**super()._identifying_params, "model": self.model, "temperature": self.temperature}
+
+
+
 THINKING_MODELS = [
     "qwen3:4b",
     "qwen3:8b",
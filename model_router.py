@@ -0,0 +1,306 @@
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from typing import Any, Dict, List, Optional
+
+import glog as log
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    BaseCallbackHandler,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult
+from pydantic import PrivateAttr
+
+import tracing
+
+
+class ModelHealth:
+    """Rolling latency (EWMA), error rate and number of outstanding requests of one model in a pool."""
+
+    def __init__(self, ewma_alpha=0.3, error_window=20):
+        self.ewma_alpha = ewma_alpha
+        self.latency_s = None
+        self.errors = deque(maxlen=error_window)
+        self.cooldown_until = 0.0
+        self.outstanding = 0
+        self.draining = False
+
+    @property
+    def error_rate(self):
+        return sum(self.errors) / len(self.errors) if self.errors else 0.0
+
+    def record(self, latency_s=None, error=False):
+        self.errors.append(error)
+        if not error:
+            if self.latency_s is None:
+                self.latency_s = latency_s
+            else:
+                self.latency_s = self.ewma_alpha * latency_s + (1 - self.ewma_alpha) * self.latency_s
+
+
+class RoutedChatModel(BaseChatModel):
+    """
+    Chat model that routes every call to one of a pool of interchangeable models.
+
+    With the "latency" policy, calls go to the fastest healthy model by rolling (EWMA) latency, with models that
+    have no latency yet tried first so that every model gets measured. With the "least_outstanding" policy (e.g.
+    for the same model served from several endpoints), calls go to the healthy model with the fewest requests in
+    flight, so that concurrent calls spread across the pool. A model is unhealthy while it is drained after its
+    error rate over the last error_window calls reached max_error_rate (with at least min_errors errors). Drained
+    models get traffic again after cooldown_seconds, or, if the pool has health_checks, once their health check
+    passes. Failed calls fail over to the next model in line, and the model that answered is recorded as
+    "answered_by" in the response metadata.
+    """
+
+    models: List[BaseChatModel]
+    model_names: List[str]
+    model: str
+    policy: str = "latency"
+    ewma_alpha: float = 0.3
+    error_window: int = 20
+    max_error_rate: float = 0.5
+    min_errors: int = 3
+    cooldown_seconds: float = 30.0
+    health_checks: Optional[List[Any]] = None
+
+    _health: Dict[str, ModelHealth] = PrivateAttr(default_factory=dict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def __init__(self, models, model_names, model=None, **kwargs):
+        super().__init__(models=models, model_names=model_names, model=model or ",".join(model_names), **kwargs)
+        if self.policy not in ("latency", "least_outstanding"):
+            raise ValueError(f"Unknown routing policy: {self.policy}")
+        self._health = {name: ModelHealth(self.ewma_alpha, self.error_window) for name in model_names}
+
+    def map_members(self, wrap):
+        """
+        Returns a pool of wrap(model) for every model of this pool (e.g. to bind an output schema to every
+        member), which shares the latency, load and health state of this pool.
+        """
+        routed = RoutedChatModel(
+            [wrap(model) for model in self.models],
+            self.model_names,
+            model=self.model,
+            policy=self.policy,
+            ewma_alpha=self.ewma_alpha,
+            error_window=self.error_window,
+            max_error_rate=self.max_error_rate,
+            min_errors=self.min_errors,
+            cooldown_seconds=self.cooldown_seconds,
+            health_checks=self.health_checks,
+        )
+        routed._health = self._health
+        routed._lock = self._lock
+        return routed
+
+    def _get_member_identities(self):
+        # LLM type and identifying params of every member, without what only differs between endpoints
+        return [
+            (model._llm_type, {key: value for key, value in model._identifying_params.items() if key != "base_url"})
+            for model in self.models
+        ]
+
+    @property
+    def _llm_type(self) -> str:
+        identities = self._get_member_identities()
+        # The same model served from several endpoints keeps the cache keys of that model
+        if all(identity == identities[0] for identity in identities):
+            return identities[0][0]
+        return "routed-chat-model"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        identities = self._get_member_identities()
+        if all(identity == identities[0] for identity in identities):
+            return identities[0][1]
+        # Member model names are already in self.model, and leaving them out of the member params keeps the
+        # pool's name the one llm_cache.get_model_name finds
+        return {
+            "model": self.model,
+            "member_params": [
+                {"_type": llm_type, **{key: value for key, value in params.items() if key != "model"}}
+                for llm_type, params in identities
+            ],
+        }
+
+    def _get_ls_params(self, stop=None, **kwargs):
+        params = super()._get_ls_params(stop=stop, **kwargs)
+        params["ls_model_name"] = self.model
+        return params
+
+    def _acquire(self, tried):
+        """
+        Picks the best pool index not in tried and counts a request in flight for it, or returns None once all
+        models were tried. Picking and counting happen under one lock, so concurrent calls spread over the pool.
+        """
+        now = time.time()
+        with self._lock:
+            ranked = []
+            for i, name in enumerate(self.model_names):
+                if i in tried:
+                    continue
+                health = self._health[name]
+                latency_s = health.latency_s if health.latency_s is not None else 0.0
+                load = health.outstanding if self.policy == "least_outstanding" else 0
+                ranked.append((now < health.cooldown_until, load, latency_s, i))
+            if not ranked:
+                return None
+            i = min(ranked)[-1]
+            self._health[self.model_names[i]].outstanding += 1
+        return i
+
+    def _record(self, name, latency_s=None, error=False):
+        with self._lock:
+            health = self._health[name]
+            health.outstanding -= 1
+            health.record(latency_s, error)
+            if (
+                not error
+                or health.draining
+                or len(health.errors) < self.min_errors
+                or health.error_rate < self.max_error_rate
+            ):
+                return
+            health.errors.clear()
+            if not self.health_checks:
+                health.cooldown_until = time.time() + self.cooldown_seconds
+                log.warning(f"Model {name} is failing, cooling it down for {self.cooldown_seconds} seconds")
+                return
+            health.draining = True
+            health.cooldown_until = float("inf")
+        log.warning(f"Model {name} is failing, draining it until its health check passes")
+        health_check = self.health_checks[self.model_names.index(name)]
+        threading.Thread(target=self._recover, args=(name, health_check), daemon=True).start()
+
+    def _recover(self, name, health_check):
+        while True:
+            time.sleep(self.cooldown_seconds)
+            try:
+                healthy = health_check()
+            except Exception:
+                healthy = False
+            if healthy:
+                break
+        with self._lock:
+            self._health[name].draining = False
+            self._health[name].cooldown_until = 0.0
+        log.info(f"Model {name} passed its health check, routing traffic to it again")
+
+    @staticmethod
+    def _tag_result(result, name):
+        for generation in result.generations:
+            generation.message.response_metadata["answered_by"] = name
+            generation.generation_info = {**(generation.generation_info or {}), "answered_by": name}
+        return result
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        last_error = None
+        tried = set()
+        while (i := self._acquire(tried)) is not None:
+            tried.add(i)
+            name = self.model_names[i]
+            start_time = time.time()
+            try:
+                result = self.models[i]._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            except Exception as e:
+                self._record(name, error=True)
+                log.warning(f"Model {name} failed, failing over: {e}")
+                last_error = e
+                continue
+            self._record(name, latency_s=time.time() - start_time)
+            return self._tag_result(result, name)
+        raise last_error
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        last_error = None
+        tried = set()
+        while (i := self._acquire(tried)) is not None:
+            tried.add(i)
+            name = self.model_names[i]
+            start_time = time.time()
+            try:
+                result = await self.models[i]._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            except Exception as e:
+                self._record(name, error=True)
+                log.warning(f"Model {name} failed, failing over: {e}")
+                last_error = e
+                continue
+            self._record(name, latency_s=time.time() - start_time)
+            return self._tag_result(result, name)
+        raise last_error
+
+    def health(self):
+        """Returns the rolling latency, error rate and requests in flight of every model in the pool."""
+        with self._lock:
+            return {
+                name: {
+                    "latency_s": health.latency_s,
+                    "error_rate": health.error_rate,
+                    "outstanding": health.outstanding,
+                    "draining": health.draining,
+                }
+                for name, health in self._health.items()
+            }
+
+
+class ModelUsageCollector(BaseCallbackHandler):
+    """
+    Callback handler that counts, per app ID and stage, which model answered each LLM call. For routed models
+    this is the pool member that answered, otherwise the model itself.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._runs = {}
+        self._usage = defaultdict(lambda: defaultdict(Counter))
+
+    def _start(self, run_id, metadata):
+        metadata = metadata or {}
+        with self._lock:
+            self._runs[run_id] = (
+                metadata.get("app_id"),
+                tracing.get_stage(metadata),
+                metadata.get("ls_model_name"),
+            )
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, metadata)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, metadata)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            app_id, stage, model = self._runs.pop(run_id, (None, None, None))
+            for generations in response.generations:
+                for generation in generations:
+                    model = (generation.generation_info or {}).get("answered_by", model)
+            self._usage[app_id][stage or "unknown"][model or "unknown"] += 1
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._runs.pop(run_id, None)
+
+    def pop(self, app_id):
+        """Returns and forgets the model usage of app_id, as {stage: {model: number of calls}}."""
+        with self._lock:
+            usage = self._usage.pop(str(app_id) if app_id is not None else None, {})
+        return {stage: dict(models) for stage, models in usage.items()}
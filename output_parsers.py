@@ -1,3 +1,5 @@
+import json
+
 from langchain.output_parsers import StructuredOutputParser
 from langchain.output_parsers import ResponseSchema
 
@@ -25,6 +27,39 @@ class ThinkingStructuredOutputParser(StructuredOutputParser):
         return super().parse(self._remove_thinking_tokens(text))
 
 
+class NativeStructuredOutputParser(ThinkingStructuredOutputParser):
+    """
+    Parser for models whose provider constrains responses to the schema (see structured_output.py). The format
+    instructions only list the keys, with their descriptions unless the provider already shows the schema to the
+    model. Plain JSON responses are parsed directly, anything else falls back to ThinkingStructuredOutputParser.
+    """
+
+    include_descriptions: bool = True
+
+    @property
+    def _type(self) -> str:
+        return "native_structured_output_parser"
+
+    def __init__(self, response_schemas, include_descriptions=True, thinking_close_tag="</think>"):
+        super().__init__(thinking_close_tag=thinking_close_tag, response_schemas=response_schemas)
+        self.include_descriptions = include_descriptions
+
+    def get_format_instructions(self, only_json: bool = False) -> str:
+        if not self.include_descriptions:
+            return "Respond with a JSON object following the response schema."
+        keys = "\n".join(f"- {schema.name} ({schema.type}): {schema.description}" for schema in self.response_schemas)
+        return f"Respond with a JSON object with these keys:\n{keys}"
+
+    def parse(self, text: str) -> dict:
+        try:
+            output = json.loads(self._remove_thinking_tokens(text))
+        except json.JSONDecodeError:
+            return super().parse(text)
+        if not isinstance(output, dict) or any(schema.name not in output for schema in self.response_schemas):
+            return super().parse(text)
+        return output
+
+
 FILTER_CHAIN_SCHEMAS = [
     ResponseSchema(
         name="clean_review_text",
@@ -72,3 +107,15 @@ JUICE_AGGREGATION_CHAIN_SCHEMAS = [
     ResponseSchema(name="score_explanation", type="string", description="Detailed explanation for the aggregate score, including why a higher or lower score was not assigned."),
 ]
 JUICE_AGGREGATION_CHAIN_PARSER = ThinkingStructuredOutputParser.from_response_schemas(JUICE_AGGREGATION_CHAIN_SCHEMAS)
+
+# The small model of a cascade (see chains.aggregation_chains.CascadeAggregationChain) also rates its confidence
+JUICE_AGGREGATION_CASCADE_CHAIN_SCHEMAS = JUICE_AGGREGATION_CHAIN_SCHEMAS + [
+    ResponseSchema(
+        name="confidence",
+        type="string",
+        description="How confident you are in the score given the summaries: low, medium or high. Use low when the summaries are sparse, vague or contradict each other on this aspect.",
+    ),
+]
+JUICE_AGGREGATION_CASCADE_CHAIN_PARSER = ThinkingStructuredOutputParser.from_response_schemas(
+    JUICE_AGGREGATION_CASCADE_CHAIN_SCHEMAS
+)
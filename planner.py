@@ -0,0 +1,344 @@
+import glob
+import json
+import math
+import os
+from collections import defaultdict
+
+import glog as log
+from langchain_core.prompts import PromptTemplate
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_ollama import ChatOllama
+from langchain_community.chat_models.openai import ChatOpenAI
+
+import chain_utils
+import constants
+import model_registry
+import output_parsers
+from chains import filter_chains
+from prompts import aggregation_prompts, filter_prompts, summarization_prompts
+from review_records import Review
+from text_utils import approx_token_count
+
+
+# Default limits per provider, override them with --rate_limits. rpm and tpm are the provider's request and token
+# rate limits (None for none), concurrency is the number of requests served at once, and a request takes
+# latency_s plus its input and output tokens at the given throughputs
+PROVIDER_LIMITS = {
+    "google": {
+        "rpm": 2000,
+        "tpm": 4000000,
+        "concurrency": 32,
+        "latency_s": 0.5,
+        "input_tokens_per_s": 20000,
+        "output_tokens_per_s": 200,
+    },
+    "openai": {
+        "rpm": 500,
+        "tpm": 200000,
+        "concurrency": 32,
+        "latency_s": 0.5,
+        "input_tokens_per_s": 20000,
+        "output_tokens_per_s": 100,
+    },
+    "ollama": {
+        "rpm": None,
+        "tpm": None,
+        "concurrency": 1,
+        "latency_s": 0.1,
+        "input_tokens_per_s": 1000,
+        "output_tokens_per_s": 40,
+    },
+    "steam": {
+        "rpm": 200,
+        "tpm": None,
+        "concurrency": 8,
+        "latency_s": 0.5,
+        "input_tokens_per_s": None,
+        "output_tokens_per_s": None,
+    },
+}
+
+# Output tokens per call when there is no trace file to measure them from. Filter calls echo the cleaned review
+# back, so their output is estimated from their input instead
+DEFAULT_OUTPUT_TOKENS = {"summarization": 400, "aggregation": 120, "blurb": 80}
+
+# Share of aspect scores a cascade escalates to the large model, when there is no trace file to measure it from
+DEFAULT_CASCADE_ESCALATION_RATE = 0.3
+
+STAGES = ["fetch", "filter", "summarization", "aggregation", "cascade", "blurb"]
+
+
+def get_provider(model):
+    """Returns the provider of a model name ("google", "openai" or "ollama"). Routed lists use their first model."""
+    llm_class = model_registry.LLM_CLASS_MAP.get(model.split(",")[0].strip())
+    if llm_class is None:
+        return "unknown"
+    if issubclass(llm_class, ChatGoogleGenerativeAI):
+        return "google"
+    if issubclass(llm_class, ChatOpenAI):
+        return "openai"
+    if issubclass(llm_class, ChatOllama):
+        return "ollama"
+    return "unknown"
+
+
+def get_limits(provider, model=None, rate_limits=None):
+    """Limits of a provider with the overrides of rate_limits (keyed by provider or model) applied."""
+    rate_limits = rate_limits or {}
+    limits = {**PROVIDER_LIMITS.get(provider, PROVIDER_LIMITS["ollama"]), **rate_limits.get(provider, {})}
+    if model is not None:
+        limits.update(rate_limits.get(model, {}))
+        if provider == "ollama":
+            # Every endpoint serves requests at the configured concurrency
+            endpoints = chain_utils.OLLAMA_ENDPOINTS.get(model) or chain_utils.OLLAMA_ENDPOINTS.get("*") or [None]
+            limits["concurrency"] *= len(endpoints)
+    return limits
+
+
+def load_trace_estimates(trace_file):
+    """
+    Measures the mean output tokens per LLM call of every stage, and the escalation rate of the aggregation cascade,
+    from a trace file written by --trace_file. Returns ({stage: output tokens}, escalation rate or None).
+    """
+    if not trace_file or not os.path.exists(trace_file):
+        return {}, None
+    output_tokens, num_calls = defaultdict(int), defaultdict(int)
+    answered_by = defaultdict(set)
+    with open(trace_file, "r") as f:
+        for line in f:
+            span = json.loads(line)
+            if span["kind"] != "llm" or span["status"] != "ok" or not span["stage"] or span["cache_hit"]:
+                continue
+            stage = span["stage"].split(".")[0]
+            output_tokens[stage] += span["output_tokens"] - span.get("wasted_reasoning_tokens", 0)
+            num_calls[stage] += 1
+            if stage == "aggregation":
+                answered_by[(span["app_id"], span["stage"])].add(span["model"])
+    estimates = {stage: output_tokens[stage] / num_calls[stage] for stage in num_calls if output_tokens[stage]}
+    escalation_rate = None
+    if answered_by and any(len(models) > 1 for models in answered_by.values()):
+        escalation_rate = sum(len(models) > 1 for models in answered_by.values()) / len(answered_by)
+    return estimates, escalation_rate
+
+
+def load_stored_reviews(app_id, reviews_dir=".", limit=None):
+    """Returns the reviews of a steam_reviews_{app_id}_*.json file written by steam_utils.py, or None."""
+    paths = sorted(glob.glob(os.path.join(reviews_dir, f"steam_reviews_{app_id}_*.json")), key=os.path.getmtime)
+    if not paths:
+        return None
+    with open(paths[-1], "r") as f:
+        reviews = [Review.from_steam(review) for review in json.load(f).get("reviews", [])]
+    return reviews[:limit] if limit else reviews
+
+
+def _render_tokens(template, **kwargs):
+    return approx_token_count(PromptTemplate.from_template(template).format(**kwargs))
+
+
+class RunPlanner:
+    """
+    Projects the LLM requests, tokens and wall time of a run without calling any model.
+
+    Sampled games are normalized, filtered and clubbed locally exactly like the filter stage does, and the prompts
+    of every stage are rendered from their templates and counted with approx_token_count. Output tokens are
+    estimates (measured from a trace file if given), and thinking budgets are counted as fully used, so the
+    projection is an upper bound for stages that think.
+    """
+
+    def __init__(
+        self,
+        filter_model,
+        summarization_model,
+        aggregation_model,
+        blurb_model,
+        summarization_batch_size=10,
+        club_reviews_batch_size=4,
+        include_llm_filter=False,
+        normalize=True,
+        max_review_words=300,
+        max_clusters=None,
+        cascade_model=None,
+        thinking_budgets=None,
+        rate_limits=None,
+        trace_file=None,
+        num_per_page=100,
+    ):
+        self.models = {
+            "filter": filter_model if include_llm_filter else None,
+            "summarization": summarization_model,
+            "aggregation": aggregation_model,
+            "cascade": cascade_model,
+            "blurb": blurb_model,
+        }
+        self.summarization_batch_size = summarization_batch_size
+        self.club_reviews_batch_size = club_reviews_batch_size
+        self.normalize = normalize
+        self.max_review_words = max_review_words
+        self.max_clusters = max_clusters
+        self.thinking_budgets = thinking_budgets or {}
+        self.rate_limits = rate_limits or {}
+        self.num_per_page = num_per_page
+        measured_output_tokens, measured_escalation_rate = load_trace_estimates(trace_file)
+        # Measured output tokens already include the reasoning of thinking stages
+        self.measured_stages = set(measured_output_tokens)
+        self.output_tokens = {**DEFAULT_OUTPUT_TOKENS, **measured_output_tokens}
+        self.escalation_rate = (
+            measured_escalation_rate if measured_escalation_rate is not None else DEFAULT_CASCADE_ESCALATION_RATE
+        )
+        self.format_instructions = {
+            "filter": output_parsers.FILTER_CHAIN_PARSER.get_format_instructions(),
+            "summarization": output_parsers.JUICE_SUMMARIZATION_CHAIN_PARSER.get_format_instructions(),
+            "aggregation": output_parsers.JUICE_AGGREGATION_CHAIN_PARSER.get_format_instructions(),
+            "cascade": output_parsers.JUICE_AGGREGATION_CASCADE_CHAIN_PARSER.get_format_instructions(),
+        }
+        self.totals = defaultdict(lambda: defaultdict(float))
+        self.num_games = 0
+
+    def _add(self, stage, requests, input_tokens, output_tokens):
+        totals = self.totals[stage]
+        totals["requests"] += requests
+        totals["input_tokens"] += input_tokens
+        totals["output_tokens"] += output_tokens
+        if stage not in self.measured_stages:
+            totals["output_tokens"] += requests * max(self.thinking_budgets.get(stage, 0), 0)
+
+    def _filter_reviews(self, reviews):
+        # The deterministic part of chain_utils.get_filter_chain, without embedding-based sampling
+        if self.normalize:
+            reviews = filter_chains.NormalizationChain(max_review_words=self.max_review_words).invoke(
+                {"reviews": reviews}
+            )["reviews"]
+        filtered_reviews = filter_chains.DeterministicFilterChain().invoke({"reviews": reviews})["filtered_reviews"]
+        if self.max_clusters:
+            # Sampling keeps at most one review per cluster
+            filtered_reviews = filtered_reviews[: self.max_clusters]
+        return chain_utils.club_reviews(filtered_reviews, self.club_reviews_batch_size)
+
+    def add_game(self, reviews):
+        """Adds the projected calls of one game, given the reviews a run would fetch for it."""
+        self.num_games += 1
+        self._add("fetch", math.ceil(len(reviews) / self.num_per_page) + 1, 0, 0)
+        filtered_reviews = self._filter_reviews(reviews)
+
+        if self.models["filter"]:
+            input_tokens = sum(
+                _render_tokens(
+                    filter_prompts.FLUFF_FILTER_PROMPT,
+                    review_text=review["review"],
+                    format_instructions=self.format_instructions["filter"],
+                )
+                for review in filtered_reviews
+            )
+            output_tokens = sum(approx_token_count(review["review"]) for review in filtered_reviews)
+            self._add("filter", len(filtered_reviews), input_tokens, output_tokens)
+
+        batches = [
+            filtered_reviews[i : i + self.summarization_batch_size]
+            for i in range(0, len(filtered_reviews), self.summarization_batch_size)
+        ]
+        input_tokens = sum(
+            _render_tokens(
+                summarization_prompts.JUICE_SUMMARIZATION_PROMPT,
+                review_texts="\n\n".join(review["review"] for review in batch),
+                format_instructions=self.format_instructions["summarization"],
+            )
+            for batch in batches
+        )
+        self._add("summarization", len(batches), input_tokens, len(batches) * self.output_tokens["summarization"])
+
+        # Every aspect prompt gets that aspect's part of every batch summary
+        summary_tokens = len(batches) * self.output_tokens["summarization"] / len(constants.ASPECT_NAMES)
+        for aspect, template in aggregation_prompts.JUICE_AGGREGATION_PROMPTS.items():
+            stage_shares = [("aggregation", 1.0)]
+            if self.models["cascade"]:
+                stage_shares = [("cascade", 1.0), ("aggregation", self.escalation_rate)]
+            for stage, share in stage_shares:
+                input_tokens = summary_tokens + _render_tokens(
+                    template, summary_texts="", format_instructions=self.format_instructions[stage]
+                )
+                self._add(stage, share, share * input_tokens, share * self.output_tokens["aggregation"])
+
+        breakdown_tokens = len(constants.ASPECT_NAMES) * self.output_tokens["aggregation"]
+        self._add(
+            "blurb",
+            1,
+            breakdown_tokens + _render_tokens(aggregation_prompts.BLURB_PROMPT, review_text=""),
+            self.output_tokens["blurb"],
+        )
+
+    def _project_stage(self, stage, totals, scale):
+        model = self.models.get(stage)
+        provider = "steam" if stage == "fetch" else get_provider(model)
+        limits = get_limits(provider, model if stage != "fetch" else None, self.rate_limits)
+        requests = totals["requests"] * scale
+        tokens = (totals["input_tokens"] + totals["output_tokens"]) * scale
+        request_seconds = requests * limits["latency_s"]
+        if limits["input_tokens_per_s"]:
+            request_seconds += totals["input_tokens"] * scale / limits["input_tokens_per_s"]
+        if limits["output_tokens_per_s"]:
+            request_seconds += totals["output_tokens"] * scale / limits["output_tokens_per_s"]
+        seconds_by_limit = {"throughput": request_seconds / limits["concurrency"]}
+        if limits["rpm"]:
+            seconds_by_limit["rpm"] = requests / limits["rpm"] * 60
+        if limits["tpm"]:
+            seconds_by_limit["tpm"] = tokens / limits["tpm"] * 60
+        limited_by = max(seconds_by_limit, key=seconds_by_limit.get)
+        return {
+            "stage": stage,
+            "model": model,
+            "provider": provider,
+            "requests": requests,
+            "input_tokens": totals["input_tokens"] * scale,
+            "output_tokens": totals["output_tokens"] * scale,
+            "wall_time_s": seconds_by_limit[limited_by],
+            "limited_by": limited_by,
+        }
+
+    def project(self, num_games):
+        """
+        Scales the sampled games up to num_games. Stages run one after the other, so the run takes the sum of the
+        stage times, and the bottleneck is the slowest stage.
+
+        Returns:
+            dict: "stages" and "providers" with requests, tokens and wall time, the "bottleneck" stage and the
+                total "wall_time_s".
+        """
+        if not self.num_games:
+            raise ValueError("No games were sampled to plan from")
+        scale = num_games / self.num_games
+        stages = [self._project_stage(stage, self.totals[stage], scale) for stage in STAGES if stage in self.totals]
+        providers = defaultdict(lambda: defaultdict(float))
+        for stage in stages:
+            for key in ["requests", "input_tokens", "output_tokens", "wall_time_s"]:
+                providers[stage["provider"]][key] += stage[key]
+        bottleneck = max(stages, key=lambda stage: stage["wall_time_s"])
+        return {
+            "num_games": num_games,
+            "num_sampled_games": self.num_games,
+            "stages": stages,
+            "providers": {provider: dict(totals) for provider, totals in providers.items()},
+            "bottleneck": bottleneck["stage"],
+            "wall_time_s": sum(stage["wall_time_s"] for stage in stages),
+        }
+
+
+def log_plan(plan):
+    log.info(f"Plan for {plan['num_games']} games, projected from {plan['num_sampled_games']} sampled games:")
+    for stage in plan["stages"]:
+        log.info(
+            f"  {stage['stage']:<14} {stage['provider']:<8} {stage['model'] or '':<22} "
+            f"{stage['requests']:>10.0f} requests {stage['input_tokens']:>13,.0f} in "
+            f"{stage['output_tokens']:>12,.0f} out {stage['wall_time_s'] / 3600:>7.2f} h "
+            f"(limited by {stage['limited_by']})"
+        )
+    for provider, totals in plan["providers"].items():
+        log.info(
+            f"  {provider:<8} {totals['requests']:,.0f} requests, "
+            f"{totals['input_tokens'] + totals['output_tokens']:,.0f} tokens, {totals['wall_time_s'] / 3600:.2f} h"
+        )
+    bottleneck = next(stage for stage in plan["stages"] if stage["stage"] == plan["bottleneck"])
+    log.info(
+        f"Projected wall time {plan['wall_time_s'] / 3600:.2f} h, bottleneck: {bottleneck['stage']} stage on "
+        f"{bottleneck['provider']} ({bottleneck['wall_time_s'] / plan['wall_time_s']:.0%} of the run, limited by "
+        f"{bottleneck['limited_by']})"
+    )
@@ -1,3 +1,6 @@
+# Prefix of cluster representatives (see chains.sampling_chains), explained to the model in the prompt below
+REPRESENTATIVE_PREFIX = "[Represents {num_reviews} similar reviews]"
+
 JUICE_SUMMARIZATION_PROMPT = """
 You are an expert at scrutinizing, evaluating summarizing video-game reviews. Given a set of reviews, produce a detailed evaluation/summary of the reviews with the following aspects in mind.
 
@@ -13,6 +16,7 @@ You are an expert at scrutinizing, evaluating summarizing video-game reviews. Gi
 - Difficulty is never a negative. 
 - Repetitiveness due to challenging gameplay, backtracking and multiple playthroughs should be ignored.
 - Do not try to give an overall positive or negative verdict. Only your evaluation and detailed summary of each aspect.
+- A review starting with "[Represents N similar reviews]" stands for N reviews that make similar points. Weigh it as N reviews rather than one, but never mention or quote this marker in your summary.
 
 Here are the reviews:
 ```
@@ -1,6 +1,12 @@
 import argparse
+import asyncio
+import functools
+import itertools
 import json
-from typing import Iterator
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List
 
 import glog as log
 
@@ -8,14 +14,18 @@ from langchain import hub
 from langchain.chains.retrieval import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain.globals import set_verbose, set_debug, set_llm_cache
-from langchain_community.cache import SQLiteCache
 from langchain_community.vectorstores import DocArrayInMemorySearch
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
 from langchain_core.document_loaders.base import BaseLoader
 from langchain_core.documents.base import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
 
 import constants
 import chain_utils
+import llm_cache
 import steam_utils
+from review_records import ReviewBatch
 
 
 def _disable_http_logging():
@@ -30,7 +40,8 @@ class SteamReviewsLoader(BaseLoader):
     """Steam reviews loader."""
 
     app_id: int
-    reviews: list[dict]
+    reviews: ReviewBatch
+    aspect_summaries: list[dict]
     num_reviews: int
 
     def __init__(self, app_id, num_reviews=100, num_per_page=100, summarization_model="qwen2.5:7b"):
@@ -38,24 +49,94 @@ class SteamReviewsLoader(BaseLoader):
         self.app_id = app_id
 
         raw_reviews = steam_utils.get_user_reviews(app_id, limit=num_reviews, num_per_page=num_per_page)["reviews"]
-        self.reviews = (
+        self.reviews = ReviewBatch(
             chain_utils.get_filter_chain("", club_reviews_batch_size=1)
             .invoke({"reviews": raw_reviews})
             .get("filtered_reviews")
         )
         self.num_reviews = len(self.reviews)
+        log.info(f"Holding {self.num_reviews} reviews in {self.reviews.nbytes / 1024:.1f} KiB")
 
         # Also add aspect-wise summaries for better context
         filter_chain = chain_utils.get_filter_chain(model="", include_llm_filter=False, club_reviews_batch_size=3)
         summarization_chain = chain_utils.get_summarization_chain(model=summarization_model, temperature=0.7)
         summarization_output = (filter_chain | summarization_chain).invoke({"reviews": self.reviews})
+        self.aspect_summaries = []
         for batch_summary in summarization_output["batch_summaries"]:
             for key, value in batch_summary.items():
-                self.reviews.append({"recommendationid": "", "review": f"{constants.ASPECT_NAMES[key]}: {value}"})
+                self.aspect_summaries.append(
+                    {"recommendationid": "", "aspect": key, "review": f"{constants.ASPECT_NAMES[key]}: {value}"}
+                )
+
+    def load_reviews(self) -> List[Document]:
+        return [
+            Document(page_content=review["review"], metadata={"recommendationid": review["recommendationid"]})
+            for review in self.reviews
+        ]
+
+    def load_aspect_summaries(self) -> List[Document]:
+        return [
+            Document(page_content=summary["review"], metadata={"recommendationid": "", "aspect": summary["aspect"]})
+            for summary in self.aspect_summaries
+        ]
 
     def lazy_load(self) -> Iterator[Document]:
-        for review in self.reviews:
-            yield Document(page_content=review["review"], metadata={"recommendationid": review["recommendationid"]})
+        yield from itertools.chain(self.load_reviews(), self.load_aspect_summaries())
+
+
+WORD_RE = re.compile(r"[a-z]+")
+
+# Words of each aspect name (and key), e.g. "exploration" for the exploration aspect
+ASPECT_VOCABULARY = {
+    aspect: {word for word in WORD_RE.findall(f"{name} {aspect}".lower()) if word != "and"}
+    for aspect, name in constants.ASPECT_NAMES.items()
+}
+
+
+def route_query_aspects(query):
+    """
+    Returns the aspects a question is about, by matching its words against the aspect name vocabulary. Words
+    match on a shared prefix of at least 5 letters, so that e.g. "explore" matches "exploration".
+    """
+    aspects = []
+    for aspect, vocabulary in ASPECT_VOCABULARY.items():
+        for query_word in WORD_RE.findall(query.lower()):
+            if any(
+                query_word == word or (min(len(query_word), len(word)) >= 5 and query_word[:5] == word[:5])
+                for word in vocabulary
+            ):
+                aspects.append(aspect)
+                break
+    return aspects
+
+
+class TwoTierRetriever(BaseRetriever):
+    """
+    Retriever over a small index of aspect summaries and a large index of raw reviews. Questions routed to one or
+    more aspects are answered from the aspect tier; the raw review tier is only searched when the question matches
+    no aspect or the aspect tier returns fewer than aspect_k summaries of the routed aspects.
+    """
+
+    aspect_store: VectorStore
+    review_store: VectorStore
+    k: int = 4
+    aspect_k: int = 3
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        aspects = route_query_aspects(query)
+        documents = []
+        if aspects:
+            # Over-fetch since the vector store can't filter by aspect itself
+            candidates = self.aspect_store.similarity_search(query, k=self.aspect_k * len(ASPECT_VOCABULARY))
+            documents = [doc for doc in candidates if doc.metadata.get("aspect") in aspects][: self.aspect_k]
+            if len(documents) >= self.aspect_k:
+                return documents
+        return documents + self.review_store.similarity_search(query, k=self.k)
+
+
+@functools.lru_cache(maxsize=None)
+def get_retrieval_qa_chat_prompt():
+    return hub.pull("langchain-ai/retrieval-qa-chat")
 
 
 def make_retrieval_qa_chain(
@@ -65,20 +146,73 @@ def make_retrieval_qa_chain(
     embedding_model="nomic-text-embed:latest",
     chat_model="gemma3:4b",
     temperature=0.7,
+    k=4,
 ):
-    loader = SteamReviewsLoader(app_id, num_reviews=num_reviews, summarization_model=summarization_model)
-    embedder = chain_utils.get_embedding_model(embedding_model, temperature=0.7)
-
-    db = DocArrayInMemorySearch.from_documents(loader.load(), embedder)
-    retriever = db.as_retriever()
+    # Fetch the prompt from the hub while reviews are loaded, summarized and embedded
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        prompt_future = executor.submit(get_retrieval_qa_chat_prompt)
+        loader = SteamReviewsLoader(app_id, num_reviews=num_reviews, summarization_model=summarization_model)
+        embedder = chain_utils.get_embedding_model(embedding_model, temperature=0.7)
+
+        retriever = TwoTierRetriever(
+            aspect_store=DocArrayInMemorySearch.from_documents(loader.load_aspect_summaries(), embedder),
+            review_store=DocArrayInMemorySearch.from_documents(loader.load_reviews(), embedder),
+            k=k,
+        )
+        retrieval_qa_chat_prompt = prompt_future.result()
 
     llm = chain_utils.get_language_model(chat_model, temperature=0.7)
-    retrieval_qa_chat_prompt = hub.pull("langchain-ai/retrieval-qa-chat")
     combine_docs_chain = create_stuff_documents_chain(llm, retrieval_qa_chat_prompt)
     rag_chain = create_retrieval_chain(retriever, combine_docs_chain)
     return rag_chain
 
 
+async def astream_answer(rag_chain, query):
+    """
+    Streams the answer to a query to stdout as tokens arrive.
+
+    Returns:
+        dict: Seconds until the retrieved context was ready, until the first answer token and until the full answer.
+    """
+    start_time = time.perf_counter()
+    latencies = {"retrieval_s": None, "first_token_s": None, "total_s": None}
+    async for chunk in rag_chain.astream({"input": query}):
+        if "context" in chunk and latencies["retrieval_s"] is None:
+            latencies["retrieval_s"] = time.perf_counter() - start_time
+        if chunk.get("answer"):
+            if latencies["first_token_s"] is None:
+                latencies["first_token_s"] = time.perf_counter() - start_time
+                print("A: ", end="", flush=True)
+            print(chunk["answer"], end="", flush=True)
+    latencies["total_s"] = time.perf_counter() - start_time
+    if latencies["first_token_s"] is None:
+        print("A: No answer found!", end="")
+    print()
+    return latencies
+
+
+def _format_latencies(latencies):
+    return ", ".join(
+        f"{name[:-2].replace('_', ' ')}: {value:.2f}s" for name, value in latencies.items() if value is not None
+    )
+
+
+async def _run_queries(rag_chain, args):
+    if args.query:
+        print(f"Q: {args.query}")
+        latencies = await astream_answer(rag_chain, args.query)
+        print(f"[{_format_latencies(latencies)}]")
+
+    if args.interactive:
+        while True:
+            # Read input off the event loop so that it stays free for any work still in flight
+            query = await asyncio.to_thread(input, "Q: ")
+            if query.lower() in ["exit", "quit"]:
+                break
+            latencies = await astream_answer(rag_chain, query)
+            print(f"[{_format_latencies(latencies)}]")
+
+
 def main(args):
     rag_chain = make_retrieval_qa_chain(
         args.app_id,
@@ -87,23 +221,13 @@ def main(args):
         embedding_model=args.embedding_model,
         chat_model=args.chat_model,
         temperature=args.temperature,
+        k=args.k,
     )
 
     if args.interactive:
         print("Type 'exit' or 'quit' to exit")
 
-    if args.query:
-        print(f"Q: {args.query}")
-        answer = rag_chain.invoke({"input": args.query}).get("answer", "No answer found!")
-        print(f"A: {answer}")
-
-    if args.interactive:
-        while True:
-            query = input("Q: ")
-            if query.lower() in ["exit", "quit"]:
-                break
-            answer = rag_chain.invoke({"input": query}).get("answer", "No answer found!")
-            print(f"A: {answer}")
+    asyncio.run(_run_queries(rag_chain, args))
 
 
 if __name__ == "__main__":
@@ -117,12 +241,14 @@ if __name__ == "__main__":
     parser.add_argument("-i", "--interactive", action="store_true", help="Run in interactive loop mode")
     parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose logging")
     parser.add_argument("--debug", action="store_true", help="Enable debug logging")
+    parser.add_argument("-k", type=int, default=4, help="Number of documents to retrieve per question")
     parser.add_argument("-t", "--temperature", type=float, default=0.7, help="Temperature fo all models")
+    parser.add_argument("--cache_db", type=str, default=".llm_cache.db", help="Path to the LLM cache database")
     args = parser.parse_args()
 
     set_verbose(args.verbose)
     set_debug(args.debug)
-    set_llm_cache(SQLiteCache(database_path=".langchain_cache.db"))
+    set_llm_cache(llm_cache.BoundedSQLiteCache(database_path=args.cache_db))
 
     _disable_http_logging()
     main(args)
@@ -0,0 +1,255 @@
+import argparse
+import contextlib
+import glob
+import json
+import math
+import os
+import sqlite3
+import time
+
+import glog as log
+import pandas as pd
+
+import scoring
+
+
+SCORE_COLUMNS = ["juice_score", "top_2_score", "all_score"] + [f"{aspect}_score" for aspect in scoring.ASPECTS]
+
+# Result columns besides run_id, app_id and the scores, as written by run_chains.make_result_row
+TEXT_COLUMNS = ["name", "url", "answered_by", "blurb"] + [f"{aspect}_explanation" for aspect in scoring.ASPECTS]
+NUMBER_COLUMNS = ["metacritic_score", "num_reviews_used", "tokens_saved"]
+
+
+def _clean_value(value):
+    # pandas gives NaN for empty CSV cells
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class ResultsDB:
+    """
+    SQLite store of the results of all runs, for ranking and filtering games across the whole history.
+
+    Every run is recorded with its mode and model config, and results are keyed by run and app ID, so rerunning a
+    game in the same run overwrites its result. The most recent result of every game is flagged as latest, and all
+    score columns are indexed together with that flag, so that ranking queries only touch the rows they return.
+    Genres are kept in a separate indexed table.
+    """
+
+    def __init__(self, db_path="juice_results.db"):
+        self.db_path = db_path
+        score_columns = ",\n".join(f"{column} REAL" for column in SCORE_COLUMNS)
+        other_columns = ",\n".join(
+            [f"{column} TEXT" for column in TEXT_COLUMNS] + [f"{column} REAL" for column in NUMBER_COLUMNS]
+        )
+        score_indexes = "\n".join(
+            f"CREATE INDEX IF NOT EXISTS results_{column}_idx ON results (is_latest, {column});"
+            for column in SCORE_COLUMNS + ["metacritic_score"]
+        )
+        with self._connect() as conn:
+            conn.executescript(
+                f"""
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id TEXT PRIMARY KEY,
+                    mode TEXT NOT NULL,
+                    model_config TEXT NOT NULL,
+                    started_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS runs_model_config_idx ON runs (model_config);
+                CREATE TABLE IF NOT EXISTS results (
+                    run_id TEXT NOT NULL,
+                    app_id TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    is_latest INTEGER NOT NULL DEFAULT 0,
+                    {score_columns},
+                    {other_columns},
+                    PRIMARY KEY (run_id, app_id)
+                );
+                CREATE INDEX IF NOT EXISTS results_app_id_idx ON results (app_id, created_at);
+                {score_indexes}
+                CREATE TABLE IF NOT EXISTS genres (
+                    run_id TEXT NOT NULL,
+                    app_id TEXT NOT NULL,
+                    genre TEXT NOT NULL,
+                    PRIMARY KEY (run_id, app_id, genre)
+                );
+                CREATE INDEX IF NOT EXISTS genres_genre_idx ON genres (genre, app_id, run_id);
+                """
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # Autocommit mode, transactions are opened explicitly with BEGIN IMMEDIATE where needed
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=60000")
+            yield conn
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def start_run(self, run_id, mode, model_config, started_at=None):
+        """Records a run. model_config is a dict (e.g. the model of every stage), stored as sorted JSON."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO runs (run_id, mode, model_config, started_at) VALUES (?, ?, ?, ?)",
+                (run_id, mode, json.dumps(model_config, sort_keys=True), started_at or time.time()),
+            )
+
+    def upsert(self, run_id, rows, created_at=None):
+        """
+        Inserts or replaces the results of a run.
+
+        Args:
+            run_id (str): The run the results belong to, see start_run.
+            rows (list): Result rows as written by run_chains.make_result_row. Genres may be a list or a JSON
+                string, unknown keys are ignored.
+            created_at (float, optional): Result time, defaults to now. Imports pass the time of the source file.
+        """
+        columns = SCORE_COLUMNS + TEXT_COLUMNS + NUMBER_COLUMNS
+        created_at = created_at or time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for row in rows:
+                app_id = str(row["app_id"])
+                values = [_clean_value(row.get(column)) for column in columns]
+                conn.execute(
+                    f"INSERT INTO results (run_id, app_id, created_at, {', '.join(columns)}) "
+                    f"VALUES (?, ?, ?, {', '.join('?' * len(columns))}) "
+                    f"ON CONFLICT (run_id, app_id) DO UPDATE SET created_at = excluded.created_at, "
+                    + ", ".join(f"{column} = excluded.{column}" for column in columns),
+                    [run_id, app_id, created_at] + values,
+                )
+                genres = _clean_value(row.get("genres")) or []
+                if isinstance(genres, str):
+                    genres = json.loads(genres)
+                conn.execute("DELETE FROM genres WHERE run_id = ? AND app_id = ?", (run_id, app_id))
+                conn.executemany(
+                    "INSERT OR IGNORE INTO genres (run_id, app_id, genre) VALUES (?, ?, ?)",
+                    [(run_id, app_id, genre) for genre in genres],
+                )
+                conn.execute(
+                    "UPDATE results SET is_latest = (rowid = ("
+                    "SELECT rowid FROM results WHERE app_id = ? ORDER BY created_at DESC, rowid DESC LIMIT 1"
+                    ")) WHERE app_id = ?",
+                    (app_id, app_id),
+                )
+            conn.execute("COMMIT")
+
+    def top(self, by="juice_score", limit=50, min_metacritic=None, genre=None, run_id=None):
+        """
+        Returns the best games by a score column, from the latest result of every game or from one run.
+
+        Args:
+            by (str): A score column, e.g. "juice_score" or "exploration_score".
+            limit (int): Number of games to return.
+            min_metacritic (float, optional): Only games with a higher metacritic score.
+            genre (str, optional): Only games of this genre.
+            run_id (str, optional): Rank the results of this run instead of the latest result of every game.
+        """
+        if by not in SCORE_COLUMNS:
+            raise ValueError(f"Unknown score column: {by}, expected one of {SCORE_COLUMNS}")
+        conditions, params = [], []
+        if run_id is None:
+            conditions.append("r.is_latest = 1")
+        else:
+            conditions.append("r.run_id = ?")
+            params.append(run_id)
+        if min_metacritic is not None:
+            conditions.append("r.metacritic_score > ?")
+            params.append(min_metacritic)
+        if genre is not None:
+            conditions.append(
+                "EXISTS (SELECT 1 FROM genres g WHERE g.genre = ? AND g.app_id = r.app_id AND g.run_id = r.run_id)"
+            )
+            params.append(genre)
+        columns = dict.fromkeys(["app_id", "name", by, "juice_score", "metacritic_score", "run_id"])
+        query = (
+            f"SELECT {', '.join(f'r.{column}' for column in columns)} FROM results r "
+            f"WHERE {' AND '.join(conditions)} AND r.{by} IS NOT NULL ORDER BY r.{by} DESC LIMIT ?"
+        )
+        with self._connect() as conn:
+            return pd.read_sql_query(query, conn, params=params + [limit])
+
+    def runs(self):
+        """Returns all runs with their number of results, newest first."""
+        with self._connect() as conn:
+            return pd.read_sql_query(
+                "SELECT runs.run_id, mode, model_config, started_at, COUNT(results.app_id) AS num_results "
+                "FROM runs LEFT JOIN results ON results.run_id = runs.run_id "
+                "GROUP BY runs.run_id ORDER BY started_at DESC",
+                conn,
+            )
+
+    def import_results_csv(self, path):
+        """Imports a results CSV written by run_chains.py as a run named after the file."""
+        run_id = os.path.splitext(os.path.basename(path))[0]
+        created_at = os.path.getmtime(path)
+        df = pd.read_csv(path, dtype={"app_id": str})
+        self.start_run(run_id, "import", {"source": path}, started_at=created_at)
+        self.upsert(run_id, df.to_dict("records"), created_at=created_at)
+        return len(df)
+
+    def import_chain_outputs(self, chain_outputs_dir="chain_outputs"):
+        """Imports the chain output JSON files of single game runs, one run per file."""
+        num_imported = 0
+        for path in glob.glob(os.path.join(chain_outputs_dir, "chain_output_*.json")):
+            match = scoring.CHAIN_OUTPUT_FILE_RE.search(os.path.basename(path))
+            if match is None:
+                continue
+            with open(path, "r") as f:
+                chain_output = json.load(f)
+            row = {key: chain_output.get(key) for key in ["juice_score", "top_2_score", "all_score", "blurb"]}
+            row.update({"app_id": match.group(1), "name": match.group(2).replace("_", " ")})
+            for aspect, branch in chain_output.get("branches", {}).items():
+                row[f"{aspect}_score"] = branch.get("aggregate_score")
+                row[f"{aspect}_explanation"] = branch.get("score_explanation")
+            run_id = os.path.splitext(os.path.basename(path))[0]
+            created_at = os.path.getmtime(path)
+            self.start_run(run_id, "import", {"source": path}, started_at=created_at)
+            self.upsert(run_id, [row], created_at=created_at)
+            num_imported += 1
+        return num_imported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query and maintain the results database")
+    parser.add_argument("--results_db", type=str, default="juice_results.db", help="Path to the results database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    top_parser = subparsers.add_parser("top", help="Show the best games by a score")
+    top_parser.add_argument("--by", type=str, default="juice", help="Aspect or score name, e.g. exploration")
+    top_parser.add_argument("--limit", type=int, default=50)
+    top_parser.add_argument("--min_metacritic", type=float, default=None)
+    top_parser.add_argument("--genre", type=str, default=None)
+    top_parser.add_argument("--run_id", type=str, default=None, help="Rank one run instead of the latest results")
+    top_parser.add_argument("--output_file", type=str, default="", help="Also save the results to a CSV file")
+    subparsers.add_parser("runs", help="List runs with their model config and number of results")
+    import_parser = subparsers.add_parser("import", help="Import existing results CSVs and chain outputs")
+    import_parser.add_argument("--results_csv", type=str, nargs="*", default=[], help="Files or glob patterns")
+    import_parser.add_argument("--chain_outputs_dir", type=str, default="")
+    args = parser.parse_args()
+
+    results_db = ResultsDB(args.results_db)
+    if args.command == "top":
+        by = args.by if args.by.endswith("_score") else f"{args.by}_score"
+        start_time = time.time()
+        df = results_db.top(
+            by=by, limit=args.limit, min_metacritic=args.min_metacritic, genre=args.genre, run_id=args.run_id
+        )
+        log.info(f"Query took {(time.time() - start_time) * 1000:.1f} ms")
+        print(df.to_string(index=False))
+        if args.output_file:
+            df.to_csv(args.output_file, index=False)
+    elif args.command == "runs":
+        print(results_db.runs().to_string(index=False))
+    elif args.command == "import":
+        paths = sorted((path for pattern in args.results_csv for path in glob.glob(pattern)), key=os.path.getmtime)
+        for path in paths:
+            log.info(f"Imported {results_db.import_results_csv(path)} results from {path}")
+        if args.chain_outputs_dir:
+            log.info(f"Imported {results_db.import_chain_outputs(args.chain_outputs_dir)} chain outputs")
@@ -0,0 +1,137 @@
+import sys
+from array import array
+from collections.abc import Sequence
+from typing import Iterable, Optional
+
+
+class Review:
+    """
+    Slim review record holding only the fields the pipeline reads. Supports dict-style access
+    (review["review"], review.get("recommendationid")) so it can stand in for raw Steam review dicts.
+    """
+
+    __slots__ = ("recommendationid", "review", "playtime_at_review", "language")
+
+    def __init__(self, recommendationid: str, review: str, playtime_at_review: Optional[int] = None, language: str = ""):
+        self.recommendationid = recommendationid
+        self.review = review
+        self.playtime_at_review = playtime_at_review
+        self.language = language
+
+    @classmethod
+    def from_steam(cls, review_data: dict) -> "Review":
+        """Creates a record from a raw review dict as returned by the Steam appreviews API."""
+        return cls(
+            recommendationid=review_data["recommendationid"],
+            review=review_data["review"],
+            playtime_at_review=review_data.get("author", {}).get("playtime_at_review"),
+            language=sys.intern(review_data.get("language", "")),
+        )
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def to_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __eq__(self, other):
+        return isinstance(other, Review) and self.to_dict() == other.to_dict()
+
+    def __hash__(self):
+        # Equal records have equal IDs, so records stay usable in sets and as dict keys
+        return hash(self.recommendationid)
+
+    def __repr__(self):
+        return f"Review(recommendationid={self.recommendationid!r}, review={self.review[:40]!r}...)"
+
+
+class ReviewBatch(Sequence):
+    """
+    Immutable, array-backed batch of reviews. All review texts live in one contiguous UTF-8 buffer (so a single emoji
+    does not widen every character to 4 bytes) with byte offsets and playtimes in typed arrays; each text slice is
+    decoded and its Review record materialized only on access. Recommendation IDs are kept as (interned) strings as
+    they are not always numeric, e.g. clubbed reviews join several IDs with spaces. Slicing returns a list of Review
+    records so batches can be fed to code that chunks reviews (club_reviews, SummarizationChain).
+    """
+
+    __slots__ = ("_ids", "_offsets", "_text", "_playtimes", "_languages")
+
+    def __init__(self, reviews: Iterable = ()):
+        self._ids = []
+        self._offsets = array("Q", [0])
+        self._playtimes = array("q")
+        self._languages = []
+        texts = []
+        for review in reviews:
+            if not isinstance(review, Review):
+                review = Review.from_steam(review)
+            self._ids.append(sys.intern(str(review.recommendationid or "")))
+            text = review.review.encode("utf-8")
+            texts.append(text)
+            self._offsets.append(self._offsets[-1] + len(text))
+            self._playtimes.append(-1 if review.playtime_at_review is None else review.playtime_at_review)
+            self._languages.append(sys.intern(review.language))
+        self._text = b"".join(texts)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _get(self, i):
+        playtime = self._playtimes[i]
+        return Review(
+            recommendationid=self._ids[i],
+            review=self._text[self._offsets[i] : self._offsets[i + 1]].decode("utf-8"),
+            playtime_at_review=None if playtime < 0 else playtime,
+            language=self._languages[i],
+        )
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._get(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("ReviewBatch index out of range")
+        return self._get(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._get(i)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Approximate memory held by the batch: its buffers and lists plus the ID and language strings they refer to.
+        Interned strings are counted once, even though they may be shared with other objects.
+        """
+        strings = {id(string): string for string in self._ids + self._languages}
+        return (
+            sys.getsizeof(self._text)
+            + sys.getsizeof(self._ids)
+            + self._offsets.itemsize * len(self._offsets)
+            + self._playtimes.itemsize * len(self._playtimes)
+            + sys.getsizeof(self._languages)
+            + sum(sys.getsizeof(string) for string in strings.values())
+        )
+
+
+def get_playtime_at_review(review_data, default=None):
+    """Returns the playtime at review (in minutes) of a Review record or raw Steam review dict."""
+    if isinstance(review_data, Review):
+        playtime = review_data.playtime_at_review
+    else:
+        playtime = review_data.get("author", {}).get("playtime_at_review")
+    return default if playtime is None else playtime
@@ -1,28 +1,76 @@
 import argparse
+import asyncio
+import functools
 import json
 import os
-import statistics
+import random
+import socket
 import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import pandas as pd
 import glog as log
 from langchain.globals import set_verbose, set_debug, set_llm_cache
-from langchain_community.cache import SQLiteCache
 from langchain_core.callbacks import get_usage_metadata_callback
 from langchain_core.exceptions import OutputParserException
 from tqdm import tqdm
 
 import constants
 import chain_utils
+import job_queue
+import llm_cache
+import model_router
+import planner
+import results_db
+import scoring
 import steam_utils
+import summary_store
+import tracing
 from prompts import aggregation_prompts
+from review_records import Review
 
 
-class OverwriteSQLiteCache(SQLiteCache):
-    def lookup(self, prompt: str, llm_string):
-        # Always return None to force recompute
-        return None
+class TracedLLMCache(tracing.CacheLookupObserverMixin, llm_cache.BoundedSQLiteCache):
+    pass
+
+
+# Records which model answered each stage of every game, see _make_config
+MODEL_USAGE = model_router.ModelUsageCollector()
+
+
+def _make_config(app_id, callbacks=None, **kwargs):
+    return {"callbacks": (callbacks or []) + [MODEL_USAGE], "metadata": {"app_id": str(app_id)}, **kwargs}
+
+
+def _scoped_model_usage(run):
+    """
+    Decorates a run for a single app ID (its first argument) so that the model usage of the app ID is cleared
+    when the run starts and forgotten when it ends. Failed runs then neither leak their usage in long-running
+    processes nor add it to the answered_by of a retry.
+    """
+    if asyncio.iscoroutinefunction(run):
+
+        @functools.wraps(run)
+        async def wrapper(app_id, *args, **kwargs):
+            MODEL_USAGE.pop(app_id)
+            try:
+                return await run(app_id, *args, **kwargs)
+            finally:
+                MODEL_USAGE.pop(app_id)
+
+    else:
+
+        @functools.wraps(run)
+        def wrapper(app_id, *args, **kwargs):
+            MODEL_USAGE.pop(app_id)
+            try:
+                return run(app_id, *args, **kwargs)
+            finally:
+                MODEL_USAGE.pop(app_id)
+
+    return wrapper
 
 
 def _get_reviews(
@@ -34,53 +82,59 @@ def _get_reviews(
     review_type="all",
     allow_other_languages=True,
 ):
-    reviews = steam_utils.get_user_reviews(
+    languages = [language]
+    if allow_other_languages and language != "all":
+        languages += [other for other in steam_utils.FALLBACK_LANGUAGES if other != language]
+    return steam_utils.get_multilingual_user_reviews(
         app_id,
+        languages=languages,
         limit=num_reviews,
         num_per_page=num_per_page,
-        language=language,
         filter=review_filter,
         review_type=review_type,
     ).get("reviews", [])
 
-    # if number of reviews is < num_revies, try to get instead with languages = 'all'
-    if len(reviews) < num_reviews and allow_other_languages:
-        log.info(f"Couldn't get enough reviews in {language}, trying to with all languages instead")
-        return steam_utils.get_user_reviews(
-            app_id,
-            limit=num_reviews,
-            num_per_page=num_per_page,
-            language="all",
-            filter=review_filter,
-            review_type=review_type,
-        ).get("reviews", [])
-    return reviews
-
-
-def calculate_weighted_aspects_score(aspect_scores):
-    aspect_weights = {
-        "lore_worldbuilding_atmosphere": 0.20,
-        "exploration": 0.20,
-        "gameplay_mechanics": 0.20,
-        "emotional_engagement": 0.1,
-        "bloat_grinding": 0.1,
-        "challenge": 0.20,
-    }
-    if set(aspect_scores.keys()) != set(aggregation_prompts.JUICE_AGGREGATION_PROMPTS.keys()):
-        total_score = 0
-        for aspect in aspect_score.keys():
-            total_score += aspect_scores[aspect]
-        return total_score / len(aspect_scores.keys())
 
-    # bloat/grinding score should be capped to the max of the other scores
-    max_area_scores = max([score for aspect, score in aspect_scores.items() if aspect != "bloat_grinding"])
-    aspect_scores["bloat_grinding"] = min(aspect_scores["bloat_grinding"], max_area_scores)
-    final_score = 0
-    for aspect in aspect_scores.keys():
-        final_score += aspect_weights[aspect] * aspect_scores[aspect]
-    return final_score
+def _add_stage_stats(stage_stats, stage_output):
+    """Adds up the stats of a stage output (e.g. of one adaptive round) into stage_stats."""
+    for stats_key, stats in chain_utils.get_stage_stats(stage_output).items():
+        totals = stage_stats.setdefault(stats_key, {})
+        for key, value in (stats or {}).items():
+            if isinstance(value, list):
+                totals[key] = totals.get(key, []) + value
+            else:
+                totals[key] = totals.get(key, 0) + (value or 0)
+    if "summarization_stats" in stage_stats:
+        totals = stage_stats["summarization_stats"]
+        num_batches = totals["num_batches"]
+        totals["success_rate"] = (num_batches - totals["num_failed_batches"]) / num_batches if num_batches else 1.0
 
 
+def _add_scores(chain_output):
+    branches = chain_output["branches"]
+    score_breakdown_text = ""
+    aspect_scores = {}
+    for aspect in branches:
+        aspect_score = branches[aspect]["aggregate_score"]
+        aspect_scores[aspect] = aspect_score
+        score_breakdown_text += (
+            f"{constants.ASPECT_NAMES[aspect]} ({aspect_score}/10): {branches[aspect]['score_explanation']}\n\n"
+        )
+
+    chain_output.update(scoring.score_aspects(aspect_scores))
+    chain_output["score_breakdown_text"] = score_breakdown_text
+    return chain_output
+
+
+def _add_scores_and_blurb(chain_output, blurb_model, config=None):
+    chain_output = _add_scores(chain_output)
+    blurb = chain_utils.get_blurb(chain_output["score_breakdown_text"], model=blurb_model, config=config)
+    chain_output["blurb"] = f"JUICE Score: {chain_output['juice_score']:.1f}. {blurb}"
+    chain_output["answered_by"] = MODEL_USAGE.pop(config["metadata"]["app_id"])
+    return chain_output
+
+
+@_scoped_model_usage
 def run_for_app_id(
     app_id,
     complete_chain,
@@ -90,60 +144,680 @@ def run_for_app_id(
     review_filter="recent",
     review_type="all",
     allow_other_languages=True,
+    blurb_model="qwen2.5:7b",
+    callbacks=None,
 ):
     reviews = _get_reviews(
         app_id, num_reviews, num_per_page, language, review_filter, review_type, allow_other_languages
     )
+    config = _make_config(app_id, callbacks)
     try:
-        chain_output = complete_chain.invoke({"reviews": reviews})
+        chain_output = complete_chain.invoke({"reviews": reviews}, config=config)
     except OutputParserException as e:
         log.exception("❗️Failed to parse JSON output. Try re-running with debug mode")
         raise
 
-    branches = chain_output["branches"]
-    score_breakdown_text = ""
-    aspect_scores = {}
-    for aspect in branches:
-        aspect_score = branches[aspect]["aggregate_score"]
-        aspect_scores[aspect] = aspect_score
-        score_breakdown_text += (
-            f"{constants.ASPECT_NAMES[aspect]} ({aspect_score}/10): {branches[aspect]['score_explanation']}\n\n"
-        )
+    chain_output["num_reviews_used"] = len(reviews)
+    return _add_scores_and_blurb(chain_output, blurb_model, config=config)
+
 
-    top_2_score = statistics.mean(
-        sorted([aspect_scores[aspect] for aspect in branches if aspect != "bloat_grinding"], reverse=True)[:2]
+@_scoped_model_usage
+async def arun_for_app_id(
+    app_id,
+    complete_chain,
+    num_reviews=200,
+    num_per_page=100,
+    language="english",
+    review_filter="recent",
+    review_type="all",
+    allow_other_languages=True,
+    blurb_model="qwen2.5:7b",
+    callbacks=None,
+):
+    """Async version of run_for_app_id. Reviews are fetched in a worker thread, all LLM calls run on the loop."""
+    reviews = await asyncio.to_thread(
+        _get_reviews, app_id, num_reviews, num_per_page, language, review_filter, review_type, allow_other_languages
     )
-    all_score = calculate_weighted_aspects_score(aspect_scores)
-    juice_score = (all_score + top_2_score) / 2
+    config = _make_config(app_id, callbacks)
+    try:
+        chain_output = await complete_chain.ainvoke({"reviews": reviews}, config=config)
+    except OutputParserException as e:
+        log.exception("❗️Failed to parse JSON output. Try re-running with debug mode")
+        raise
 
-    blurb = chain_utils.get_blurb(score_breakdown_text, model=args.blurb_model)
-    blurb = f"JUICE Score: {juice_score:.1f}. {blurb}"
-    chain_output["all_score"] = all_score
-    chain_output["top_2_score"] = top_2_score
-    chain_output["juice_score"] = juice_score
-    chain_output["score_breakdown_text"] = score_breakdown_text
-    chain_output["blurb"] = blurb
+    chain_output["num_reviews_used"] = len(reviews)
+    chain_output = _add_scores(chain_output)
+    blurb = await chain_utils.aget_blurb(chain_output["score_breakdown_text"], model=blurb_model, config=config)
+    chain_output["blurb"] = f"JUICE Score: {chain_output['juice_score']:.1f}. {blurb}"
+    chain_output["answered_by"] = MODEL_USAGE.pop(config["metadata"]["app_id"])
     return chain_output
 
 
-def main_with_usage_callback(args):
+async def arun_for_app_ids(app_ids, complete_chain, max_in_flight=16, **kwargs):
+    """
+    Scores many games concurrently on one event loop, at most max_in_flight games at a time. Since every stage
+    uses abatch/ainvoke, the LLM requests of all games in flight share the loop instead of a thread each.
+
+    Args:
+        app_ids (list): The games to score.
+        complete_chain: The filter | summarization | aggregation chain.
+        max_in_flight (int): Number of games processed concurrently.
+        **kwargs: Passed on to arun_for_app_id.
+
+    Returns:
+        A dict mapping each app ID to its chain output, or to the exception that made it fail.
+    """
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def run(app_id):
+        async with semaphore:
+            return await arun_for_app_id(app_id, complete_chain, **kwargs)
+
+    outputs = await asyncio.gather(*[run(app_id) for app_id in app_ids], return_exceptions=True)
+    return dict(zip(app_ids, outputs))
+
+
+def run_for_app_id_group(
+    app_ids,
+    stage_chains,
+    num_reviews=200,
+    num_per_page=100,
+    language="english",
+    review_filter="recent",
+    review_type="all",
+    allow_other_languages=True,
+    blurb_model="qwen2.5:7b",
+    max_concurrency=None,
+    callbacks=None,
+):
+    """
+    Scores a group of games stage by stage: every game is filtered, then every game is summarized, then aggregated,
+    and finally all blurbs are written. Each model therefore only has to be loaded once per group (instead of once
+    per game and stage), which matters for local Ollama runs where model swaps dominate runtime. Intermediate
+    results are held in memory between stages.
+
+    Returns:
+        A dict mapping each app ID to its chain output, or to the exception that made it fail.
+    """
+    for app_id in app_ids:
+        MODEL_USAGE.pop(app_id)
+    try:
+        return _run_for_app_id_group(
+            app_ids,
+            stage_chains,
+            num_reviews,
+            num_per_page,
+            language,
+            review_filter,
+            review_type,
+            allow_other_languages,
+            blurb_model,
+            max_concurrency,
+            callbacks,
+        )
+    finally:
+        # Games that failed in some stage never had their usage popped into an answered_by
+        for app_id in app_ids:
+            MODEL_USAGE.pop(app_id)
+
+
+def _run_for_app_id_group(
+    app_ids,
+    stage_chains,
+    num_reviews,
+    num_per_page,
+    language,
+    review_filter,
+    review_type,
+    allow_other_languages,
+    blurb_model,
+    max_concurrency,
+    callbacks,
+):
+    results = {}
+    configs = {app_id: _make_config(app_id, callbacks, max_concurrency=max_concurrency) for app_id in app_ids}
+
+    stage_inputs = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(len(app_ids), 8))) as executor:
+        futures = {
+            app_id: executor.submit(
+                _get_reviews,
+                app_id,
+                num_reviews,
+                num_per_page,
+                language,
+                review_filter,
+                review_type,
+                allow_other_languages,
+            )
+            for app_id in app_ids
+        }
+        for app_id, future in futures.items():
+            try:
+                stage_inputs[app_id] = {"reviews": future.result()}
+            except Exception as e:
+                log.error(f"Error fetching reviews for app_id={app_id}: {e}")
+                results[app_id] = e
+    num_reviews_used = {app_id: len(stage_input["reviews"]) for app_id, stage_input in stage_inputs.items()}
+
+    for stage in ["filter", "summarization", "aggregation"]:
+        group_app_ids = list(stage_inputs.keys())
+        if not group_app_ids:
+            break
+        log.info(f"Running {stage} stage for {len(group_app_ids)} games")
+        stage_outputs = stage_chains[stage].batch(
+            [stage_inputs[app_id] for app_id in group_app_ids],
+            config=[configs[app_id] for app_id in group_app_ids],
+            return_exceptions=True,
+        )
+        stage_inputs = {}
+        for app_id, stage_output in zip(group_app_ids, stage_outputs):
+            if isinstance(stage_output, Exception):
+                log.error(f"Error running {stage} stage for app_id={app_id}: {stage_output}")
+                results[app_id] = stage_output
+            else:
+                stage_inputs[app_id] = stage_output
+
+    chain_outputs = {app_id: _add_scores(chain_output) for app_id, chain_output in stage_inputs.items()}
+    group_app_ids = list(chain_outputs.keys())
+    if group_app_ids:
+        log.info(f"Writing blurbs for {len(group_app_ids)} games")
+        blurbs = chain_utils.get_blurb_chain(model=blurb_model).batch(
+            [{"review_text": chain_outputs[app_id]["score_breakdown_text"]} for app_id in group_app_ids],
+            config=[configs[app_id] for app_id in group_app_ids],
+            return_exceptions=True,
+        )
+        for app_id, blurb in zip(group_app_ids, blurbs):
+            if isinstance(blurb, Exception):
+                log.error(f"Error writing blurb for app_id={app_id}: {blurb}")
+                results[app_id] = blurb
+                continue
+            chain_output = chain_outputs[app_id]
+            chain_output["num_reviews_used"] = num_reviews_used[app_id]
+            chain_output["blurb"] = f"JUICE Score: {chain_output['juice_score']:.1f}. {blurb}"
+            chain_output["answered_by"] = MODEL_USAGE.pop(app_id)
+            results[app_id] = chain_output
+    return results
+
+
+def _iter_review_rounds(app_id, round_size, max_reviews, num_per_page, language, review_filter, review_type, allow_other_languages):
+    """Yields rounds of up to round_size unseen reviews, until max_reviews have been yielded or reviews run out."""
+    page_sources = [language] + (["all"] if allow_other_languages and language != "all" else [])
+    seen_review_ids = set()
+    pending_reviews = []
+    num_yielded = 0
+    for page_language in page_sources:
+        if page_language != language:
+            log.info(f"Ran out of {language} reviews after {len(seen_review_ids)}, continuing with all languages")
+        pages = steam_utils.iter_user_review_pages(
+            app_id, language=page_language, num_per_page=num_per_page, filter=review_filter, review_type=review_type
+        )
+        try:
+            for page_reviews, _ in pages:
+                for review in page_reviews:
+                    if review["recommendationid"] not in seen_review_ids:
+                        seen_review_ids.add(review["recommendationid"])
+                        pending_reviews.append(Review.from_steam(review))
+                while len(pending_reviews) >= round_size or num_yielded + len(pending_reviews) >= max_reviews:
+                    round_reviews = pending_reviews[: min(round_size, max_reviews - num_yielded)]
+                    pending_reviews = pending_reviews[len(round_reviews) :]
+                    num_yielded += len(round_reviews)
+                    yield round_reviews
+                    if num_yielded >= max_reviews:
+                        return
+        except Exception as e:
+            log.exception(f"Failed fetching {page_language} reviews for app_id={app_id}: {e}")
+    if pending_reviews:
+        yield pending_reviews
+
+
+@_scoped_model_usage
+def run_adaptive_for_app_id(
+    app_id,
+    stage_chains,
+    interim_aggregation_chain=None,
+    max_reviews=500,
+    round_size=100,
+    min_reviews=200,
+    tolerance=0.5,
+    patience=1,
+    num_per_page=100,
+    language="english",
+    review_filter="recent",
+    review_type="all",
+    allow_other_languages=True,
+    blurb_model="qwen2.5:7b",
+    callbacks=None,
+):
+    """
+    Like run_for_app_id, but fetches and summarizes reviews in rounds of round_size, running an interim aggregation
+    after each round. Stops once every aspect score moved by at most `tolerance` for `patience` consecutive rounds
+    (and at least min_reviews were used), or once max_reviews is reached. If interim_aggregation_chain is None the
+    interim aggregations use the final aggregation chain, and the last one is reused as the final result.
+    """
+    if round_size <= 0:
+        raise ValueError(f"round_size must be positive, got {round_size}")
+    config = _make_config(app_id, callbacks)
+    batch_summaries = []
+    previous_scores = None
+    interim_output = None
+    stable_rounds = 0
+    num_reviews_used = 0
+    converged = False
+    rounds = []
+    stage_stats = {}
+
+    review_rounds = _iter_review_rounds(
+        app_id, round_size, max_reviews, num_per_page, language, review_filter, review_type, allow_other_languages
+    )
+    for round_reviews in review_rounds:
+        num_reviews_used += len(round_reviews)
+        filter_output = stage_chains["filter"].invoke({"reviews": round_reviews}, config=config)
+        summarization_output = stage_chains["summarization"].invoke(filter_output, config=config)
+        # Chain outputs include their inputs, so this also holds the stats of the filter stage
+        _add_stage_stats(stage_stats, summarization_output)
+        batch_summaries.extend(summarization_output["batch_summaries"])
+
+        interim_output = (interim_aggregation_chain or stage_chains["aggregation"]).invoke(
+            {"batch_summaries": batch_summaries}, config=config
+        )
+        scores = {aspect: branch["aggregate_score"] for aspect, branch in interim_output["branches"].items()}
+        max_delta = None
+        if previous_scores is not None:
+            max_delta = max(abs(scores[aspect] - previous_scores[aspect]) for aspect in scores)
+            stable_rounds = stable_rounds + 1 if max_delta <= tolerance else 0
+        previous_scores = scores
+        rounds.append({"num_reviews_used": num_reviews_used, "scores": scores, "max_delta": max_delta})
+        log.info(f"Adaptive round {len(rounds)}: {num_reviews_used} reviews, scores={scores}, max_delta={max_delta}")
+
+        if num_reviews_used >= min_reviews and stable_rounds >= patience:
+            log.info(f"Aspect scores converged after {num_reviews_used} reviews, stopping early")
+            converged = True
+            review_rounds.close()
+            break
+
+    if interim_output is None:
+        raise ValueError(f"Failed to fetch any reviews for app_id={app_id}")
+
+    if interim_aggregation_chain is None:
+        chain_output = interim_output
+    else:
+        chain_output = stage_chains["aggregation"].invoke({"batch_summaries": batch_summaries}, config=config)
+
+    chain_output["num_reviews_used"] = num_reviews_used
+    chain_output.update(stage_stats)
+    chain_output["adaptive"] = {
+        "converged": converged,
+        "max_reviews": max_reviews,
+        "rounds": rounds,
+    }
+    return _add_scores_and_blurb(chain_output, blurb_model, config=config)
+
+
+@_scoped_model_usage
+def run_delta_for_app_id(
+    app_id,
+    stage_chains,
+    store,
+    delta_window=20,
+    num_reviews=200,
+    num_per_page=100,
+    language="english",
+    review_filter="recent",
+    review_type="all",
+    allow_other_languages=True,
+    blurb_model="qwen2.5:7b",
+    callbacks=None,
+):
+    """
+    Like run_for_app_id, but only filters and summarizes reviews not covered by the summaries stored for app_id in
+    `store` (a SummaryStore). The new batch summaries are merged with the delta_window most recent stored ones and
+    only the aggregation is rerun on them; the window only limits the aggregation input, all stored summaries are
+    kept. Games without stored summaries get a full run, which becomes the baseline for later delta runs. With the
+    "recent" review filter, fetching stops at the first page that contains an already covered review. Reviews of
+    summarization batches that failed (with a quorum below 1) are not marked as covered, so later delta runs
+    summarize them again.
+    """
+    config = _make_config(app_id, callbacks)
+    stored = store.load(app_id) or {"batch_summaries": [], "covered_review_ids": []}
+    covered_review_ids = set(stored["covered_review_ids"])
+
+    new_reviews = []
+    review_rounds = _iter_review_rounds(
+        app_id, num_per_page, num_reviews, num_per_page, language, review_filter, review_type, allow_other_languages
+    )
+    for round_reviews in review_rounds:
+        round_new_reviews = [review for review in round_reviews if review.recommendationid not in covered_review_ids]
+        new_reviews.extend(round_new_reviews)
+        if review_filter == "recent" and len(round_new_reviews) < len(round_reviews):
+            review_rounds.close()
+            break
+    log.info(
+        f"Found {len(new_reviews)} new reviews for app_id={app_id}, "
+        f"{len(stored['batch_summaries'])} stored batch summaries"
+    )
+
+    new_batch_summaries = []
+    stage_stats = {}
+    failed_review_ids = set()
+    if new_reviews:
+        filter_output = stage_chains["filter"].invoke({"reviews": new_reviews}, config=config)
+        summarization_output = stage_chains["summarization"].invoke(filter_output, config=config)
+        stage_stats = chain_utils.get_stage_stats(summarization_output)
+        new_batch_summaries = summarization_output["batch_summaries"]
+        failed_review_ids = set(summarization_output["summarization_stats"]["failed_review_ids"])
+
+    prior_batch_summaries = stored["batch_summaries"][-delta_window:] if delta_window else stored["batch_summaries"]
+    batch_summaries = prior_batch_summaries + new_batch_summaries
+    if not batch_summaries:
+        raise ValueError(f"Failed to fetch any reviews for app_id={app_id}")
+
+    chain_output = stage_chains["aggregation"].invoke(
+        {"batch_summaries": batch_summaries, **stage_stats}, config=config
+    )
+    store.save(
+        app_id,
+        stored["batch_summaries"] + new_batch_summaries,
+        covered_review_ids.union(
+            review.recommendationid for review in new_reviews if review.recommendationid not in failed_review_ids
+        ),
+    )
+
+    chain_output["num_reviews_used"] = len(new_reviews)
+    chain_output["delta"] = {
+        "num_new_reviews": len(new_reviews),
+        "num_new_summaries": len(new_batch_summaries),
+        "num_uncovered_reviews": len(failed_review_ids),
+        "num_prior_summaries": len(prior_batch_summaries),
+    }
+    return _add_scores_and_blurb(chain_output, blurb_model, config=config)
+
+
+def main_with_usage_callback(args, callbacks=None):
     with get_usage_metadata_callback() as cb:
-        main(args)
+        main(args, callbacks=callbacks)
         print("\nToken Usage Data:")
         print(json.dumps(cb.usage_metadata, indent=4))
 
 
-def main(args):
-    complete_chain = chain_utils.make_complete_chain(
+def export_traces(tracer, args):
+    if args.trace_file:
+        tracer.export_jsonl(args.trace_file)
+    if args.metrics_file:
+        tracer.export_prometheus(args.metrics_file)
+
+
+def make_chains(args):
+    stage_chains = chain_utils.make_stage_chains(
+        filter_model=args.filter_model,
+        summarization_model=args.summarization_model,
+        aggregation_model=args.aggregation_model,
+        summarization_batch_size=args.summarization_batch_size,
+        club_reviews_batch_size=args.club_reviews_batch_size,
+        include_llm_filter=args.enable_llm_filter,
+        normalize=not args.disable_normalization,
+        max_review_words=args.max_review_words or None,
+        sampling_embedding_model=args.sampling_embedding_model or None,
+        max_clusters=args.max_clusters,
+        thinking_budgets={
+            "filter": args.filter_thinking_budget,
+            "summarization": args.summarization_thinking_budget,
+            "aggregation": args.aggregation_thinking_budget,
+        },
+        native_structured_output=args.native_structured_output,
+        cascade_model=args.cascade_model or None,
+        cascade_borderline_scores=tuple(int(score) for score in args.cascade_borderline_scores.split(",") if score),
+        cascade_audit_fraction=args.cascade_audit_fraction,
+        summarization_retries=args.summarization_retries,
+        summarization_quorum=args.summarization_quorum,
+        interim_aggregation_model=args.interim_aggregation_model if args.adaptive else None,
+    )
+    stage_chains["complete"] = stage_chains["filter"] | stage_chains["summarization"] | stage_chains["aggregation"]
+    return stage_chains
+
+
+def run_with_args(app_id, chains, args, callbacks=None):
+    if args.delta:
+        return run_delta_for_app_id(
+            app_id,
+            chains,
+            summary_store.SummaryStore(args.summary_store_dir),
+            delta_window=args.delta_window,
+            num_reviews=args.num_reviews,
+            num_per_page=args.num_per_page,
+            language=args.language,
+            review_filter=args.filter,
+            review_type=args.review_type,
+            blurb_model=args.blurb_model,
+            callbacks=callbacks,
+        )
+    if args.adaptive:
+        return run_adaptive_for_app_id(
+            app_id,
+            chains,
+            interim_aggregation_chain=chains["interim_aggregation"],
+            max_reviews=args.num_reviews,
+            round_size=args.adaptive_round_size,
+            min_reviews=args.adaptive_min_reviews,
+            tolerance=args.adaptive_tolerance,
+            patience=args.adaptive_patience,
+            num_per_page=args.num_per_page,
+            language=args.language,
+            review_filter=args.filter,
+            review_type=args.review_type,
+            blurb_model=args.blurb_model,
+            callbacks=callbacks,
+        )
+    return run_for_app_id(
+        app_id,
+        chains["complete"],
+        num_reviews=args.num_reviews,
+        num_per_page=args.num_per_page,
+        language=args.language,
+        review_filter=args.filter,
+        review_type=args.review_type,
+        blurb_model=args.blurb_model,
+        callbacks=callbacks,
+    )
+
+
+RESULT_COLUMNS = [
+    "app_id",
+    "name",
+    "url",
+    "metacritic_score",
+    "genres",
+    "juice_score",
+    "top_2_score",
+    "all_score",
+    "num_reviews_used",
+    "tokens_saved",
+    "answered_by",
+    "blurb",
+] + [
+    f"{aspect}_{field}"
+    for aspect in sorted(aggregation_prompts.JUICE_AGGREGATION_PROMPTS.keys())
+    for field in ["score", "explanation"]
+]
+
+
+def make_result_row(app_id, game_details, chain_output):
+    genres = [g["description"] for g in game_details.get("genres", [])]
+    row = {
+        "app_id": app_id,
+        "name": game_details["name"],
+        "url": f"store.steampowered.com/app/{app_id}",
+        "metacritic_score": game_details.get("metacritic", {}).get("score", None),
+        "genres": json.dumps(genres),
+        "juice_score": chain_output["juice_score"],
+        "top_2_score": chain_output["top_2_score"],
+        "all_score": chain_output["all_score"],
+        "num_reviews_used": chain_output["num_reviews_used"],
+        "tokens_saved": (chain_output.get("normalization_stats") or {}).get("tokens_saved"),
+        "answered_by": json.dumps(chain_output.get("answered_by", {})),
+        "blurb": chain_output["blurb"],
+    }
+    for aspect in sorted(aggregation_prompts.JUICE_AGGREGATION_PROMPTS.keys()):
+        row[f"{aspect}_score"] = chain_output["branches"][aspect]["aggregate_score"]
+        row[f"{aspect}_explanation"] = chain_output["branches"][aspect]["score_explanation"]
+    return row
+
+
+def get_model_config(args):
+    return {
+        "filter_model": args.filter_model if args.enable_llm_filter else None,
+        "summarization_model": args.summarization_model,
+        "aggregation_model": args.aggregation_model,
+        "cascade_model": args.cascade_model or None,
+        "blurb_model": args.blurb_model,
+        "num_reviews": args.num_reviews,
+        "mode": "adaptive" if args.adaptive else "delta" if args.delta else "full",
+        "prompt_version": args.prompt_version,
+    }
+
+
+def start_results_run(args, mode):
+    """Records a run in the results database. Returns the database and the run ID, or (None, None) if disabled."""
+    if not args.results_db:
+        return None, None
+    store = results_db.ResultsDB(args.results_db)
+    run_id = f"{datetime.now().strftime('%Y-%m-%d_%H:%M:%S')}_{socket.gethostname()}_{os.getpid()}"
+    store.start_run(run_id, mode, get_model_config(args))
+    return store, run_id
+
+
+def add_cascade_stats(cascade_totals, cascade_reasons, cascade_stats):
+    cascade_totals.update({key: value for key, value in cascade_stats.items() if key != "escalation_reasons"})
+    cascade_reasons.update(cascade_stats.get("escalation_reasons", {}))
+
+
+def log_cascade_stats(cascade_totals, cascade_reasons):
+    """Logs how often the aggregation cascade escalated and how well its models agreed, over a whole run."""
+    if not cascade_totals["num_aspects"]:
+        return
+    log.info(
+        f"Aggregation cascade escalated {cascade_totals['num_escalated']}/{cascade_totals['num_aspects']} aspect "
+        f"scores: {dict(cascade_reasons)}"
+    )
+    if cascade_totals["num_compared"]:
+        num_compared = cascade_totals["num_compared"]
+        log.info(
+            f"Small and large models agreed exactly on {cascade_totals['num_exact_agreement'] / num_compared:.0%} "
+            f"and within 1 point on {cascade_totals['num_within_1'] / num_compared:.0%} of {num_compared} compared "
+            f"scores, mean absolute difference {cascade_totals['total_abs_difference'] / num_compared:.2f}"
+        )
+
+
+def log_summarization_stats(summarization_totals):
+    """Logs the summarization batch success rate over a whole run."""
+    if not summarization_totals["num_batches"]:
+        return
+    num_batches = summarization_totals["num_batches"]
+    log.info(
+        f"{num_batches - summarization_totals['num_failed_batches']}/{num_batches} summarization batches succeeded "
+        f"({summarization_totals['num_retried_batches']} batch retries), "
+        f"{summarization_totals['num_partial_games']} games were scored without their failed batches"
+    )
+
+
+def run_group_with_args(app_ids, chains, args, callbacks=None):
+    return run_for_app_id_group(
+        app_ids,
+        chains,
+        num_reviews=args.num_reviews,
+        num_per_page=args.num_per_page,
+        language=args.language,
+        review_filter=args.filter,
+        review_type=args.review_type,
+        blurb_model=args.blurb_model,
+        max_concurrency=args.group_max_concurrency or None,
+        callbacks=callbacks,
+    )
+
+
+def run_async_with_args(app_ids, chains, args, callbacks=None):
+    return asyncio.run(
+        arun_for_app_ids(
+            app_ids,
+            chains["complete"],
+            max_in_flight=args.async_games,
+            num_reviews=args.num_reviews,
+            num_per_page=args.num_per_page,
+            language=args.language,
+            review_filter=args.filter,
+            review_type=args.review_type,
+            blurb_model=args.blurb_model,
+            callbacks=callbacks,
+        )
+    )
+
+
+def run_plan(args):
+    """
+    Projects the requests, tokens and wall time of a run per stage and provider, without calling any model, from
+    a sample of its games. Stored review files (see planner.load_stored_reviews) are used where available.
+    """
+    if args.run_for_file:
+        app_ids = sorted(set(x.strip() for x in open(args.run_for_file, "r").readlines() if x.strip()))
+    else:
+        app_ids = [steam_utils.get_game_id_from_url(args.steam_url) if args.steam_url else args.app_id]
+    rate_limits = {}
+    if args.rate_limits:
+        with open(args.rate_limits, "r") as f:
+            rate_limits = json.load(f)
+    run_planner = planner.RunPlanner(
         filter_model=args.filter_model,
         summarization_model=args.summarization_model,
         aggregation_model=args.aggregation_model,
+        blurb_model=args.blurb_model,
         summarization_batch_size=args.summarization_batch_size,
         club_reviews_batch_size=args.club_reviews_batch_size,
         include_llm_filter=args.enable_llm_filter,
+        normalize=not args.disable_normalization,
+        max_review_words=args.max_review_words or None,
+        max_clusters=args.max_clusters if args.sampling_embedding_model else None,
+        cascade_model=args.cascade_model or None,
+        thinking_budgets={
+            "filter": args.filter_thinking_budget,
+            "summarization": args.summarization_thinking_budget,
+            "aggregation": args.aggregation_thinking_budget,
+        },
+        rate_limits=rate_limits,
+        trace_file=args.trace_file,
+        num_per_page=args.num_per_page,
     )
+    if args.adaptive or args.delta:
+        log.warning("Planning a full run, adaptive and delta runs use fewer reviews")
+
+    sampled_app_ids = random.Random(0).sample(app_ids, min(args.plan_sample_size, len(app_ids)))
+    for app_id in tqdm(sampled_app_ids):
+        try:
+            reviews = planner.load_stored_reviews(app_id, args.plan_reviews_dir, limit=args.num_reviews)
+            if reviews is None:
+                reviews = _get_reviews(
+                    app_id, args.num_reviews, args.num_per_page, args.language, args.filter, args.review_type
+                )
+            run_planner.add_game(reviews)
+        except Exception as e:
+            log.error(f"Error sampling reviews for app_id={app_id}: {e}")
+    plan = run_planner.project(len(app_ids))
+    planner.log_plan(plan)
+    return plan
+
+
+def main(args, callbacks=None):
+    if args.plan:
+        run_plan(args)
+        return
+
+    chains = make_chains(args)
+
+    if args.worker:
+        run_worker(args, chains, callbacks=callbacks)
+        return
 
     if args.app_id or args.steam_url:
+        store, run_id = start_results_run(args, "single")
         if args.steam_url:
             args.app_id = steam_utils.get_game_id_from_url(args.steam_url)
         game_details = steam_utils.get_game_details(args.app_id)
@@ -153,20 +827,14 @@ def main(args):
         os.makedirs("chain_outputs/", exist_ok=True)
 
         start_time = time.time()
-        chain_output = run_for_app_id(
-            args.app_id,
-            complete_chain,
-            num_reviews=args.num_reviews,
-            num_per_page=args.num_per_page,
-            language=args.language,
-            review_filter=args.filter,
-            review_type=args.review_type,
-        )
+        chain_output = run_with_args(args.app_id, chains, args, callbacks=callbacks)
         log.info(f"Took {time.time()-start_time} seconds to run complete chain")
 
         log.info(f"Saving chain output data to {output_file}")
         with open(output_file, "w") as f:
             json.dump(chain_output, f, indent=4)
+        if store is not None:
+            store.upsert(run_id, [make_result_row(args.app_id, game_details, chain_output)])
 
         print("\n" + chain_output["blurb"] + "\n")
         print(chain_output["score_breakdown_text"])
@@ -179,70 +847,73 @@ def main(args):
     else:
         app_ids = [x.strip() for x in open(args.run_for_file, "r").readlines()]
         app_ids = sorted(list(set([app_id for app_id in app_ids if app_id])))
-        tuples = []
+        rows = []
         skipped_app_ids = []
-        columns = [
-            "app_id",
-            "name",
-            "url",
-            "metacritic_score",
-            "genres",
-            "juice_score",
-            "top_2_score",
-            "all_score",
-            "blurb",
-        ]
-        review_aspects = sorted(list(aggregation_prompts.JUICE_AGGREGATION_PROMPTS.keys()))
-        for aspect in review_aspects:
-            columns.append(f"{aspect}_score")
-            columns.append(f"{aspect}_explanation")
-
-        for app_id in tqdm(app_ids):
-            try:
-                game_details = steam_utils.get_game_details(app_id.strip())
-                if not game_details:
-                    raise ValueError(f"Failed to fetch game details for app_id={app_id}")
-            except Exception as e:
-                log.exception(f"Error getting game details for app_id={args.app_id}: {e}")
-                log.info(f"Skipping {app_id} due to error")
-                skipped_app_ids.append(app_id)
-                continue
-            genres = [g["description"] for g in game_details.get("genres", [])]
-            log.info(f"Running for app_id {app_id}: {game_details['name']}")
-            try:
-                chain_output = run_for_app_id(
-                    app_id,
-                    complete_chain,
-                    num_reviews=args.num_reviews,
-                    num_per_page=args.num_per_page,
-                    language=args.language,
-                    review_filter=args.filter,
-                    review_type=args.review_type,
+        store, run_id = start_results_run(args, "batch")
+        cascade_totals, cascade_reasons = Counter(), Counter()
+        summarization_totals = Counter()
+
+        if args.async_games > 0 and not (args.adaptive or args.delta):
+            # Game details are fetched per group, so groups are larger than the number of games in flight
+            async_group_size = max(args.async_games * 4, 64)
+            groups = [app_ids[i : i + async_group_size] for i in range(0, len(app_ids), async_group_size)]
+        elif args.group_size > 1 and not (args.adaptive or args.delta):
+            groups = [app_ids[i : i + args.group_size] for i in range(0, len(app_ids), args.group_size)]
+        else:
+            groups = [[app_id] for app_id in app_ids]
+
+        for group in tqdm(groups):
+            group_details = {}
+            for app_id in group:
+                try:
+                    game_details = steam_utils.get_game_details(app_id.strip())
+                    if not game_details:
+                        raise ValueError(f"Failed to fetch game details for app_id={app_id}")
+                    group_details[app_id] = game_details
+                except Exception as e:
+                    log.exception(f"Error getting game details for app_id={app_id}: {e}")
+                    log.info(f"Skipping {app_id} due to error")
+                    skipped_app_ids.append(app_id)
+
+            if args.async_games > 0 and not (args.adaptive or args.delta):
+                log.info(f"Running {len(group_details)} app_ids, {args.async_games} at a time on one event loop")
+                chain_outputs = run_async_with_args(list(group_details.keys()), chains, args, callbacks=callbacks)
+            elif len(group) > 1:
+                log.info(f"Running for group of {len(group_details)} app_ids: {list(group_details.keys())}")
+                chain_outputs = run_group_with_args(list(group_details.keys()), chains, args, callbacks=callbacks)
+            else:
+                chain_outputs = {}
+                for app_id, game_details in group_details.items():
+                    log.info(f"Running for app_id {app_id}: {game_details['name']}")
+                    try:
+                        chain_outputs[app_id] = run_with_args(app_id, chains, args, callbacks=callbacks)
+                    except Exception as e:
+                        chain_outputs[app_id] = e
+
+            for app_id, chain_output in chain_outputs.items():
+                if isinstance(chain_output, Exception):
+                    log.error(f"Error running chain for app_id={app_id}: {chain_output}")
+                    log.info(f"Skipping {app_id} due to error")
+                    skipped_app_ids.append(app_id)
+                    continue
+                rows.append(make_result_row(app_id, group_details[app_id], chain_output))
+                if store is not None:
+                    store.upsert(run_id, rows[-1:])
+                add_cascade_stats(cascade_totals, cascade_reasons, chain_output.get("cascade_stats") or {})
+                summarization_stats = chain_output.get("summarization_stats") or {}
+                summarization_totals.update(
+                    {
+                        key: value
+                        for key, value in summarization_stats.items()
+                        if key not in ("success_rate", "failed_review_ids")
+                    }
                 )
-            except Exception as e:
-                log.error(f"Error running chain for app_id={app_id}: {e}")
-                log.info(f"Skipping {app_id} due to error")
-                skipped_app_ids.append(app_id)
-                continue
-            datapoint = [
-                app_id,
-                game_details["name"],
-                f"store.steampowered.com/app/{app_id}",
-                game_details.get("metacritic", {}).get("score", None),
-                json.dumps(genres),
-                chain_output["juice_score"],
-                chain_output["top_2_score"],
-                chain_output["all_score"],
-                chain_output["blurb"],
-            ]
-            for aspect in review_aspects:
-                aspect_score = chain_output["branches"][aspect]["aggregate_score"]
-                aspect_explanation = chain_output["branches"][aspect]["score_explanation"]
-                datapoint.extend([aspect_score, aspect_explanation])
-            tuples.append(datapoint)
-            log.info(f"{game_details['name']}, {chain_output['blurb']}")
-
-        df = pd.DataFrame(tuples, columns=columns)
+                summarization_totals["num_partial_games"] += summarization_stats.get("num_failed_batches", 0) > 0
+                log.info(f"{group_details[app_id]['name']}, {chain_output['blurb']}")
+
+        log_cascade_stats(cascade_totals, cascade_reasons)
+        log_summarization_stats(summarization_totals)
+        df = pd.DataFrame(rows, columns=RESULT_COLUMNS)
         output_file = f"run_results_{datetime.now().strftime('%Y-%m-%d_%H:%M')}.csv"
         log.info(f"Saving results to {output_file}")
         df.to_csv(output_file, index=False)
@@ -253,44 +924,277 @@ def main(args):
         log.info(f"Done!")
 
 
+def run_worker(args, chains, callbacks=None):
+    """
+    Pulls app IDs from the shared job queue until no unfinished jobs are left, writing each result back to the
+    queue database. Any number of workers on one or more hosts can share the same queue database.
+    """
+    queue = job_queue.JobQueue(args.queue_db, lease_seconds=args.lease_seconds, max_attempts=args.max_attempts)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    store, run_id = start_results_run(args, "worker")
+    log.info(f"Starting worker {worker_id} on queue {args.queue_db}: {queue.stats()}")
+
+    num_done = 0
+    while True:
+        app_id = queue.lease(worker_id)
+        if app_id is None:
+            if not queue.has_unfinished_jobs():
+                break
+            # Other workers still hold leases that may expire and need to be picked up
+            time.sleep(args.poll_interval)
+            continue
+
+        with job_queue.LeaseHeartbeat(queue, app_id, worker_id):
+            try:
+                game_details = steam_utils.get_game_details(app_id)
+                if not game_details:
+                    raise ValueError(f"Failed to fetch game details for app_id={app_id}")
+                log.info(f"Running for app_id {app_id}: {game_details['name']}")
+                chain_output = run_with_args(app_id, chains, args, callbacks=callbacks)
+            except Exception as e:
+                log.error(f"Error running chain for app_id={app_id}: {e}")
+                queue.fail(app_id, worker_id, e)
+                continue
+        result_row = make_result_row(app_id, game_details, chain_output)
+        if not queue.complete(app_id, worker_id, result_row):
+            log.warning(f"Dropping result for app_id={app_id}, the lease was taken over by another worker")
+            continue
+        if store is not None:
+            store.upsert(run_id, [result_row])
+        num_done += 1
+        log.info(f"{game_details['name']}, {chain_output['blurb']}")
+
+    log.info(f"Worker {worker_id} finished {num_done} jobs, queue: {queue.stats()}")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Filter reviews")
     me_group = parser.add_mutually_exclusive_group(required=True)
     me_group.add_argument("--app_id", type=str, help="Steam app ID")
     me_group.add_argument("--steam_url", type=str, help="URL to Steam store page")
     me_group.add_argument("--run_for_file", type=str, help="Path to file containing list of app IDs")
+    me_group.add_argument(
+        "--worker", action="store_true", help="Process app IDs from the shared job queue (see job_queue.py)"
+    )
+    parser.add_argument("--queue_db", type=str, default="juice_queue.db", help="Path to the shared job queue database")
+    parser.add_argument(
+        "--results_db", type=str, default="juice_results.db", help="Results database, see results_db.py ('' disables)"
+    )
+    parser.add_argument("--lease_seconds", type=int, default=900, help="Job lease duration, renewed by heartbeats")
+    parser.add_argument("--max_attempts", type=int, default=3, help="Attempts per job before it is dead-lettered")
+    parser.add_argument("--poll_interval", type=float, default=10, help="Seconds to wait when no job is available")
     parser.add_argument("--enable_llm_filter", action="store_true", help="Enable LLM filtering")
+    parser.add_argument(
+        "--disable_normalization", action="store_true", help="Send review texts to the LLMs without normalization"
+    )
+    parser.add_argument(
+        "--max_review_words",
+        type=int,
+        default=300,
+        help="Longer reviews are shortened by extractive sentence selection during normalization (0 disables)",
+    )
+    parser.add_argument(
+        "--sampling_embedding_model",
+        type=str,
+        default="",
+        help="Embedding model for cluster sampling; if set, only one representative per cluster of similar "
+        "reviews is summarized",
+    )
+    parser.add_argument("--max_clusters", type=int, default=40, help="Maximum number of clusters per game")
     parser.add_argument("--filter_model", type=str, default="gemini-2.0-flash-lite")
     parser.add_argument("--summarization_model", type=str, default="gemini-2.0-flash")
     parser.add_argument("--summarization_batch_size", type=int, default=10, help="Batch size for summarization chain")
+    parser.add_argument(
+        "--summarization_retries", type=int, default=2, help="Retries of failed summarization batches (only those)"
+    )
+    parser.add_argument(
+        "--summarization_quorum",
+        type=float,
+        default=1.0,
+        help="Fraction of summarization batches that must succeed to score a game without the failed ones",
+    )
     parser.add_argument("--aggregation_model", type=str, default="gemini-2.0-flash")
     parser.add_argument("--blurb_model", type=str, default="gemini-2.0-flash-lite")
+    parser.add_argument(
+        "--cascade_model",
+        type=str,
+        default="",
+        help="Small model that scores aspects first, escalating to --aggregation_model only when needed",
+    )
+    parser.add_argument(
+        "--cascade_borderline_scores", type=str, default="5,6", help="Cascade model scores that are always escalated"
+    )
+    parser.add_argument(
+        "--cascade_audit_fraction", type=float, default=0.05, help="Fraction of cascade scores checked by both models"
+    )
+    parser.add_argument(
+        "--native_structured_output",
+        action="store_true",
+        help="Constrain LLM responses to the output schema through the provider instead of format instructions",
+    )
+    for stage in ["filter", "summarization", "aggregation"]:
+        parser.add_argument(
+            f"--{stage}_thinking_budget",
+            type=int,
+            default=0,
+            help=f"Reasoning token budget per {stage} call of thinking models (0 disables thinking, -1 is unbounded)",
+        )
     parser.add_argument("--num_reviews", type=int, default=500, help="Number of reviews to filter")
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Summarize reviews in rounds and stop once aspect scores converge (--num_reviews becomes the cap)",
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="Only summarize reviews not covered by the stored summaries of a game and rerun aggregation",
+    )
+    parser.add_argument(
+        "--delta_window", type=int, default=20, help="Number of most recent stored batch summaries to aggregate over"
+    )
+    parser.add_argument(
+        "--summary_store_dir", type=str, default="summary_store", help="Directory of stored summaries for --delta"
+    )
+    parser.add_argument("--adaptive_round_size", type=int, default=100, help="Reviews fetched per adaptive round")
+    parser.add_argument(
+        "--adaptive_min_reviews", type=int, default=200, help="Minimum reviews to use before stopping early"
+    )
+    parser.add_argument(
+        "--adaptive_tolerance", type=float, default=0.5, help="Max per-aspect score change to consider scores stable"
+    )
+    parser.add_argument(
+        "--adaptive_patience", type=int, default=1, help="Number of consecutive stable rounds needed to stop early"
+    )
+    parser.add_argument(
+        "--interim_aggregation_model",
+        type=str,
+        default="",
+        help="Cheaper model for interim aggregations in adaptive mode (defaults to the aggregation model)",
+    )
     parser.add_argument("--language", type=str, default="english", help="Language for reviews")
     parser.add_argument("--num_per_page", type=int, default=100, help="Number of reviews per page")
     parser.add_argument("--filter", type=str, default="recent", help="Filter for reviews. Can be 'all' or 'recent'.")
     parser.add_argument(
         "--review_type", type=str, default="all", help="Review type. Can be 'positive', 'negative' or 'all'."
     )
+    parser.add_argument(
+        "--fallback_languages",
+        type=str,
+        default=",".join(steam_utils.FALLBACK_LANGUAGES),
+        help="Comma-separated languages fetched concurrently when there are too few reviews in --language",
+    )
+    parser.add_argument(
+        "--store_base_url", type=str, default=steam_utils.STORE_BASE_URL, help="Base URL of the Steam store API"
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Dry run: project requests, tokens and wall time per stage and provider without calling any model",
+    )
+    parser.add_argument("--plan_sample_size", type=int, default=20, help="Games sampled to project a --plan from")
+    parser.add_argument(
+        "--plan_reviews_dir",
+        type=str,
+        default=".",
+        help="With --plan, use steam_reviews_{app_id}_*.json files in this directory instead of fetching reviews",
+    )
+    parser.add_argument(
+        "--rate_limits",
+        type=str,
+        default="",
+        help="With --plan, JSON file overriding the limits (rpm, tpm, concurrency...) per provider or model",
+    )
     parser.add_argument("--verbose", action="store_true", help="Verbose mode")
     parser.add_argument("--debug", action="store_true", help="Debug mode")
     parser.add_argument("--skip_cache", action="store_true", help="Skip caching local db")
     parser.add_argument(
-        "--overwrite_cache", action="store_true", help="Overwrite cache instead of using it for lookups"
+        "--overwrite_cache",
+        type=str,
+        nargs="?",
+        const="*",
+        default="",
+        help="Overwrite cache instead of using it for lookups, for all models or a comma-separated list of models",
+    )
+    parser.add_argument("--cache_db", type=str, default=".llm_cache.db", help="Path to the LLM cache database")
+    parser.add_argument("--cache_max_size_mb", type=float, default=1024, help="Evict LRU cache entries beyond this")
+    parser.add_argument("--cache_max_age_days", type=float, default=0, help="Evict cache entries older than this")
+    parser.add_argument(
+        "--prompt_version", type=str, default="", help="Cache namespace, bump to keep responses of old prompts apart"
     )
     parser.add_argument("--club_reviews_batch_size", type=int, default=4, help="Batch size for club reviews")
+    parser.add_argument(
+        "--group_size",
+        type=int,
+        default=0,
+        help="With --run_for_file, run each stage for a group of this many games before moving to the next model",
+    )
+    parser.add_argument(
+        "--async_games",
+        type=int,
+        default=0,
+        help="With --run_for_file, score this many games concurrently on one event loop (async chains)",
+    )
+    parser.add_argument(
+        "--group_max_concurrency", type=int, default=0, help="Max games processed in parallel within a stage"
+    )
+    parser.add_argument(
+        "--ollama_keep_alive",
+        type=lambda x: int(x) if x.lstrip("-").isdigit() else x,
+        default=None,
+        help="How long Ollama keeps models loaded after a request (e.g. '30m', '-1' for forever)",
+    )
+    parser.add_argument(
+        "--ollama_endpoints",
+        type=str,
+        default="",
+        help="Comma-separated Ollama base URLs to balance all Ollama models over, or a JSON file mapping model names "
+        "(or '*') to lists of base URLs",
+    )
     parser.add_argument("--report_token_usage", action="store_true", help="Report token usage")
+    parser.add_argument("--trace_file", type=str, default="", help="Append per-stage/per-LLM-call spans to this JSONL file")
+    parser.add_argument(
+        "--metrics_file", type=str, default="", help="Write per-stage metrics to this Prometheus text format file"
+    )
     args = parser.parse_args()
+    if args.delta and args.adaptive:
+        parser.error("--delta and --adaptive can't be combined")
+    if args.adaptive_round_size <= 0:
+        parser.error("--adaptive_round_size must be positive")
+    if args.num_per_page <= 0:
+        parser.error("--num_per_page must be positive")
 
     set_verbose(args.verbose)
     set_debug(args.debug)
+    steam_utils.STORE_BASE_URL = args.store_base_url
+    steam_utils.FALLBACK_LANGUAGES = [language for language in args.fallback_languages.split(",") if language]
+    chain_utils.OLLAMA_KEEP_ALIVE = args.ollama_keep_alive
+    if os.path.exists(args.ollama_endpoints):
+        with open(args.ollama_endpoints, "r") as f:
+            chain_utils.OLLAMA_ENDPOINTS = json.load(f)
+    elif args.ollama_endpoints:
+        chain_utils.OLLAMA_ENDPOINTS = {"*": [url for url in args.ollama_endpoints.split(",") if url]}
+    cache = None
     if not args.skip_cache:
-        if not args.overwrite_cache:
-            set_llm_cache(SQLiteCache(database_path=".langchain_cache.db"))
+        cache = TracedLLMCache(
+            database_path=args.cache_db,
+            max_size_mb=args.cache_max_size_mb,
+            max_age_days=args.cache_max_age_days or None,
+            prompt_version=args.prompt_version,
+            overwrite_models=[model for model in args.overwrite_cache.split(",") if model],
+        )
+        set_llm_cache(cache)
+
+    tracer = tracing.StageTracer() if args.trace_file or args.metrics_file else None
+    callbacks = [tracer] if tracer else None
+    try:
+        if args.report_token_usage:
+            main_with_usage_callback(args, callbacks=callbacks)
         else:
-            set_llm_cache(OverwriteSQLiteCache(database_path=".langchain_cache.db"))
-    
-    if args.report_token_usage:
-        main_with_usage_callback(args)
-    else:
-        main(args)
+            main(args, callbacks=callbacks)
+    finally:
+        if tracer:
+            export_traces(tracer, args)
+        if cache:
+            cache_stats = cache.stats()
+            log.info(f"LLM cache hits: {cache_stats['hits']}, misses: {cache_stats['misses']}")
@@ -0,0 +1,165 @@
+import argparse
+import glob
+import json
+import os
+import re
+import time
+
+import glog as log
+import numpy as np
+import pandas as pd
+
+from constants import ASPECT_NAMES
+
+
+ASPECTS = list(ASPECT_NAMES.keys())
+
+# Aspect weights of the weighted ("all") score; profiles are normalized to sum to 1 when applied
+WEIGHT_PROFILES = {
+    "default": {
+        "lore_worldbuilding_atmosphere": 0.20,
+        "exploration": 0.20,
+        "gameplay_mechanics": 0.20,
+        "emotional_engagement": 0.1,
+        "bloat_grinding": 0.1,
+        "challenge": 0.20,
+    },
+    "equal": {aspect: 1.0 for aspect in ASPECTS},
+}
+
+CHAIN_OUTPUT_FILE_RE = re.compile(r"chain_output_(\d+)_(.*)\.json$")
+
+
+def get_weights(profile="default", weights_file=None):
+    """Returns the aspect weights of a named profile, or of a JSON file mapping aspects to weights."""
+    if weights_file:
+        with open(weights_file, "r") as f:
+            weights = json.load(f)
+    elif profile in WEIGHT_PROFILES:
+        weights = WEIGHT_PROFILES[profile]
+    else:
+        raise ValueError(f"Unknown weight profile: {profile}, expected one of {list(WEIGHT_PROFILES)}")
+    unknown_aspects = set(weights) - set(ASPECTS)
+    if unknown_aspects:
+        raise ValueError(f"Unknown aspects in weights: {sorted(unknown_aspects)}")
+    return {aspect: float(weights.get(aspect, 0.0)) for aspect in ASPECTS}
+
+
+def compute_scores(aspect_scores: pd.DataFrame, weights=None) -> pd.DataFrame:
+    """
+    Computes the weighted, top-2 and juice scores for many games at once.
+
+    The bloat/grinding score is capped to the best other aspect score before weighting. Games with missing
+    aspect scores fall back to the plain mean of the aspects they have.
+
+    Args:
+        aspect_scores (pd.DataFrame): One row per game and one column per aspect (missing scores as NaN).
+        weights (dict, optional): Aspect weights, defaults to the "default" profile.
+
+    Returns:
+        pd.DataFrame: all_score, top_2_score and juice_score columns, indexed like aspect_scores.
+    """
+    weights = weights or get_weights("default")
+    scores = aspect_scores.reindex(columns=ASPECTS).to_numpy(dtype=float)
+    other_aspects = np.array([aspect != "bloat_grinding" for aspect in ASPECTS])
+    bloat_index = ASPECTS.index("bloat_grinding")
+
+    other_scores = scores[:, other_aspects]
+    missing = np.isnan(scores).any(axis=1)
+    with np.errstate(all="ignore"):
+        capped_scores = scores.copy()
+        capped_scores[:, bloat_index] = np.fmin(scores[:, bloat_index], np.nanmax(other_scores, axis=1))
+        weight_vector = np.array([weights[aspect] for aspect in ASPECTS])
+        weighted_scores = np.nan_to_num(capped_scores) @ (weight_vector / weight_vector.sum())
+        all_scores = np.where(missing, np.nanmean(scores, axis=1), weighted_scores)
+
+        # Sort descending with missing scores last, then average the two best
+        sorted_scores = -np.sort(np.where(np.isnan(other_scores), np.inf, -other_scores), axis=1)[:, :2]
+        top_2_scores = np.nanmean(np.where(np.isinf(sorted_scores), np.nan, sorted_scores), axis=1)
+
+    return pd.DataFrame(
+        {"all_score": all_scores, "top_2_score": top_2_scores, "juice_score": (all_scores + top_2_scores) / 2},
+        index=aspect_scores.index,
+    )
+
+
+def score_aspects(aspect_scores, weights=None):
+    """
+    Computes the scores of a single game.
+
+    Args:
+        aspect_scores (dict): Aspect name to score.
+        weights (dict, optional): Aspect weights, defaults to the "default" profile.
+
+    Returns:
+        dict: all_score, top_2_score and juice_score.
+    """
+    scores = compute_scores(pd.DataFrame([aspect_scores]), weights=weights)
+    return {key: float(value) for key, value in scores.iloc[0].items()}
+
+
+def load_chain_outputs(chain_outputs_dir="chain_outputs"):
+    """Reads per-aspect scores from the chain output JSON files written by run_chains.py."""
+    rows = []
+    for path in sorted(glob.glob(os.path.join(chain_outputs_dir, "chain_output_*.json")), key=os.path.getmtime):
+        match = CHAIN_OUTPUT_FILE_RE.search(os.path.basename(path))
+        if match is None:
+            continue
+        with open(path, "r") as f:
+            chain_output = json.load(f)
+        row = {"app_id": match.group(1), "name": match.group(2).replace("_", " ")}
+        for aspect, branch in chain_output.get("branches", {}).items():
+            row[aspect] = branch.get("aggregate_score")
+        rows.append(row)
+    return pd.DataFrame(rows, columns=["app_id", "name"] + ASPECTS)
+
+
+def load_results_csvs(paths):
+    """Reads per-aspect scores (the {aspect}_score columns) from results CSVs written by run_chains.py."""
+    frames = []
+    for path in sorted(paths, key=os.path.getmtime):
+        df = pd.read_csv(path, dtype={"app_id": str})
+        df = df.rename(columns={f"{aspect}_score": aspect for aspect in ASPECTS})
+        frames.append(df.reindex(columns=["app_id", "name"] + ASPECTS))
+    if not frames:
+        return pd.DataFrame(columns=["app_id", "name"] + ASPECTS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def rank_games(aspect_scores: pd.DataFrame, weights=None) -> pd.DataFrame:
+    """
+    Scores and ranks games, keeping only the most recently loaded scores of each app ID.
+
+    Returns:
+        pd.DataFrame: The input columns plus the scores and a 1-based rank, best game first.
+    """
+    aspect_scores = aspect_scores.drop_duplicates(subset="app_id", keep="last").reset_index(drop=True)
+    ranked = pd.concat([aspect_scores, compute_scores(aspect_scores[ASPECTS], weights=weights)], axis=1)
+    ranked = ranked.sort_values("juice_score", ascending=False, kind="stable").reset_index(drop=True)
+    ranked.insert(0, "rank", np.arange(1, len(ranked) + 1))
+    return ranked
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score and rank stored results without any LLM calls")
+    parser.add_argument("--chain_outputs_dir", type=str, default="", help="Directory of chain output JSON files")
+    parser.add_argument("--results_csv", type=str, nargs="*", default=[], help="Results CSV files or glob patterns")
+    parser.add_argument("--profile", type=str, default="default", choices=list(WEIGHT_PROFILES.keys()))
+    parser.add_argument("--weights_file", type=str, default="", help="JSON file mapping aspects to weights")
+    parser.add_argument("--output_file", type=str, default="rankings.csv")
+    args = parser.parse_args()
+
+    frames = []
+    if args.chain_outputs_dir:
+        frames.append(load_chain_outputs(args.chain_outputs_dir))
+    if args.results_csv:
+        frames.append(load_results_csvs([path for pattern in args.results_csv for path in glob.glob(pattern)]))
+    if not frames:
+        parser.error("Pass --chain_outputs_dir and/or --results_csv")
+
+    start_time = time.time()
+    rankings = rank_games(pd.concat(frames, ignore_index=True), weights=get_weights(args.profile, args.weights_file))
+    log.info(f"Ranked {len(rankings)} games in {time.time() - start_time:.3f} seconds")
+    log.info(f"Saving rankings to {args.output_file}")
+    rankings.to_csv(args.output_file, index=False)
+    print(rankings[["rank", "app_id", "name", "juice_score", "top_2_score", "all_score"]].head(20).to_string(index=False))
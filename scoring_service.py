@@ -0,0 +1,380 @@
+"""
+Long-running HTTP service that scores games on request.
+
+The chains are built once at startup and shared by a pool of worker threads, so requests pay neither interpreter
+startup nor chain construction. Requests for an app ID that is already queued or running join the existing job
+instead of scoring the game twice, and games scored within the freshness window are answered from memory.
+
+Endpoints:
+    POST /jobs                  {"app_id": "1245620", "force": false}, returns the job (202, or 200 when cached)
+    GET  /jobs/{job_id}         Job status, current stage, progress events and the result once done
+    GET  /jobs/{job_id}/events  Streams progress events as JSON lines until the job finishes
+    GET  /health                Number of jobs per status and the size of the result cache
+
+Usage:
+    python3 scoring_service.py --port 8780 --workers 4 --freshness_hours 24
+    curl -s -X POST localhost:8780/jobs -d '{"app_id": "1245620"}'
+    curl -sN localhost:8780/jobs/<job_id>/events
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import glog as log
+from langchain.globals import set_llm_cache
+from langchain_core.callbacks import BaseCallbackHandler
+
+import chain_utils
+import llm_cache
+import results_db
+import run_chains
+import steam_utils
+
+
+class Job:
+    """A scoring job for one app ID. Progress events are appended as stages start and finish."""
+
+    def __init__(self, app_id):
+        self.job_id = uuid.uuid4().hex
+        self.app_id = app_id
+        self.status = "queued"
+        self.stage = None
+        self.events = []
+        self.result = None
+        self.error = None
+        self.cached = False
+        self.created_at = time.time()
+        self.finished_at = None
+        self.condition = threading.Condition()
+
+    @property
+    def is_finished(self):
+        return self.status in ("done", "failed")
+
+    def add_event(self, event, stage=None, **kwargs):
+        with self.condition:
+            if stage is not None and event == "start":
+                self.stage = stage
+            self.events.append({"time": time.time(), "event": event, "stage": stage, **kwargs})
+            self.condition.notify_all()
+
+    def finish(self, result=None, error=None):
+        with self.condition:
+            self.status = "failed" if error is not None else "done"
+            self.result = result
+            self.error = repr(error) if error is not None else None
+            self.finished_at = time.time()
+            self.events.append({"time": self.finished_at, "event": self.status, "stage": None})
+            self.condition.notify_all()
+
+    def to_dict(self, include_result=True):
+        with self.condition:
+            job = {
+                "job_id": self.job_id,
+                "app_id": self.app_id,
+                "status": self.status,
+                "stage": self.stage,
+                "cached": self.cached,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+                "events": list(self.events),
+                "error": self.error,
+            }
+            if include_result:
+                job["result"] = self.result
+            return job
+
+    def iter_events(self, timeout=15):
+        """Yields progress events as they happen until the job finishes. Yields None as a keepalive when idle."""
+        index = 0
+        while True:
+            with self.condition:
+                if index >= len(self.events) and not self.is_finished:
+                    self.condition.wait(timeout)
+                events = self.events[index:]
+                is_finished = self.is_finished
+            index += len(events)
+            if not events and not is_finished:
+                yield None
+            yield from events
+            if is_finished and index >= len(self.events):
+                return
+
+
+class JobProgress(BaseCallbackHandler):
+    """Callback handler that adds start and end events of the top-level stages (filter, summarization...) to a job."""
+
+    run_inline = True
+
+    def __init__(self, job):
+        super().__init__()
+        self.job = job
+        self._stage_runs = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        stage = (metadata or {}).get("stage")
+        # The first run of a stage is its root, nested runs inherit the stage metadata
+        if stage and stage not in self._stage_runs.values():
+            self._stage_runs[run_id] = stage
+            self.job.add_event("start", stage)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        if run_id in self._stage_runs:
+            self.job.add_event("end", self._stage_runs[run_id])
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        if run_id in self._stage_runs:
+            self.job.add_event("error", self._stage_runs[run_id], error=repr(error))
+
+
+class ScoringService:
+    """
+    Runs scoring jobs on a pool of worker threads with one shared complete chain. At most one job per app ID is
+    queued or running at a time, and the results of finished jobs are reused for freshness_seconds. Like the
+    jobs, at most max_jobs results are kept, and results are dropped once they are past the freshness window.
+    """
+
+    def __init__(
+        self,
+        complete_chain,
+        num_workers=4,
+        freshness_seconds=24 * 3600,
+        max_jobs=10000,
+        results_store=None,
+        results_run_id=None,
+        **run_kwargs,
+    ):
+        self.complete_chain = complete_chain
+        self.freshness_seconds = freshness_seconds
+        self.max_jobs = max_jobs
+        self.results_store = results_store
+        self.results_run_id = results_run_id
+        self.run_kwargs = run_kwargs
+        self._executor = ThreadPoolExecutor(max_workers=num_workers)
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._in_flight = {}
+        # Finished jobs by app ID, in the order they finished
+        self._fresh = OrderedDict()
+
+    def submit(self, app_id, force=False):
+        """
+        Returns the job for app_id: the queued or running one if there is one, a finished job with the cached
+        result if the game was scored within the freshness window (unless force), or a newly queued job.
+        """
+        app_id = str(app_id)
+        with self._lock:
+            job = self._in_flight.get(app_id)
+            if job is not None:
+                return job
+            fresh = self._fresh.get(app_id)
+            if fresh is not None and time.time() - fresh.finished_at >= self.freshness_seconds:
+                del self._fresh[app_id]
+                fresh = None
+            if not force and fresh is not None:
+                job = Job(app_id)
+                job.cached = True
+                job.finish(result=fresh.result)
+                self._add_job(job)
+                return job
+            job = Job(app_id)
+            self._in_flight[app_id] = job
+            self._add_job(job)
+        self._executor.submit(self._run, job)
+        return job
+
+    def _add_job(self, job):
+        self._jobs[job.job_id] = job
+        while len(self._jobs) > self.max_jobs:
+            self._jobs.popitem(last=False)
+
+    def _add_fresh(self, job):
+        self._fresh[job.app_id] = job
+        self._fresh.move_to_end(job.app_id)
+        now = time.time()
+        while self._fresh and (
+            len(self._fresh) > self.max_jobs
+            or now - next(iter(self._fresh.values())).finished_at >= self.freshness_seconds
+        ):
+            self._fresh.popitem(last=False)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job):
+        with job.condition:
+            job.status = "running"
+        try:
+            job.add_event("start", "details")
+            game_details = steam_utils.get_game_details(job.app_id)
+            if not game_details:
+                raise ValueError(f"Failed to fetch game details for app_id={job.app_id}")
+            job.add_event("end", "details")
+            chain_output = run_chains.run_for_app_id(
+                job.app_id, self.complete_chain, callbacks=[JobProgress(job)], **self.run_kwargs
+            )
+            chain_output["name"] = game_details["name"]
+            if self.results_store is not None:
+                result_row = run_chains.make_result_row(job.app_id, game_details, chain_output)
+                self.results_store.upsert(self.results_run_id, [result_row])
+        except Exception as e:
+            log.exception(f"Error scoring app_id={job.app_id}: {e}")
+            with self._lock:
+                self._in_flight.pop(job.app_id, None)
+            job.finish(error=e)
+            return
+        # Finished before it is published as fresh, so that submit always sees its finished_at
+        job.finish(result=chain_output)
+        with self._lock:
+            self._in_flight.pop(job.app_id, None)
+            self._add_fresh(job)
+        log.info(f"Scored app_id={job.app_id} in {job.finished_at - job.created_at:.1f} seconds")
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+            num_cached = len(self._fresh)
+        stats = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+        for job in jobs:
+            stats[job.status] += 1
+        return {"jobs": stats, "cached_results": num_cached}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ScoringServiceHandler(BaseHTTPRequestHandler):
+    service: ScoringService = None
+
+    def log_message(self, format, *args):
+        log.debug(f"{self.address_string()} {format % args}")
+
+    def _send_json(self, status, data):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            self._send_json(404, {"error": "Not Found"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            app_id = str(body["app_id"]).strip()
+            if not app_id.isdigit():
+                raise ValueError(f"Invalid app_id: {app_id}")
+        except Exception as e:
+            self._send_json(400, {"error": f"Expected a JSON body with a numeric app_id: {e}"})
+            return
+        job = self.service.submit(app_id, force=bool(body.get("force", False)))
+        self._send_json(200 if job.cached else 202, job.to_dict())
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path == "/health":
+            self._send_json(200, self.service.stats())
+            return
+        match = re.fullmatch(r"/jobs/([0-9a-f]+)(/events)?", path)
+        job = self.service.get(match.group(1)) if match else None
+        if job is None:
+            self._send_json(404, {"error": "Not Found"})
+            return
+        if not match.group(2):
+            self._send_json(200, job.to_dict())
+            return
+
+        # HTTP/1.0 without a Content-Length, so the stream ends when the connection is closed
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        try:
+            for event in job.iter_events():
+                self.wfile.write(b"\n" if event is None else json.dumps(event).encode() + b"\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def make_server(host, port, service):
+    handler = type("ConfiguredScoringServiceHandler", (ScoringServiceHandler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP service that scores games on request")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8780)
+    parser.add_argument("--workers", type=int, default=4, help="Games scored concurrently")
+    parser.add_argument(
+        "--freshness_hours", type=float, default=24, help="Answer repeated requests from memory for this long"
+    )
+    parser.add_argument("--enable_llm_filter", action="store_true", help="Enable LLM filtering")
+    parser.add_argument("--filter_model", type=str, default="gemini-2.0-flash-lite")
+    parser.add_argument("--summarization_model", type=str, default="gemini-2.0-flash")
+    parser.add_argument("--summarization_batch_size", type=int, default=10, help="Batch size for summarization chain")
+    parser.add_argument("--aggregation_model", type=str, default="gemini-2.0-flash")
+    parser.add_argument("--blurb_model", type=str, default="gemini-2.0-flash-lite")
+    parser.add_argument("--club_reviews_batch_size", type=int, default=4, help="Batch size for club reviews")
+    parser.add_argument("--num_reviews", type=int, default=500, help="Number of reviews to filter")
+    parser.add_argument("--language", type=str, default="english", help="Language for reviews")
+    parser.add_argument("--filter", type=str, default="recent", help="Filter for reviews. Can be 'all' or 'recent'.")
+    parser.add_argument("--cache_db", type=str, default=".llm_cache.db", help="LLM cache database, empty to disable")
+    parser.add_argument("--results_db", type=str, default="juice_results.db", help="Results database, empty to disable")
+    args = parser.parse_args()
+
+    if args.cache_db:
+        set_llm_cache(llm_cache.BoundedSQLiteCache(args.cache_db))
+    complete_chain = chain_utils.make_complete_chain(
+        filter_model=args.filter_model,
+        summarization_model=args.summarization_model,
+        aggregation_model=args.aggregation_model,
+        summarization_batch_size=args.summarization_batch_size,
+        club_reviews_batch_size=args.club_reviews_batch_size,
+        include_llm_filter=args.enable_llm_filter,
+    )
+    store, run_id = None, None
+    if args.results_db:
+        store = results_db.ResultsDB(args.results_db)
+        run_id = f"service_{time.strftime('%Y-%m-%d_%H:%M:%S')}_{uuid.uuid4().hex[:8]}"
+        store.start_run(
+            run_id,
+            "service",
+            {
+                "filter_model": args.filter_model if args.enable_llm_filter else None,
+                "summarization_model": args.summarization_model,
+                "aggregation_model": args.aggregation_model,
+                "blurb_model": args.blurb_model,
+                "num_reviews": args.num_reviews,
+            },
+        )
+    service = ScoringService(
+        complete_chain,
+        num_workers=args.workers,
+        freshness_seconds=args.freshness_hours * 3600,
+        results_store=store,
+        results_run_id=run_id,
+        num_reviews=args.num_reviews,
+        language=args.language,
+        review_filter=args.filter,
+        blurb_model=args.blurb_model,
+    )
+    server = make_server(args.host, args.port, service)
+    log.info(f"Serving scoring service on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.shutdown()
+        server.server_close()
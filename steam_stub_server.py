@@ -0,0 +1,329 @@
+"""
+Local stand-in for the Steam store API, for load and failure testing of the fetch path.
+
+Serves `/appreviews/{app_id}` and `/api/appdetails` from fixture files written by
+`steam_utils.py` (steam_reviews_{app_id}_*.json and steam_details_{app_id}_*.json), and can
+synthesize corpora for unknown app IDs. Pagination follows Steam's cursor semantics: an opaque
+cursor is returned with every page, and once the reviews are exhausted the same cursor is
+returned with an empty page. Latency, 429s, 5xx errors, malformed JSON, repeated cursors and
+empty pages can be injected at configurable rates.
+
+Usage:
+    python3 steam_stub_server.py --fixtures_dir fixtures/ --port 8765 --rate_429 0.02 --rate_5xx 0.01
+    STEAM_STORE_BASE_URL=http://127.0.0.1:8765 python3 run_chains.py --app_id 1245620
+"""
+
+import argparse
+import base64
+import glob
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import glog as log
+
+
+SYNTHETIC_LANGUAGES = ["english"] * 6 + ["schinese", "russian", "spanish", "german"]
+SYNTHETIC_SENTENCES = [
+    "The combat feels weighty and every boss fight taught me something new.",
+    "Exploration is rewarding, there are secrets hidden in almost every corner.",
+    "The world and its lore are told through item descriptions and environments.",
+    "Later areas get grindy and a few dungeons reuse the same layout.",
+    "I died a hundred times and loved every second of the challenge.",
+    "The story did not land for me but the atmosphere is incredible.",
+    "Performance is fine on my machine with a few stutters in big areas.",
+    "Build variety is huge and the upgrade systems are deep.",
+]
+
+
+def encode_cursor(offset):
+    return base64.b64encode(f"offset:{offset}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    if cursor in ("", "*"):
+        return 0
+    try:
+        return int(base64.b64decode(cursor.encode()).decode().split(":", 1)[1])
+    except Exception:
+        return None
+
+
+class FixtureStore:
+    """Holds review and game detail corpora, loaded from fixture files or synthesized on demand."""
+
+    def __init__(self, fixtures_dir="", synthetic_reviews=0, seed=0):
+        self.synthetic_reviews = synthetic_reviews
+        self.seed = seed
+        self.reviews = {}
+        self.details = {}
+        self._lock = threading.Lock()
+        if fixtures_dir:
+            self._load_fixtures(fixtures_dir)
+
+    def _load_fixtures(self, fixtures_dir):
+        for path in glob.glob(os.path.join(fixtures_dir, "steam_reviews_*.json")):
+            app_id = re.match(r"steam_reviews_(\d+)", os.path.basename(path)).group(1)
+            with open(path) as f:
+                self.reviews[app_id] = json.load(f)
+        for path in glob.glob(os.path.join(fixtures_dir, "steam_details_*.json")):
+            app_id = re.match(r"steam_details_(\d+)", os.path.basename(path)).group(1)
+            with open(path) as f:
+                self.details[app_id] = json.load(f)
+        log.info(f"Loaded review fixtures for {len(self.reviews)} and details for {len(self.details)} app IDs")
+
+    def _synthesize_reviews(self, app_id):
+        rng = random.Random(f"{self.seed}:{app_id}")
+        reviews = []
+        for i in range(self.synthetic_reviews):
+            voted_up = rng.random() < 0.8
+            reviews.append(
+                {
+                    "recommendationid": str(int(app_id) * 100000 + i),
+                    "author": {
+                        "steamid": str(76561190000000000 + rng.randrange(10**9)),
+                        "num_reviews": rng.randrange(1, 50),
+                        "playtime_forever": rng.randrange(60, 20000),
+                        "playtime_at_review": rng.randrange(0, 10000),
+                    },
+                    "language": rng.choice(SYNTHETIC_LANGUAGES),
+                    "review": " ".join(rng.sample(SYNTHETIC_SENTENCES, rng.randrange(1, 5))),
+                    "timestamp_created": 1700000000 - i * 3600,
+                    "voted_up": voted_up,
+                    "votes_up": rng.randrange(0, 100),
+                    "votes_funny": rng.randrange(0, 10),
+                    "steam_purchase": True,
+                    "received_for_free": False,
+                    "written_during_early_access": False,
+                }
+            )
+        num_positive = sum(review["voted_up"] for review in reviews)
+        return {
+            "query_summary": {
+                "review_score_desc": "Very Positive",
+                "total_positive": num_positive,
+                "total_negative": len(reviews) - num_positive,
+                "total_reviews": len(reviews),
+            },
+            "reviews": reviews,
+        }
+
+    def get_reviews(self, app_id):
+        with self._lock:
+            if app_id not in self.reviews and self.synthetic_reviews > 0 and app_id.isdigit():
+                self.reviews[app_id] = self._synthesize_reviews(app_id)
+            return self.reviews.get(app_id)
+
+    def get_details(self, app_id):
+        with self._lock:
+            if app_id not in self.details and self.synthetic_reviews > 0 and app_id.isdigit():
+                self.details[app_id] = {
+                    "steam_appid": int(app_id),
+                    "name": f"Synthetic Game {app_id}",
+                    "genres": [{"id": "1", "description": "Action"}],
+                    "metacritic": {"score": 50 + int(app_id) % 50},
+                }
+            return self.details.get(app_id)
+
+
+class FaultConfig:
+    def __init__(
+        self,
+        latency_ms=0,
+        latency_jitter_ms=0,
+        rate_429=0.0,
+        rate_5xx=0.0,
+        rate_malformed=0.0,
+        rate_repeat_cursor=0.0,
+        rate_empty_page=0.0,
+        seed=0,
+    ):
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.rate_malformed = rate_malformed
+        self.rate_repeat_cursor = rate_repeat_cursor
+        self.rate_empty_page = rate_empty_page
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def roll(self, rate):
+        with self._lock:
+            return self._rng.random() < rate
+
+    def choice(self, options):
+        with self._lock:
+            return self._rng.choice(options)
+
+    def sleep(self):
+        with self._lock:
+            jitter = self._rng.uniform(-self.latency_jitter_ms, self.latency_jitter_ms)
+        delay_ms = max(0.0, self.latency_ms + jitter)
+        if delay_ms:
+            time.sleep(delay_ms / 1000)
+
+
+class SteamStubHandler(BaseHTTPRequestHandler):
+    store: FixtureStore = None
+    faults: FaultConfig = None
+    stats: Counter = Counter()
+    stats_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        # Keep per-request logging out of load tests
+        pass
+
+    def _count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def _send(self, status, body, content_type="application/json"):
+        payload = body.encode() if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        self._count(f"status_{status}")
+
+    def _send_json(self, data):
+        if self.faults.roll(self.faults.rate_malformed):
+            self._count("malformed")
+            self._send(200, json.dumps(data)[: -max(1, len(json.dumps(data)) // 3)])
+            return
+        self._send(200, json.dumps(data))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query, keep_blank_values=True).items()}
+        self._count("requests")
+
+        if url.path == "/stats":
+            with self.stats_lock:
+                stats = dict(self.stats)
+            self._send(200, json.dumps(stats))
+            return
+
+        self.faults.sleep()
+        if self.faults.roll(self.faults.rate_429):
+            self._send(429, "Too Many Requests", content_type="text/plain")
+            return
+        if self.faults.roll(self.faults.rate_5xx):
+            self._send(self.faults.choice([500, 502, 503]), "Server Error", content_type="text/plain")
+            return
+
+        match = re.fullmatch(r"/appreviews/(\d+)/?", url.path)
+        if match:
+            self._handle_reviews(match.group(1), query)
+        elif url.path == "/api/appdetails":
+            self._handle_details(query)
+        else:
+            self._send(404, "Not Found", content_type="text/plain")
+
+    def _handle_reviews(self, app_id, query):
+        corpus = self.store.get_reviews(app_id)
+        cursor = query.get("cursor", "*")
+        if corpus is None:
+            self._send_json({"success": 1, "query_summary": {"num_reviews": 0}, "reviews": [], "cursor": cursor})
+            return
+
+        reviews = corpus.get("reviews", [])
+        language = query.get("language", "all")
+        if language != "all":
+            reviews = [review for review in reviews if review.get("language", "english") == language]
+        review_type = query.get("review_type", "all")
+        if review_type in ("positive", "negative"):
+            reviews = [review for review in reviews if review.get("voted_up", True) == (review_type == "positive")]
+
+        offset = decode_cursor(cursor)
+        if offset is None:
+            self._send_json({"success": 2})
+            return
+        num_per_page = max(1, min(int(query.get("num_per_page", 20)), 100))
+
+        if self.faults.roll(self.faults.rate_empty_page):
+            self._count("empty_page")
+            page, next_cursor = [], encode_cursor(offset)
+        elif offset >= len(reviews):
+            # Steam keeps returning the same cursor with no reviews once the end is reached
+            page, next_cursor = [], cursor
+        else:
+            page = reviews[offset : offset + num_per_page]
+            next_cursor = encode_cursor(offset + len(page))
+            if self.faults.roll(self.faults.rate_repeat_cursor):
+                self._count("repeat_cursor")
+                next_cursor = cursor
+
+        query_summary = {"num_reviews": len(page)}
+        if cursor == "*":
+            num_positive = sum(review.get("voted_up", True) for review in reviews)
+            query_summary.update(
+                {
+                    "review_score_desc": corpus.get("query_summary", {}).get("review_score_desc", ""),
+                    "total_positive": num_positive,
+                    "total_negative": len(reviews) - num_positive,
+                    "total_reviews": len(reviews),
+                }
+            )
+        self._send_json({"success": 1, "query_summary": query_summary, "reviews": page, "cursor": next_cursor})
+
+    def _handle_details(self, query):
+        app_id = query.get("appids", "")
+        details = self.store.get_details(app_id)
+        if details is None:
+            self._send_json({app_id: {"success": False}})
+            return
+        self._send_json({app_id: {"success": True, "data": details}})
+
+
+def make_server(host, port, store, faults):
+    handler = type("ConfiguredSteamStubHandler", (SteamStubHandler,), {"store": store, "faults": faults, "stats": Counter()})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Steam store API")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fixtures_dir", type=str, default="", help="Directory with steam_reviews_*/steam_details_* json files")
+    parser.add_argument(
+        "--synthetic_reviews", type=int, default=0, help="Synthesize this many reviews for app IDs without fixtures"
+    )
+    parser.add_argument("--latency_ms", type=float, default=0, help="Mean added latency per request")
+    parser.add_argument("--latency_jitter_ms", type=float, default=0, help="Uniform jitter around the mean latency")
+    parser.add_argument("--rate_429", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--rate_5xx", type=float, default=0.0, help="Fraction of requests answered with a 5xx error")
+    parser.add_argument("--rate_malformed", type=float, default=0.0, help="Fraction of responses with truncated JSON")
+    parser.add_argument(
+        "--rate_repeat_cursor", type=float, default=0.0, help="Fraction of review pages that repeat the request cursor"
+    )
+    parser.add_argument("--rate_empty_page", type=float, default=0.0, help="Fraction of review pages returned empty")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    store = FixtureStore(args.fixtures_dir, synthetic_reviews=args.synthetic_reviews, seed=args.seed)
+    faults = FaultConfig(
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        rate_malformed=args.rate_malformed,
+        rate_repeat_cursor=args.rate_repeat_cursor,
+        rate_empty_page=args.rate_empty_page,
+        seed=args.seed,
+    )
+    server = make_server(args.host, args.port, store, faults)
+    log.info(f"Serving Steam stub on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -7,10 +7,23 @@ import argparse
 import os
 import json
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 
 import glog as log
 
+from review_records import Review, ReviewBatch
+
+# Base URL of the Steam store; point this at steam_stub_server.py for load and failure testing
+STORE_BASE_URL = os.environ.get("STEAM_STORE_BASE_URL", "https://store.steampowered.com")
+REQUEST_TIMEOUT = 30
+
+# Languages used to top up reviews when a game has too few in the requested language. "all" also returns reviews
+# in the requested language again, so listing specific languages wastes fewer pages
+FALLBACK_LANGUAGES = ["all"]
+
 
 def get_game_id_from_url(game_url):
     """
@@ -45,9 +58,9 @@ def get_game_title_from_url(url, replace_underscore=True):
         return ""
 
 
-def get_user_reviews(app_id, language="english", num_per_page=20, filter="recent", review_type="all", purchase_type="all", limit=20):
+def iter_user_review_pages(app_id, language="english", num_per_page=20, filter="recent", review_type="all", purchase_type="all"):
     """
-    Fetches user reviews for a given Steam app ID.
+    Lazily fetches pages of user reviews for a given Steam app ID, following the review cursor.
 
     Args:
         app_id: The ID of the Steam app.
@@ -56,10 +69,10 @@ def get_user_reviews(app_id, language="english", num_per_page=20, filter="recent
         filter: The filter to apply to the reviews (e.g., "recent").
         review_type: The type of reviews to fetch (e.g., "all").
         purchase_type: The type of purchase to filter by (e.g., "all").
-        limit: The maximum number of reviews to fetch.
 
-    Returns:
-        A list of dictionaries containing data about user reviews.
+    Yields:
+        A (reviews, query_summary) tuple for each page. Stops once the cursor stops advancing or a page comes
+        back empty. Request and decoding errors are raised to the caller.
     """
     params = {
         "json": 1,
@@ -70,57 +83,99 @@ def get_user_reviews(app_id, language="english", num_per_page=20, filter="recent
         "review_type": review_type,
         "purchase_type": purchase_type,
     }
-    user_review_url = f"https://store.steampowered.com/appreviews/{app_id}"
-    user_reviews = []
-    reviews_summary = {}
-
-    while len(user_reviews) < limit:
-        try:
-            response = requests.get(user_review_url, params=params)
-            if response.status_code != 200:
-                raise Exception(f"Failed to fetch user reviews. Status code: {response.status_code}")
-
-            response_json = response.json()
-            user_reviews.extend(response_json["reviews"])  # Add each review to the list
+    user_review_url = f"{STORE_BASE_URL}/appreviews/{app_id}"
+    num_fetched = 0
 
-            if not reviews_summary:
-                reviews_summary = {
-                    "review_score_desc": response_json.get("query_summary", {}).get("review_score_desc", ""),
-                    "total_positive": response_json.get("query_summary", {}).get("total_positive", 0),
-                    "total_negative": response_json.get("query_summary", {}).get("total_negative", 0),
-                    "total_reviews": response_json.get("query_summary", {}).get("total_reviews", 0),
-                }
-
-        except requests.exceptions.HTTPError as e:
-            log.exception(f"HTTP error occurred: {e}")
-            log.info(f"Fetched {len(user_reviews)} reviews...")
-            return { "query_summary": {}, "reviews": user_reviews }
-        except json.JSONDecodeError as e:
-            log.exception(f"JSON decoding error occurred: {e}")
-            log.info(f"Fetched {len(user_reviews)} reviews...")
-            return { "query_summary": {}, "reviews": user_reviews }
-        except Exception as e:
-            log.exception(f"An unexpected error occurred: {e}")
-            log.info(f"Fetched {len(user_reviews)} reviews...")
-            return { "query_summary": {}, "reviews": user_reviews }
+    while True:
+        response = requests.get(user_review_url, params=params, timeout=REQUEST_TIMEOUT)
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch user reviews. Status code: {response.status_code}")
 
-        if len(response_json["reviews"]) > 0:
-            log.info(f"Fetched {len(user_reviews)} reviews so far...")
+        response_json = response.json()
+        page_reviews = response_json["reviews"]
+        num_fetched += len(page_reviews)
+        query_summary = {
+            "review_score_desc": response_json.get("query_summary", {}).get("review_score_desc", ""),
+            "total_positive": response_json.get("query_summary", {}).get("total_positive", 0),
+            "total_negative": response_json.get("query_summary", {}).get("total_negative", 0),
+            "total_reviews": response_json.get("query_summary", {}).get("total_reviews", 0),
+        }
+        yield page_reviews, query_summary
+
+        if len(page_reviews) > 0:
+            log.info(f"Fetched {num_fetched} {language} reviews so far...")
 
         new_cursor = response_json.get("cursor", "")
         if new_cursor == params["cursor"]:
-            log.info(f"Found no update in cursor after fetching {len(user_reviews)} reviews")
+            log.info(f"Found no update in cursor after fetching {num_fetched} reviews")
             break
 
         params["cursor"] = new_cursor
         if not params["cursor"]:
-            log.info(f"Reached the end of all reviews after fetching {len(user_reviews)} reviews")
+            log.info(f"Reached the end of all reviews after fetching {num_fetched} reviews")
             break
 
-        if len(response_json["reviews"]) == 0:
-            log.info(f"Got 0 reviews after fetching {len(user_reviews)} reviews, stopping...")
+        if len(page_reviews) == 0:
+            log.info(f"Got 0 reviews after fetching {num_fetched} reviews, stopping...")
             break
-    
+
+
+def get_user_reviews(app_id, language="english", num_per_page=20, filter="recent", review_type="all", purchase_type="all", limit=20, compact=True):
+    """
+    Fetches user reviews for a given Steam app ID.
+
+    Args:
+        app_id: The ID of the Steam app.
+        language: The language of the reviews to fetch (e.g., "english").
+        num_per_page: The number of reviews to fetch per page.
+        filter: The filter to apply to the reviews (e.g., "recent").
+        review_type: The type of reviews to fetch (e.g., "all").
+        purchase_type: The type of purchase to filter by (e.g., "all").
+        limit: The maximum number of reviews to fetch.
+        compact: Whether to keep only the fields the pipeline uses, as a ReviewBatch of Review records,
+            instead of the raw review dicts.
+
+    Returns:
+        A dictionary with the query summary and the fetched reviews.
+    """
+    def _make_result(query_summary, reviews):
+        return {"query_summary": query_summary, "reviews": ReviewBatch(reviews) if compact else reviews}
+
+    user_reviews = []
+    reviews_summary = {}
+    pages = iter_user_review_pages(
+        app_id,
+        language=language,
+        num_per_page=num_per_page,
+        filter=filter,
+        review_type=review_type,
+        purchase_type=purchase_type,
+    )
+
+    try:
+        while len(user_reviews) < limit:
+            page = next(pages, None)
+            if page is None:
+                break
+            page_reviews, query_summary = page
+            if compact:
+                page_reviews = [Review.from_steam(review) for review in page_reviews]
+            user_reviews.extend(page_reviews)  # Add each review to the list
+            if not reviews_summary:
+                reviews_summary = query_summary
+    except requests.exceptions.HTTPError as e:
+        log.exception(f"HTTP error occurred: {e}")
+        log.info(f"Fetched {len(user_reviews)} reviews...")
+        return _make_result({}, user_reviews)
+    except json.JSONDecodeError as e:
+        log.exception(f"JSON decoding error occurred: {e}")
+        log.info(f"Fetched {len(user_reviews)} reviews...")
+        return _make_result({}, user_reviews)
+    except Exception as e:
+        log.exception(f"An unexpected error occurred: {e}")
+        log.info(f"Fetched {len(user_reviews)} reviews...")
+        return _make_result({}, user_reviews)
+
     # Keep only unique reviews from user_reviews
     seen_review_ids = set()
     unique_user_reviews = []
@@ -132,10 +187,98 @@ def get_user_reviews(app_id, language="english", num_per_page=20, filter="recent
 
     if len(unique_user_reviews) < len(user_reviews):
         log.info(f"Removed {len(user_reviews) - len(unique_user_reviews)} duplicate reviews.")
-    return {
-        "query_summary": reviews_summary,
-        "reviews": unique_user_reviews,
-    }
+    return _make_result(reviews_summary, unique_user_reviews)
+
+
+def get_multilingual_user_reviews(app_id, languages=("english", "all"), num_per_page=100, filter="recent", review_type="all", purchase_type="all", limit=200, compact=True):
+    """
+    Fetches up to `limit` user reviews, preferring the first of `languages` and topping up from the others.
+
+    The first page of the preferred language tells how many reviews it has in total. Only if that is short of
+    the limit are the other languages (e.g. "all") fetched, concurrently with the rest of the preferred language
+    and each with its own cursor. Reviews are merged and deduplicated by recommendationid as pages arrive, and
+    fetching stops once the limit is met. Every review keeps the language Steam tagged it with.
+
+    Args:
+        app_id: The ID of the Steam app.
+        languages: Languages to fetch, in order of preference (e.g. ("english", "all")).
+        num_per_page, filter, review_type, purchase_type, compact: Same as for get_user_reviews.
+        limit: The maximum number of reviews to fetch.
+
+    Returns:
+        A dictionary with the query summary of the preferred language and the fetched reviews, preferred
+        language first.
+    """
+    merged_reviews = {language: [] for language in languages}
+    seen_review_ids = set()
+    lock = threading.Lock()
+    preferred_done = threading.Event()
+    stop = threading.Event()
+
+    def _add_page(language, page_reviews):
+        with lock:
+            for review in page_reviews:
+                if review["recommendationid"] not in seen_review_ids:
+                    seen_review_ids.add(review["recommendationid"])
+                    merged_reviews[language].append(Review.from_steam(review) if compact else review)
+            if len(merged_reviews[languages[0]]) >= limit or (
+                preferred_done.is_set() and len(seen_review_ids) >= limit
+            ):
+                stop.set()
+            return len(merged_reviews[language])
+
+    def _fetch(language, pages):
+        try:
+            while not stop.is_set():
+                page = next(pages, None)
+                if page is None or _add_page(language, page[0]) >= limit:
+                    break
+        except Exception as e:
+            log.exception(f"Failed fetching {language} reviews for app_id={app_id}: {e}")
+        finally:
+            pages.close()
+            if language == languages[0]:
+                preferred_done.set()
+                # The other languages may already have filled up the rest while this one was still running
+                _add_page(language, [])
+
+    def _pages(language):
+        return iter_user_review_pages(
+            app_id,
+            language=language,
+            num_per_page=num_per_page,
+            filter=filter,
+            review_type=review_type,
+            purchase_type=purchase_type,
+        )
+
+    preferred_pages = _pages(languages[0])
+    try:
+        first_page_reviews, query_summary = next(preferred_pages)
+    except StopIteration:
+        first_page_reviews, query_summary = [], {}
+    except Exception as e:
+        log.exception(f"Failed fetching {languages[0]} reviews for app_id={app_id}: {e}")
+        first_page_reviews, query_summary = [], {}
+    _add_page(languages[0], first_page_reviews)
+
+    other_languages = list(languages[1:]) if query_summary.get("total_reviews", 0) < limit else []
+    if other_languages:
+        log.info(
+            f"Only {query_summary.get('total_reviews', 0)} {languages[0]} reviews for app_id={app_id}, "
+            f"also fetching {other_languages}"
+        )
+    with ThreadPoolExecutor(max_workers=len(languages)) as executor:
+        executor.submit(_fetch, languages[0], preferred_pages)
+        for language in other_languages:
+            executor.submit(_fetch, language, _pages(language))
+
+    user_reviews = [review for language in languages for review in merged_reviews[language]][:limit]
+    log.info(
+        f"Fetched {len(user_reviews)} reviews for app_id={app_id}: "
+        + ", ".join(f"{len(merged_reviews[language])} via {language}" for language in languages)
+    )
+    return {"query_summary": query_summary, "reviews": ReviewBatch(user_reviews) if compact else user_reviews}
 
 
 def get_game_details(app_id, cc="IN"):
@@ -149,9 +292,9 @@ def get_game_details(app_id, cc="IN"):
     Returns:
         A dictionary containing the game details. Returns an empty dictionary if an error occurs.
     """
-    game_details_url = f"https://store.steampowered.com/api/appdetails?appids={app_id}&cc={cc}"
+    game_details_url = f"{STORE_BASE_URL}/api/appdetails?appids={app_id}&cc={cc}"
     try:
-        response = requests.get(game_details_url)
+        response = requests.get(game_details_url, timeout=REQUEST_TIMEOUT)
         if response.status_code != 200:
             raise Exception("Failed to fetch game details. Status code:", response.status_code)
 
@@ -174,12 +317,14 @@ def get_game_details(app_id, cc="IN"):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Get Steam game details and user reviews.')
     parser.add_argument('--game_url', type=str, default="https://store.steampowered.com/app/730/CounterStrike_Global_Offensive/", help='Steam store url for game')
+    parser.add_argument('--store_base_url', type=str, default=STORE_BASE_URL, help='Base URL of the Steam store API')
     args = parser.parse_args()
+    STORE_BASE_URL = args.store_base_url
 
     game_id = get_game_id_from_url(args.game_url)
     game_title = get_game_title_from_url(args.game_url, replace_underscore=False)
     game_details = get_game_details(game_id)
-    reviews_data = get_user_reviews(game_id, language="english", num_per_page=50, limit=500)
+    reviews_data = get_user_reviews(game_id, language="english", num_per_page=50, limit=500, compact=False)
 
     with open(f"steam_reviews_{game_id}_{game_title}.json", "w") as f:
         json.dump(reviews_data, f, indent=4)
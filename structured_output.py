@@ -0,0 +1,114 @@
+from typing import Any, Dict, List, Optional
+
+from langchain_community.chat_models.openai import ChatOpenAI
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_ollama import ChatOllama
+
+
+JSON_SCHEMA_TYPES = {"string": "string", "integer": "integer", "int": "integer", "float": "number", "number": "number"}
+
+GEMINI_SCHEMA_TYPES = {"string": "STRING", "integer": "INTEGER", "number": "NUMBER", "object": "OBJECT"}
+
+
+def get_json_schema(response_schemas):
+    """Converts the ResponseSchemas of a StructuredOutputParser to a JSON schema of a flat object."""
+    return {
+        "type": "object",
+        "properties": {
+            schema.name: {"type": JSON_SCHEMA_TYPES.get(schema.type, "string"), "description": schema.description}
+            for schema in response_schemas
+        },
+        "required": [schema.name for schema in response_schemas],
+    }
+
+
+def _get_gemini_schema(json_schema):
+    return {
+        "type_": GEMINI_SCHEMA_TYPES[json_schema["type"]],
+        "properties": {
+            name: {"type_": GEMINI_SCHEMA_TYPES[prop["type"]], "description": prop["description"]}
+            for name, prop in json_schema["properties"].items()
+        },
+        "required": json_schema["required"],
+        "property_ordering": list(json_schema["properties"]),
+    }
+
+
+def supports_native_structured_output(llm):
+    return isinstance(llm, (ChatOllama, ChatGoogleGenerativeAI, ChatOpenAI))
+
+
+def shows_schema_to_model(llm):
+    """Whether the provider shows the schema (with its descriptions) to the model, rather than only enforcing it."""
+    return isinstance(llm, (ChatGoogleGenerativeAI, ChatOpenAI))
+
+
+class NativeStructuredChatModel(BaseChatModel):
+    """
+    Wraps a chat model so that every call asks the provider to constrain the response to a JSON schema: the
+    format parameter for Ollama, a response schema for Gemini and a strict json_schema response format for OpenAI.
+    Responses are plain JSON, so the stage's output parser rarely fails and its format instructions can be short
+    (see output_parsers.NativeStructuredOutputParser).
+    """
+
+    llm: BaseChatModel
+    json_schema: Dict[str, Any]
+    schema_name: str
+
+    @property
+    def _llm_type(self) -> str:
+        return "native-structured-chat-model"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {**self.llm._identifying_params, "structured_output": self.schema_name}
+
+    def _get_ls_params(self, stop=None, **kwargs):
+        return self.llm._get_ls_params(stop=stop, **kwargs)
+
+    def _get_provider_kwargs(self):
+        if isinstance(self.llm, ChatOllama):
+            return {"format": self.json_schema}
+        if isinstance(self.llm, ChatGoogleGenerativeAI):
+            return {
+                "generation_config": {
+                    "response_mime_type": "application/json",
+                    "response_schema": _get_gemini_schema(self.json_schema),
+                }
+            }
+        if isinstance(self.llm, ChatOpenAI):
+            return {
+                "response_format": {
+                    "type": "json_schema",
+                    "json_schema": {
+                        "name": self.schema_name,
+                        "strict": True,
+                        "schema": {**self.json_schema, "additionalProperties": False},
+                    },
+                }
+            }
+        raise ValueError(f"Native structured output is not supported for {type(self.llm).__name__}")
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return self.llm._generate(messages, stop=stop, run_manager=run_manager, **self._get_provider_kwargs(), **kwargs)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return await self.llm._agenerate(
+            messages, stop=stop, run_manager=run_manager, **self._get_provider_kwargs(), **kwargs
+        )
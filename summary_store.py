@@ -0,0 +1,45 @@
+import json
+import os
+import time
+
+
+class SummaryStore:
+    """
+    Per-game store of batch summaries and of the review IDs they cover, used by delta runs to only summarize
+    reviews posted since the previous run. Each game is kept in its own JSON file under store_dir.
+    """
+
+    def __init__(self, store_dir="summary_store"):
+        self.store_dir = store_dir
+
+    def _path(self, app_id):
+        return os.path.join(self.store_dir, f"{app_id}.json")
+
+    def load(self, app_id):
+        """Returns the stored record for app_id, or None if the game was never stored."""
+        if not os.path.exists(self._path(app_id)):
+            return None
+        with open(self._path(app_id), "r") as f:
+            return json.load(f)
+
+    def save(self, app_id, batch_summaries, covered_review_ids):
+        """
+        Stores batch summaries (oldest first) and the IDs of all reviews already considered for app_id.
+
+        Args:
+            app_id: The ID of the Steam app.
+            batch_summaries (list): Summarization outputs, oldest first.
+            covered_review_ids (iterable): IDs of reviews that were summarized or filtered out.
+        """
+        os.makedirs(self.store_dir, exist_ok=True)
+        record = {
+            "app_id": str(app_id),
+            "updated_at": time.time(),
+            "batch_summaries": batch_summaries,
+            "covered_review_ids": sorted(covered_review_ids),
+        }
+        # Write to a temporary file first so that a crash never leaves a truncated record behind
+        tmp_path = self._path(app_id) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, self._path(app_id))
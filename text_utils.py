@@ -0,0 +1,94 @@
+import math
+import re
+from collections import Counter
+
+
+BBCODE_LIST_ITEM_RE = re.compile(r"\[\*\]")
+BBCODE_TAG_RE = re.compile(
+    r"\[/?(?:h[1-6]|b|i|u|s|strike|spoiler|noparse|hr|list|olist|quote|code|table|tr|th|td|url|img|previewyoutube)"
+    r"(?:=[^\]]*)?\]",
+    re.IGNORECASE,
+)
+URL_RE = re.compile(r"(?:https?://|www\.)\S+", re.IGNORECASE)
+# Letters and punctuation only, runs of digits are numbers
+REPEATED_CHAR_RE = re.compile(r"([^\W\d_]|[^\w\s])\1{3,}")
+EMOJI_RUN_RE = re.compile(
+    "([\U0001F000-\U0001FAFF☀-➿⬀-⯿])[\U0001F000-\U0001FAFF☀-➿⬀-⯿️‍]+"
+)
+HORIZONTAL_SPACE_RE = re.compile(r"[ \t ⠀]+")
+BLANK_LINES_RE = re.compile(r"\n\s*\n+")
+SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+WORD_RE = re.compile(r"[a-z0-9']+")
+
+# Rough number of characters per token of English text
+CHARS_PER_TOKEN = 4
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from game games has have i if in is it its it's just me my not of on or so "
+    "that the this to was were with you your".split()
+)
+
+
+def approx_token_count(text):
+    """Rough token count for English text (~4 characters per token), used for cost reporting and planning."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def is_ascii_art_line(line, min_length=8, min_alnum_ratio=0.3):
+    """Whether a line is mostly symbols (ASCII/braille art, dividers) rather than text."""
+    stripped = line.strip()
+    if len(stripped) < min_length:
+        return False
+    num_alnum = sum(char.isalnum() for char in stripped)
+    return num_alnum / len(stripped) < min_alnum_ratio
+
+
+def strip_markup_and_noise(text):
+    """
+    Removes Steam BBCode tags, URLs and ASCII-art lines, and collapses runs of repeated characters, emoji and
+    whitespace. The text inside tags (including spoilers) is kept.
+
+    >>> strip_markup_and_noise("[b]Sooooo[/b] good!!!!!!")
+    'Sooo good!!!'
+    >>> strip_markup_and_noise("I played 10000 hours and paid $100000.")
+    'I played 10000 hours and paid $100000.'
+    """
+    text = BBCODE_LIST_ITEM_RE.sub("\n- ", text)
+    text = BBCODE_TAG_RE.sub(" ", text)
+    text = URL_RE.sub("", text)
+    text = "\n".join(line for line in text.split("\n") if not is_ascii_art_line(line))
+    text = REPEATED_CHAR_RE.sub(r"\1\1\1", text)
+    text = EMOJI_RUN_RE.sub(r"\1", text)
+    text = HORIZONTAL_SPACE_RE.sub(" ", text)
+    text = BLANK_LINES_RE.sub("\n\n", text)
+    return "\n".join(line.strip() for line in text.split("\n")).strip()
+
+
+def select_sentences(text, max_words):
+    """
+    Caps a text at roughly max_words words by extractive sentence selection. Sentences are scored by the average
+    in-text frequency of their content words, the first sentence is always kept, and the selected sentences are
+    returned in their original order.
+    """
+    if len(text.split()) <= max_words:
+        return text
+
+    sentences = [sentence.strip() for sentence in SENTENCE_SPLIT_RE.split(text) if sentence.strip()]
+    sentence_words = [
+        [word for word in WORD_RE.findall(sentence.lower()) if word not in STOPWORDS] for sentence in sentences
+    ]
+    word_counts = Counter(word for words in sentence_words for word in words)
+    scores = [sum(word_counts[word] for word in words) / (len(words) + 1) for words in sentence_words]
+
+    selected = {0}
+    num_words = len(sentences[0].split())
+    for i in sorted(range(1, len(sentences)), key=lambda i: scores[i], reverse=True):
+        sentence_length = len(sentences[i].split())
+        if num_words + sentence_length > max_words:
+            continue
+        selected.add(i)
+        num_words += sentence_length
+
+    capped = " ".join(sentences[i] for i in sorted(selected))
+    # A single giant sentence can still exceed the budget
+    return " ".join(capped.split(" ")[:max_words])
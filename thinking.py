@@ -0,0 +1,199 @@
+import math
+from typing import Any, Dict, List, Optional
+
+import glog as log
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from text_utils import CHARS_PER_TOKEN
+
+
+FORCE_ANSWER_PROMPT = (
+    "/no_think Your thinking budget is used up. Stop reasoning and give your final answer now, "
+    "following the format instructions exactly."
+)
+
+
+class _ThinkingStream:
+    """
+    Splits a streamed generation into reasoning (inside the think tags) and answer text. Whether the model is still
+    thinking and the length of its reasoning so far are tracked chunk by chunk, so checking the budget after every
+    chunk stays linear in the generation length.
+    """
+
+    def __init__(self, open_tag, close_tag):
+        self.open_tag = open_tag
+        self.close_tag = close_tag
+        self.is_thinking = True
+        self.reasoning_length = 0
+        self._parts = []
+        # Leading text until it is known whether the generation opens with open_tag
+        self._head = ""
+        self._opened = False
+        # End of the reasoning so far, to find a close tag split over chunks
+        self._tail = ""
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+    @property
+    def reasoning_tokens(self):
+        return math.ceil(self.reasoning_length / CHARS_PER_TOKEN)
+
+    def feed(self, text):
+        self._parts.append(text)
+        if not self.is_thinking:
+            return
+        if not self._opened:
+            self._head = (self._head + text).lstrip()
+            if not self._head.startswith(self.open_tag):
+                self.is_thinking = self.open_tag.startswith(self._head)
+                return
+            self._opened = True
+            text = self._head[len(self.open_tag) :]
+        window = self._tail + text
+        end = window.find(self.close_tag)
+        if end >= 0:
+            self.reasoning_length += end - len(self._tail)
+            self.is_thinking = False
+            return
+        self.reasoning_length += len(text)
+        self._tail = window[max(0, len(window) - len(self.close_tag) + 1) :]
+
+    @property
+    def reasoning(self):
+        stripped = self.text.lstrip()
+        if not stripped.startswith(self.open_tag):
+            return ""
+        return stripped[len(self.open_tag) :].split(self.close_tag, 1)[0]
+
+    @property
+    def answer(self):
+        stripped = self.text.lstrip()
+        if stripped.startswith(self.open_tag):
+            return stripped.split(self.close_tag, 1)[1].strip() if self.close_tag in stripped else ""
+        return stripped
+
+
+class ThinkingBudgetChatModel(BaseChatModel):
+    """
+    Wraps a thinking model (e.g. qwen3) to bound its reasoning. Generations are streamed, and once the reasoning
+    inside the think tags exceeds budget_tokens the stream is closed and the answer is forced with a follow-up
+    request that carries the partial reasoning. The returned message only holds the answer; reasoning_tokens,
+    wasted_reasoning_tokens (reasoning of cut-off streams) and cut_off are set in the generation info.
+    """
+
+    llm: BaseChatModel
+    budget_tokens: int
+    think_open_tag: str = "<think>"
+    think_close_tag: str = "</think>"
+
+    @property
+    def _llm_type(self) -> str:
+        return "thinking-budget-chat-model"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {**self.llm._identifying_params, "thinking_budget_tokens": self.budget_tokens}
+
+    def _get_ls_params(self, stop=None, **kwargs):
+        return self.llm._get_ls_params(stop=stop, **kwargs)
+
+    def _can_stream(self):
+        return type(self.llm)._stream is not BaseChatModel._stream
+
+    def _force_answer_messages(self, messages, reasoning):
+        return list(messages) + [
+            AIMessage(content=f"{self.think_open_tag}{reasoning}{self.think_close_tag}"),
+            HumanMessage(content=FORCE_ANSWER_PROMPT),
+        ]
+
+    def _make_result(self, answer, stream, usage_metadata, cut_off, forced_result=None):
+        reasoning_tokens = stream.reasoning_tokens
+        generation_info = {
+            "reasoning_tokens": reasoning_tokens,
+            "wasted_reasoning_tokens": reasoning_tokens if cut_off else 0,
+            "cut_off": cut_off,
+        }
+        if forced_result is not None:
+            usage_metadata = forced_result.generations[0].message.usage_metadata
+            # With /no_think, qwen3 still opens its answer with an empty think block
+            forced_stream = _ThinkingStream(self.think_open_tag, self.think_close_tag)
+            forced_stream.feed(forced_result.generations[0].message.content)
+            answer = forced_stream.answer
+        message = AIMessage(content=answer, response_metadata=dict(generation_info))
+        if usage_metadata:
+            message.usage_metadata = {
+                "input_tokens": usage_metadata.get("input_tokens", 0),
+                "output_tokens": usage_metadata.get("output_tokens", 0) + (reasoning_tokens if cut_off else 0),
+                "total_tokens": usage_metadata.get("total_tokens", 0) + (reasoning_tokens if cut_off else 0),
+            }
+        return ChatResult(generations=[ChatGeneration(message=message, generation_info=generation_info)])
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if not self._can_stream():
+            return self.llm._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+        stream = _ThinkingStream(self.think_open_tag, self.think_close_tag)
+        usage_metadata = None
+        cut_off = False
+        chunks = self.llm._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+        try:
+            for chunk in chunks:
+                stream.feed(chunk.text)
+                usage_metadata = chunk.message.usage_metadata or usage_metadata
+                if stream.is_thinking and stream.reasoning_tokens > self.budget_tokens:
+                    cut_off = True
+                    break
+        finally:
+            # Closing the stream closes the HTTP response, which stops the server from generating further
+            chunks.close()
+
+        if not cut_off:
+            return self._make_result(stream.answer, stream, usage_metadata, cut_off)
+        log.info(f"Cut off reasoning after ~{stream.reasoning_tokens} tokens, forcing an answer")
+        forced_result = self.llm._generate(
+            self._force_answer_messages(messages, stream.reasoning), stop=stop, run_manager=run_manager, **kwargs
+        )
+        return self._make_result(None, stream, None, cut_off, forced_result=forced_result)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if not self._can_stream():
+            return await self.llm._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+        stream = _ThinkingStream(self.think_open_tag, self.think_close_tag)
+        usage_metadata = None
+        cut_off = False
+        chunks = self.llm._astream(messages, stop=stop, run_manager=run_manager, **kwargs)
+        try:
+            async for chunk in chunks:
+                stream.feed(chunk.text)
+                usage_metadata = chunk.message.usage_metadata or usage_metadata
+                if stream.is_thinking and stream.reasoning_tokens > self.budget_tokens:
+                    cut_off = True
+                    break
+        finally:
+            await chunks.aclose()
+
+        if not cut_off:
+            return self._make_result(stream.answer, stream, usage_metadata, cut_off)
+        log.info(f"Cut off reasoning after ~{stream.reasoning_tokens} tokens, forcing an answer")
+        forced_result = await self.llm._agenerate(
+            self._force_answer_messages(messages, stream.reasoning), stop=stop, run_manager=run_manager, **kwargs
+        )
+        return self._make_result(None, stream, None, cut_off, forced_result=forced_result)
@@ -0,0 +1,288 @@
+import json
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+import glog as log
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import ChatGeneration, LLMResult
+
+
+# Span of the LLM call currently running in this context, so that cache lookups
+# (which happen between on_chat_model_start and on_llm_end) can be attributed to it
+_CURRENT_LLM_SPAN: ContextVar[Optional[Dict[str, Any]]] = ContextVar("_CURRENT_LLM_SPAN", default=None)
+
+
+def record_cache_lookup(hit: bool):
+    """
+    Marks the LLM call running in the current context as a cache hit or miss.
+    Does nothing when no StageTracer is attached to the running chain.
+    """
+    span = _CURRENT_LLM_SPAN.get()
+    if span is not None:
+        span["cache_hit"] = hit
+
+
+class CacheLookupObserverMixin:
+    """Mixin for LangChain caches that reports hits/misses to the active StageTracer."""
+
+    def lookup(self, prompt: str, llm_string: str):
+        cache_val = super().lookup(prompt, llm_string)
+        record_cache_lookup(cache_val is not None)
+        return cache_val
+
+
+def get_stage(metadata):
+    """Returns the stage name a run belongs to, e.g. "aggregation.exploration" for aggregation branches."""
+    metadata = metadata or {}
+    stage = metadata.get("stage")
+    if stage and metadata.get("aspect"):
+        return f"{stage}.{metadata['aspect']}"
+    return stage
+
+
+class StageTracer(BaseCallbackHandler):
+    """
+    Callback handler that records a span for every pipeline stage and every LLM call.
+
+    Stages are identified through the "stage" (and, for aggregation branches, "aspect") metadata
+    keys that chain_utils attaches to each sub-chain, and the app ID through the "app_id" metadata
+    key passed at invoke time.
+    LLM call spans are tagged with stage, model, token usage, latency and cache hits; stage
+    spans additionally roll up retries and the totals of the LLM calls made inside them.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        super().__init__()
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._parents: Dict[UUID, Optional[UUID]] = {}
+        self._stages: Dict[UUID, Optional[str]] = {}
+        self._open_spans: Dict[UUID, Dict[str, Any]] = {}
+
+    def _new_span(self, kind, run_id, parent_run_id, metadata, stage):
+        return {
+            "span_id": str(run_id),
+            "parent_span_id": str(parent_run_id) if parent_run_id else None,
+            "kind": kind,
+            "app_id": (metadata or {}).get("app_id"),
+            "stage": stage,
+            "model": None,
+            "start_time": time.time(),
+            "end_time": None,
+            "latency_s": None,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "total_tokens": 0,
+            "reasoning_tokens": 0,
+            "wasted_reasoning_tokens": 0,
+            "llm_calls": 0,
+            "cache_hits": 0,
+            "cache_hit": False,
+            "retries": 0,
+            "status": "running",
+            "error": None,
+        }
+
+    def _enclosing_stage_span(self, run_id):
+        # Walk up the run tree to the closest run that opened a stage span
+        while run_id is not None:
+            span = self._open_spans.get(run_id)
+            if span is not None and span["kind"] == "stage":
+                return span
+            run_id = self._parents.get(run_id)
+        return None
+
+    def _close_span(self, run_id, error=None):
+        span = self._open_spans.pop(run_id, None)
+        if span is None:
+            return None
+        span["end_time"] = time.time()
+        span["latency_s"] = span["end_time"] - span["start_time"]
+        span["status"] = "error" if error is not None else "ok"
+        span["error"] = repr(error) if error is not None else None
+        self.spans.append(span)
+        return span
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        stage = get_stage(metadata)
+        with self._lock:
+            self._parents[run_id] = parent_run_id
+            self._stages[run_id] = stage
+            if stage and stage != self._stages.get(parent_run_id):
+                self._open_spans[run_id] = self._new_span("stage", run_id, parent_run_id, metadata, stage)
+            if any(tag.startswith("retry:attempt:") for tag in tags or []):
+                stage_span = self._enclosing_stage_span(run_id)
+                if stage_span is not None:
+                    stage_span["retries"] += 1
+
+    def _end_chain(self, run_id, error=None):
+        with self._lock:
+            self._close_span(run_id, error)
+            self._parents.pop(run_id, None)
+            self._stages.pop(run_id, None)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end_chain(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end_chain(run_id, error)
+
+    def _start_llm(self, serialized, run_id, parent_run_id, metadata, kwargs):
+        metadata = metadata or {}
+        with self._lock:
+            self._parents[run_id] = parent_run_id
+            span = self._new_span("llm", run_id, parent_run_id, metadata, get_stage(metadata))
+            invocation_params = kwargs.get("invocation_params") or {}
+            span["model"] = (
+                metadata.get("ls_model_name") or invocation_params.get("model") or invocation_params.get("model_name")
+            )
+            span["llm_calls"] = 1
+            self._open_spans[run_id] = span
+        _CURRENT_LLM_SPAN.set(span)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        self._start_llm(serialized, run_id, parent_run_id, metadata, kwargs)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        self._start_llm(serialized, run_id, parent_run_id, metadata, kwargs)
+
+    @staticmethod
+    def _get_token_usage(response: LLMResult):
+        for generations in response.generations:
+            for generation in generations:
+                if isinstance(generation, ChatGeneration) and generation.message.usage_metadata:
+                    usage = generation.message.usage_metadata
+                    return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        return token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+
+    @staticmethod
+    def _get_answered_by(response: LLMResult):
+        # Set by model_router.RoutedChatModel to the pool member that answered
+        for generations in response.generations:
+            for generation in generations:
+                if (generation.generation_info or {}).get("answered_by"):
+                    return generation.generation_info["answered_by"]
+        return None
+
+    @staticmethod
+    def _get_reasoning_tokens(response: LLMResult):
+        # Set by thinking.ThinkingBudgetChatModel, wasted tokens are the reasoning of streams that were cut off
+        reasoning_tokens, wasted_reasoning_tokens = 0, 0
+        for generations in response.generations:
+            for generation in generations:
+                generation_info = generation.generation_info or {}
+                reasoning_tokens += generation_info.get("reasoning_tokens", 0)
+                wasted_reasoning_tokens += generation_info.get("wasted_reasoning_tokens", 0)
+        return reasoning_tokens, wasted_reasoning_tokens
+
+    def _end_llm(self, run_id, response=None, error=None):
+        with self._lock:
+            span = self._close_span(run_id, error)
+            parent_run_id = self._parents.pop(run_id, None)
+            if span is None:
+                return
+            if response is not None:
+                span["input_tokens"], span["output_tokens"] = self._get_token_usage(response)
+                span["model"] = self._get_answered_by(response) or span["model"]
+                span["total_tokens"] = span["input_tokens"] + span["output_tokens"]
+                span["reasoning_tokens"], span["wasted_reasoning_tokens"] = self._get_reasoning_tokens(response)
+            span["cache_hits"] = int(span["cache_hit"])
+
+            stage_span = self._enclosing_stage_span(parent_run_id)
+            if stage_span is not None:
+                for key in [
+                    "input_tokens",
+                    "output_tokens",
+                    "total_tokens",
+                    "reasoning_tokens",
+                    "wasted_reasoning_tokens",
+                    "llm_calls",
+                    "cache_hits",
+                ]:
+                    stage_span[key] += span[key]
+                stage_span["model"] = stage_span["model"] or span["model"]
+        _CURRENT_LLM_SPAN.set(None)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end_llm(run_id, response=response)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end_llm(run_id, error=error)
+
+    def on_retry(self, retry_state, *, run_id, **kwargs):
+        with self._lock:
+            stage_span = self._enclosing_stage_span(run_id)
+            if stage_span is not None:
+                stage_span["retries"] += 1
+
+    def export_jsonl(self, path):
+        """Appends all finished spans to a JSONL file, one span per line."""
+        with self._lock:
+            spans = list(self.spans)
+        log.info(f"Writing {len(spans)} trace spans to {path}")
+        with open(path, "a") as f:
+            for span in spans:
+                f.write(json.dumps(span) + "\n")
+
+    def export_prometheus(self, path, prefix="juice"):
+        """Writes per-stage and per-model metrics to a file in the Prometheus text exposition format."""
+        with self._lock:
+            spans = list(self.spans)
+
+        # metric name -> (type, help, {label tuple: value})
+        metrics = {
+            "stage_duration_seconds_total": ("counter", "Wall time spent in each stage", defaultdict(float)),
+            "stage_runs_total": ("counter", "Number of stage runs", defaultdict(float)),
+            "stage_errors_total": ("counter", "Number of failed stage runs", defaultdict(float)),
+            "stage_retries_total": ("counter", "Number of retried attempts inside each stage", defaultdict(float)),
+            "llm_requests_total": ("counter", "Number of LLM calls", defaultdict(float)),
+            "llm_errors_total": ("counter", "Number of failed LLM calls", defaultdict(float)),
+            "llm_latency_seconds_total": ("counter", "Total latency of LLM calls", defaultdict(float)),
+            "llm_cache_hits_total": ("counter", "Number of LLM calls served from the cache", defaultdict(float)),
+            "llm_tokens_total": ("counter", "Tokens used by LLM calls that missed the cache", defaultdict(float)),
+            "llm_reasoning_tokens_total": ("counter", "Reasoning tokens of thinking models", defaultdict(float)),
+            "llm_wasted_reasoning_tokens_total": (
+                "counter",
+                "Reasoning tokens of thinking models that were cut off at their budget",
+                defaultdict(float),
+            ),
+        }
+        for span in spans:
+            stage = span["stage"] or "unknown"
+            if span["kind"] == "stage":
+                app_labels = (("app_id", span["app_id"] or ""), ("stage", stage))
+                metrics["stage_duration_seconds_total"][2][app_labels] += span["latency_s"]
+                metrics["stage_runs_total"][2][(("stage", stage),)] += 1
+                metrics["stage_errors_total"][2][(("stage", stage),)] += span["status"] == "error"
+                metrics["stage_retries_total"][2][(("stage", stage),)] += span["retries"]
+                continue
+
+            labels = (("stage", stage), ("model", span["model"] or "unknown"))
+            metrics["llm_requests_total"][2][labels] += 1
+            metrics["llm_errors_total"][2][labels] += span["status"] == "error"
+            metrics["llm_latency_seconds_total"][2][labels] += span["latency_s"]
+            metrics["llm_cache_hits_total"][2][labels] += span["cache_hit"]
+            if not span["cache_hit"]:
+                metrics["llm_tokens_total"][2][labels + (("direction", "input"),)] += span["input_tokens"]
+                metrics["llm_tokens_total"][2][labels + (("direction", "output"),)] += span["output_tokens"]
+                metrics["llm_reasoning_tokens_total"][2][labels] += span["reasoning_tokens"]
+                metrics["llm_wasted_reasoning_tokens_total"][2][labels] += span["wasted_reasoning_tokens"]
+
+        lines = []
+        for name, (metric_type, help_text, values) in metrics.items():
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {metric_type}")
+            for labels, value in sorted(values.items()):
+                label_text = ",".join(f'{key}="{str(val)}"' for key, val in labels)
+                lines.append(f"{prefix}_{name}{{{label_text}}} {float(value)}")
+
+        log.info(f"Writing metrics for {len(spans)} trace spans to {path}")
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")